@@ -1,86 +1,419 @@
 # Local Backend code for Dashboard Analytics
 
-from flask import Flask, jsonify, render_template_string
+from flask import Flask, jsonify, render_template_string, request, Response, stream_with_context
 from flask_cors import CORS
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
 import json
 from collections import defaultdict, Counter
 import os
-from boto3.dynamodb.conditions import Key, Attr
+import heapq
+import math
+import hashlib
+import threading
+import time
+import queue
+from array import array
+from boto3.dynamodb.conditions import Key, ConditionExpressionBuilder
 
 app = Flask(__name__)
 CORS(app)  # enable CORS for frontend access
 
+# DynamoDB wire format (the same codec as in lambda_function.py, which is deployed as a single file)
+#
+# Items are read and written through the low-level client and converted in one
+# pass between wire format ({'N': '42'}, {'M': {...}}) and plain Python values,
+# instead of the resource layer's Decimals plus a second pass to undo them.
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+_FROM_WIRE = {
+    'S': lambda v: v,
+    'N': _number,
+    'BOOL': lambda v: v,
+    'NULL': lambda v: None,
+    'B': lambda v: v,
+    'SS': set,
+    'NS': lambda v: {_number(n) for n in v},
+    'BS': set,
+    'L': lambda v: [from_wire(x) for x in v],
+    'M': lambda v: {k: from_wire(x) for k, x in v.items()},
+}
+
+def from_wire(value):
+    """One wire-format attribute value as int/float/str/bool/None/bytes/list/dict/set"""
+    for tag, raw in value.items():
+        return _FROM_WIRE[tag](raw)
+
+def to_wire(value):
+    """One Python value as a wire-format attribute value"""
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {k: to_wire(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [to_wire(v) for v in value]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(v, str) for v in value):
+            return {'SS': list(value)}
+        if all(isinstance(v, (bytes, bytearray)) for v in value):
+            return {'BS': [bytes(v) for v in value]}
+        return {'NS': [str(v) for v in value]}
+    raise TypeError(f"Cannot store {type(value).__name__} in DynamoDB")
+
+def item_from_wire(item):
+    return {name: from_wire(value) for name, value in item.items()}
+
+def item_to_wire(item):
+    return {name: to_wire(value) for name, value in item.items()}
+
+def item_decoder(schema):
+    """Decoder for items of a known shape; `schema` maps attribute names to wire types.
+
+    Attributes in the schema are read with their tag directly instead of being
+    dispatched on; anything else, or a value whose type differs, goes through
+    from_wire.
+    """
+    readers = {name: (tag, _FROM_WIRE[tag]) for name, tag in schema.items()}
+    def decode(item):
+        native = {}
+        for name, value in item.items():
+            reader = readers.get(name)
+            if reader is not None and reader[0] in value:
+                native[name] = reader[1](value[reader[0]])
+            else:
+                native[name] = from_wire(value)
+        return native
+    return decode
+
+class NativeTable:
+    """One table on the low-level DynamoDB client, called like a resource Table.
+
+    Keys, items and expression values go in as plain Python values and items
+    come back as plain Python values, with numbers as int or float rather
+    than Decimal. Key() and Attr() conditions are accepted as with the
+    resource. LastEvaluatedKey is returned native and ExclusiveStartKey is
+    taken native, so pagination loops work unchanged.
+    """
+    CONDITIONS = ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression')
+
+    def __init__(self, client, name, schema=None):
+        self.client = client
+        self.name = name
+        self.decode = item_decoder(schema) if schema else item_from_wire
+
+    def encode_request(self, kwargs):
+        kwargs['TableName'] = self.name
+        builder = ConditionExpressionBuilder()
+        for parameter in self.CONDITIONS:
+            condition = kwargs.get(parameter)
+            if condition is not None and not isinstance(condition, str):
+                built = builder.build_expression(condition, is_key_condition=parameter == 'KeyConditionExpression')
+                kwargs[parameter] = built.condition_expression
+                # copied so a caller reusing its kwargs across pages is not modified
+                kwargs['ExpressionAttributeNames'] = {
+                    **kwargs.get('ExpressionAttributeNames', {}), **built.attribute_name_placeholders
+                }
+                kwargs['ExpressionAttributeValues'] = {
+                    **kwargs.get('ExpressionAttributeValues', {}), **built.attribute_value_placeholders
+                }
+        for parameter in ('Key', 'Item', 'ExclusiveStartKey', 'ExpressionAttributeValues'):
+            if parameter in kwargs:
+                kwargs[parameter] = item_to_wire(kwargs[parameter])
+        return kwargs
+
+    def decode_response(self, response):
+        if 'Item' in response:
+            response['Item'] = self.decode(response['Item'])
+        if 'Items' in response:
+            response['Items'] = [self.decode(item) for item in response['Items']]
+        if 'Attributes' in response:
+            response['Attributes'] = self.decode(response['Attributes'])
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = item_from_wire(response['LastEvaluatedKey'])
+        return response
+
+    def get_item(self, **kwargs):
+        return self.decode_response(self.client.get_item(**self.encode_request(kwargs)))
+
+    def put_item(self, **kwargs):
+        return self.decode_response(self.client.put_item(**self.encode_request(kwargs)))
+
+    def update_item(self, **kwargs):
+        return self.decode_response(self.client.update_item(**self.encode_request(kwargs)))
+
+    def delete_item(self, **kwargs):
+        return self.decode_response(self.client.delete_item(**self.encode_request(kwargs)))
+
+    def query(self, **kwargs):
+        return self.decode_response(self.client.query(**self.encode_request(kwargs)))
+
+    def scan(self, **kwargs):
+        return self.decode_response(self.client.scan(**self.encode_request(kwargs)))
+
 # initialize DynamoDB
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1') 
-user_profiles_table = dynamodb.Table('VirtualAssistant-UserProfiles')
-conversation_history_table = dynamodb.Table('VirtualAssistant-ConversationHistory')
-usage_analytics_table = dynamodb.Table('VirtualAssistant-UsageAnalytics')
+dynamodb_client = boto3.client('dynamodb', region_name='us-east-1')
+user_profiles_table = NativeTable(dynamodb_client, 'VirtualAssistant-UserProfiles', {'user_id': 'S'})
+conversation_history_table = NativeTable(dynamodb_client, 'VirtualAssistant-ConversationHistory', {
+    'user_id': 'S', 'timestamp': 'S', 'date': 'S', 'intent_name': 'S', 'request_type': 'S', 'utterance': 'S'
+})
+usage_analytics_table = NativeTable(dynamodb_client, 'VirtualAssistant-UsageAnalytics', {'metric_type': 'S', 'count': 'N'})
+user_stats_table = NativeTable(dynamodb_client, 'VirtualAssistant-UserStats', {
+    'user_id': 'S', 'name': 'S', 'conversation_count': 'N', 'friends_count': 'N'
+})
+analytics_rollups_table = NativeTable(dynamodb_client, 'VirtualAssistant-AnalyticsRollups', {
+    'period': 'S', 'requests': 'N', 'registers': 'B'
+})
+cost_metrics_table = NativeTable(dynamodb_client, 'VirtualAssistant-CostMetrics', {
+    'bucket_name': 'S', 'date': 'S', 'timestamp': 'S', 'object_count': 'N', 'total_size_bytes': 'N'
+})
+
+# GSI on ConversationHistory: partition 'date', sort 'timestamp'
+CONVERSATION_DATE_INDEX = 'date-timestamp-index'
+
+# bucket inspection fans out over a bounded pool with per-call timeouts
+S3_INSPECT_WORKERS = int(os.environ.get('S3_INSPECT_WORKERS', '8'))
+S3_BUCKET_TIMEOUT = float(os.environ.get('S3_BUCKET_TIMEOUT', '5'))
+S3_PANEL_TIMEOUT = float(os.environ.get('S3_PANEL_TIMEOUT', '10'))
 
 # initialize S3
-s3_client = boto3.client('s3', region_name='us-east-1')
+s3_client = boto3.client(
+    's3',
+    region_name='us-east-1',
+    config=Config(
+        connect_timeout=S3_BUCKET_TIMEOUT,
+        read_timeout=S3_BUCKET_TIMEOUT,
+        retries={'max_attempts': 2},
+        max_pool_connections=S3_INSPECT_WORKERS
+    )
+)
+s3_executor = ThreadPoolExecutor(max_workers=S3_INSPECT_WORKERS, thread_name_prefix='s3-inspect')
 
-class DashboardAnalytics:
-    @staticmethod
-    def decimal_to_native(obj):
-        """Convert Decimal objects to native Python types for JSON serialization"""
-        if isinstance(obj, list):
-            return [DashboardAnalytics.decimal_to_native(i) for i in obj]
-        elif isinstance(obj, dict):
-            return {k: DashboardAnalytics.decimal_to_native(v) for k, v in obj.items()}
-        elif isinstance(obj, Decimal):
-            return int(obj) if obj % 1 == 0 else float(obj)
-        else:
-            return obj
+# counters the skill adds to each 'timing#<period>' rollup for the invocations it timed
+TIMING_COUNTERS = (
+    'timed_requests', 'duration_ms', 'cpu_ms', 'cold_starts', 'memory_mb', 'memory_limit_mb',
+    'dynamodb_calls', 'dynamodb_ms', 's3_calls', 's3_ms'
+)
 
-    @staticmethod
-    def get_total_requests():
-        """Get total requests from analytics table"""
-        try:
-            response = usage_analytics_table.scan(
-                FilterExpression=Attr('metric_type').eq('total_requests')
+# distinct users per hour are HyperLogLog sketches on 'users#<period>' rollup items
+HLL_PRECISION = 10  # must match HLL_PRECISION in lambda_function.py
+
+def hll_estimate(registers):
+    """Distinct count from HyperLogLog registers, with linear counting for small sets"""
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -rank for rank in registers)
+    empty = registers.count(0)
+    if estimate <= 2.5 * m and empty:
+        estimate = m * math.log(m / empty)
+    return int(round(estimate))
+
+def histogram_percentile(buckets, fraction):
+    """Latency at `fraction` of a {upper bound ms: count} histogram, interpolated within its bucket"""
+    total = sum(buckets.values())
+    if not total:
+        return 0
+    rank = fraction * total
+    seen = 0
+    lower = 0
+    for bound in sorted(buckets):
+        count = buckets[bound]
+        if count and seen + count >= rank:
+            if bound == float('inf'):
+                return lower
+            return round(lower + (bound - lower) * (rank - seen) / count, 1)
+        seen += count
+        lower = bound
+    return lower
+
+# how often the background refresher wakes up to rebuild due payloads
+DASHBOARD_REFRESH_TICK = float(os.environ.get('DASHBOARD_REFRESH_TICK', '1'))
+# refresh interval of the combined payload while stream clients are connected
+DASHBOARD_STREAM_INTERVAL = float(os.environ.get('DASHBOARD_STREAM_INTERVAL', '5'))
+
+class DashboardSnapshot:
+    """A single read of each source the dashboard needs, shared by every panel.
+
+    Sources are fetched lazily and at most once per snapshot, so an endpoint
+    only pays for the tables its panels use and /api/dashboard/all pays for
+    each table once. Rollup and per-user rows are unpacked into parallel
+    arrays the first time they are read.
+    """
+    def __init__(self, recent_limit=15):
+        self.recent_limit = recent_limit
+        self.now = datetime.now(timezone.utc)
+        self.hour_periods = [
+            f"hour#{(self.now - timedelta(hours=offset)).strftime('%Y-%m-%dT%H')}"
+            for offset in range(23, -1, -1)
+        ]
+        self._sources = {}
+
+    def _source(self, name, loader):
+        if name not in self._sources:
+            self._sources[name] = loader()
+        return self._sources[name]
+
+    def preload(self, name, value):
+        """Use an already built value for a source instead of reading it again"""
+        self._sources[name] = value
+
+    # sources
+
+    def rollups(self):
+        """Last 24 hourly rollups plus the all-time item, as columns.
+
+        The skill's timing counters (on 'timing#<period>' items) are summed over
+        the 24 hours and its latency_<intent>_<bound> attributes merged into one
+        histogram per intent.
+        """
+        def load():
+            items = DashboardAnalytics.get_rollups(
+                self.hour_periods
+                + [f'{kind}#{period}' for kind in ('users', 'timing') for period in self.hour_periods]
+                + ['all']
             )
-            total = sum(item.get('count', 0) for item in response['Items'])
-            return int(total)
+            hourly_requests = array('q')
+            hourly_users = []
+            timing = dict.fromkeys(TIMING_COUNTERS, 0)
+            latency = defaultdict(lambda: defaultdict(int))
+            for period in self.hour_periods:
+                item = items.get(period, {})
+                hourly_requests.append(int(item.get('requests', 0)))
+                hourly_users.append(items.get(f'users#{period}', {}).get('registers', b''))
+                for attribute, value in items.get(f'timing#{period}', {}).items():
+                    if attribute in timing:
+                        timing[attribute] += value
+                    elif attribute.startswith('latency_'):
+                        intent, bound = attribute[len('latency_'):].rsplit('_', 1)
+                        latency[intent][float(bound)] += value
+            all_time = items.get('all', {})
+            intents = {
+                attribute[len('intent_'):]: int(value)
+                for attribute, value in all_time.items()
+                if attribute.startswith('intent_')
+            }
+            return {
+                'hourly_requests': hourly_requests, 'hourly_users': hourly_users, 'intents': intents,
+                'total_requests': int(all_time.get('requests', 0)), 'timing': timing, 'latency': latency
+            }
+        return self._source('rollups', load)
+
+    def usage(self):
+        """errors counter, summed from its own partition (one row per day)"""
+        def load():
+            totals = {'errors': 0}
+            query_kwargs = {
+                'KeyConditionExpression': Key('metric_type').eq('errors'),
+                'ProjectionExpression': '#count',
+                'ExpressionAttributeNames': {'#count': 'count'}
+            }
+            while True:
+                response = usage_analytics_table.query(**query_kwargs)
+                totals['errors'] += sum(int(item.get('count', 0)) for item in response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    return totals
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return self._source('usage', load)
+
+    def user_stats(self):
+        """Per-user counters as parallel columns"""
+        def load():
+            columns = {'user_id': [], 'name': [], 'interactions': array('q'), 'friends': array('q')}
+            scan_kwargs = {
+                'ProjectionExpression': 'user_id, conversation_count, friends_count, #name',
+                'ExpressionAttributeNames': {'#name': 'name'}
+            }
+            while True:
+                response = user_stats_table.scan(**scan_kwargs)
+                for item in response['Items']:
+                    columns['user_id'].append(item['user_id'])
+                    columns['name'].append(item.get('name'))
+                    columns['interactions'].append(int(item.get('conversation_count', 0)))
+                    columns['friends'].append(int(item.get('friends_count', 0)))
+                if 'LastEvaluatedKey' not in response:
+                    return columns
+                scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return self._source('user_stats', load)
+
+    def recent_rows(self):
+        """Newest conversations from the date index, today's partition first"""
+        def load():
+            items = []
+            day = datetime.now(timezone.utc)
+            for _ in range(2):
+                response = conversation_history_table.query(
+                    IndexName=CONVERSATION_DATE_INDEX,
+                    KeyConditionExpression=Key('date').eq(day.strftime('%Y-%m-%d')),
+                    ScanIndexForward=False,
+                    Limit=self.recent_limit - len(items)
+                )
+                items.extend(response['Items'])
+                if len(items) >= self.recent_limit:
+                    break
+                day -= timedelta(days=1)
+            return items
+        return self._source('recent_rows', load)
+
+    def profiles(self):
+        def load():
+            items = []
+            scan_kwargs = {'ProjectionExpression': 'user_id, friends'}
+            while True:
+                response = user_profiles_table.scan(**scan_kwargs)
+                items.extend(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    return items
+                scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return self._source('profiles', load)
+
+    def buckets(self):
+        return self._source('buckets', lambda: s3_client.list_buckets().get('Buckets', []))
+
+    # panels
+
+    def total_requests(self):
+        try:
+            # the all-time rollup counts every logged request
+            return self.rollups()['total_requests']
         except Exception as e:
             print(f"Error getting total requests: {e}")
             return 0
 
-    @staticmethod
-    def get_active_users_count():
-        """Get count of users who interacted in the last 24 hours"""
+    def active_users(self):
         try:
-            yesterday = (datetime.now() - timedelta(days=1)).isoformat()
-            
-            
-            response = conversation_history_table.scan(
-                FilterExpression=Attr('timestamp').gte(yesterday)
-            )
-            
-            unique_users = set()
-            for item in response['Items']:
-                unique_users.add(item['user_id'])
-            
-            return len(unique_users)
+            # the union of the hourly sketches is their register-wise maximum
+            merged = bytearray(1 << HLL_PRECISION)
+            for registers in self.rollups()['hourly_users']:
+                for index, rank in enumerate(registers):
+                    if rank > merged[index]:
+                        merged[index] = rank
+            return hll_estimate(merged)
         except Exception as e:
             print(f"Error getting active users: {e}")
             return 0
 
-    @staticmethod
-    def get_total_friends():
-        """Get total number of friends from a specific user"""
+    def total_friends(self):
         try:
-            
-            response = user_profiles_table.scan()
-            
-            if not response['Items']:
+            profiles = self.profiles()
+            if not profiles:
                 return 0
             
-            
-            sorted_users = sorted(response['Items'], key=lambda x: x['user_id'])
-            
+            sorted_users = sorted(profiles, key=lambda x: x['user_id'])
             
             if len(sorted_users) >= 2:
                 target_user = sorted_users[1] 
@@ -89,61 +422,68 @@ class DashboardAnalytics:
             
             friends = target_user.get('friends', [])
             return len(friends) if friends else 0
-            
         except Exception as e:
             print(f"Error getting total friends: {e}")
             return 0
 
-    @staticmethod
-    def get_s3_bucket_count():
-        """Get total number of S3 buckets"""
+    def s3_bucket_count(self):
         try:
-            response = s3_client.list_buckets()
-            bucket_count = len(response.get('Buckets', []))
-            return bucket_count
+            return len(self.buckets())
         except Exception as e:
             print(f"Error getting S3 bucket count: {e}")
             return 0
 
-    @staticmethod
-    def get_s3_bucket_details():
-        """Get detailed information about S3 buckets"""
+    def s3_bucket_details(self):
+        # per-bucket listings are the slowest source, so the panel is built once per snapshot
+        return self._source('s3_details', self._load_s3_bucket_details)
+
+    def _load_s3_bucket_details(self):
         try:
-            response = s3_client.list_buckets()
-            buckets = response.get('Buckets', [])
+            buckets = self.buckets()
+            
+            # buckets are inspected in parallel; the panel waits at most S3_PANEL_TIMEOUT
+            futures = {
+                s3_executor.submit(DashboardAnalytics.inspect_bucket, bucket['Name']): bucket
+                for bucket in buckets
+            }
+            done, _ = wait(futures, timeout=S3_PANEL_TIMEOUT)
             
             bucket_details = []
             total_objects = 0
             total_size = 0
+            partial = False
             
-            for bucket in buckets:
+            for future, bucket in futures.items():
                 bucket_name = bucket['Name']
                 created_date = bucket['CreationDate'].isoformat() if bucket.get('CreationDate') else 'Unknown'
-                
-                try:
-                    objects_response = s3_client.list_objects_v2(Bucket=bucket_name, MaxKeys=1000)
-                    object_count = objects_response.get('KeyCount', 0)
-                    total_objects += object_count
-                    bucket_size = 0  
-                    total_size += bucket_size
-                    
-                except Exception as bucket_error:
-                    print(f"Error getting details for bucket {bucket_name}: {bucket_error}")
-                    object_count = 0
-                    bucket_size = 0
-                
-                bucket_details.append({
+                detail = {
                     'name': bucket_name,
                     'created_date': created_date,
-                    'object_count': object_count,
-                    'size': bucket_size
-                })
+                    'object_count': 0,
+                    'size': 0,
+                    'status': 'ok'
+                }
+                
+                if future not in done:
+                    detail['status'] = 'timeout'
+                elif future.exception():
+                    print(f"Error getting details for bucket {bucket_name}: {future.exception()}")
+                    detail['status'] = 'error'
+                    detail['error'] = str(future.exception())
+                else:
+                    detail.update(future.result())
+                    total_objects += detail['object_count']
+                    total_size += detail['size']
+                partial = partial or detail['status'] != 'ok'
+                
+                bucket_details.append(detail)
             
             return {
                 'buckets': bucket_details,
                 'total_buckets': len(buckets),
                 'total_objects': total_objects,
-                'total_size': total_size
+                'total_size': total_size,
+                'partial': partial
             }
         except Exception as e:
             print(f"Error getting S3 bucket details: {e}")
@@ -154,24 +494,39 @@ class DashboardAnalytics:
                 'total_size': 0
             }
 
-    @staticmethod
-    def get_average_response_time():
-        """Simulate average response time (you can implement actual timing logic)"""
-        return 245  
+    def average_response_time(self):
+        """Mean skill response time in ms over the last 24 hours"""
+        try:
+            timing = self.rollups()['timing']
+            if not timing['timed_requests']:
+                return 0
+            return round(timing['duration_ms'] / timing['timed_requests'])
+        except Exception as e:
+            print(f"Error getting average response time: {e}")
+            return 0
 
-    @staticmethod
-    def get_recent_activity(limit=10):
-        """Get recent conversations"""
+    def latency_by_intent(self):
+        """p50/p95/p99 skill response time per intent over the last 24 hours, busiest first"""
+        try:
+            latency = self.rollups()['latency']
+            percentiles = {
+                intent: {
+                    'count': sum(buckets.values()),
+                    'p50': histogram_percentile(buckets, 0.50),
+                    'p95': histogram_percentile(buckets, 0.95),
+                    'p99': histogram_percentile(buckets, 0.99)
+                }
+                for intent, buckets in latency.items()
+            }
+            return dict(sorted(percentiles.items(), key=lambda entry: -entry[1]['count']))
+        except Exception as e:
+            print(f"Error getting latency by intent: {e}")
+            return {}
+
+    def recent_activity(self, limit=10):
         try:
-            
-            response = conversation_history_table.scan()
-            
-            items = response['Items']
-            
-            items.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            
             activities = []
-            for item in items[:limit]:
+            for item in self.recent_rows()[:limit]:
                 activities.append({
                     'intent': item.get('intent_name', 'Unknown'),
                     'user': item.get('user_id', 'Unknown')[-3:],  
@@ -179,34 +534,18 @@ class DashboardAnalytics:
                     'details': item.get('utterance', 'No details'),
                     'request_type': item.get('request_type', 'Unknown')
                 })
-            
             return activities
         except Exception as e:
             print(f"Error getting recent activity: {e}")
             return []
 
-    @staticmethod
-    def get_requests_over_time():
-        """Get request counts over time (last 24 hours, grouped by hour)"""
+    def requests_over_time(self):
         try:
+            hourly_requests = self.rollups()['hourly_requests']
             
-            yesterday = datetime.now() - timedelta(days=1)
-            response = conversation_history_table.scan(
-                FilterExpression=Attr('timestamp').gte(yesterday.isoformat())
-            )
-            
-           
             hourly_counts = defaultdict(int)
-            for item in response['Items']:
-                timestamp_str = item.get('timestamp', '')
-                if timestamp_str:
-                    try:
-                        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                        hour_key = timestamp.strftime('%H:00')
-                        hourly_counts[hour_key] += 1
-                    except:
-                        continue
-            
+            for period, requests in zip(self.hour_periods, hourly_requests):
+                hourly_counts[f"{period[-2:]}:00"] += requests
             
             timeline = []
             for hour in range(24):
@@ -215,181 +554,480 @@ class DashboardAnalytics:
                     'time': hour_str,
                     'requests': hourly_counts.get(hour_str, 0)
                 })
-            
             return timeline
         except Exception as e:
             print(f"Error getting requests over time: {e}")
             return []
 
-    @staticmethod
-    def get_intent_distribution():
-        """Get distribution of different intents"""
+    def intent_distribution(self):
         try:
-            response = conversation_history_table.scan()
-            
-            intent_counts = Counter()
-            for item in response['Items']:
-                intent_name = item.get('intent_name', 'Unknown')
-                intent_counts[intent_name] += 1
-            
-            return dict(intent_counts)
+            return dict(self.rollups()['intents'])
         except Exception as e:
             print(f"Error getting intent distribution: {e}")
             return {}
 
-    @staticmethod
-    def get_top_users(limit=5):
-        """Get top users by interaction count"""
+    def top_users(self, limit=5):
         try:
-            
-            response = conversation_history_table.scan()
-            
-            user_stats = defaultdict(lambda: {'interactions': 0, 'friends': 0, 'name': 'Unknown'})
-            
-            
-            for item in response['Items']:
-                user_id = item.get('user_id', 'Unknown')
-                user_stats[user_id]['interactions'] += 1
-            
-            
-            profiles_response = user_profiles_table.scan()
-            for profile in profiles_response['Items']:
-                user_id = profile['user_id']
-                if user_id in user_stats:
-                    user_stats[user_id]['friends'] = len(profile.get('friends', []))
-                    user_stats[user_id]['name'] = profile.get('name', f'User-{user_id[-3:]}')
-            
-            
-            sorted_users = sorted(
-                user_stats.items(), 
-                key=lambda x: x[1]['interactions'], 
-                reverse=True
-            )
+            columns = self.user_stats()
+            interactions = columns['interactions']
+            top_rows = heapq.nlargest(limit, range(len(interactions)), key=interactions.__getitem__)
             
             top_users = []
-            for user_id, stats in sorted_users[:limit]:
+            for row in top_rows:
                 top_users.append({
-                    'name': stats['name'],
-                    'interactions': stats['interactions'],
-                    'friends': stats['friends']
+                    'name': columns['name'][row] or f"User-{columns['user_id'][row][-3:]}",
+                    'interactions': interactions[row],
+                    'friends': columns['friends'][row]
                 })
-            
             return top_users
         except Exception as e:
             print(f"Error getting top users: {e}")
             return []
 
-    @staticmethod
-    def get_system_health():
-        """Get system health metrics"""
+    def system_health(self):
         try:
-            
-            response = usage_analytics_table.scan(
-                FilterExpression=Attr('metric_type').begins_with('error_')
-            )
-            
-            total_errors = sum(item.get('count', 0) for item in response['Items'])
-            total_requests = DashboardAnalytics.get_total_requests()
+            total_errors = self.usage()['errors']
+            total_requests = self.total_requests()
             
             success_rate = 100
             if total_requests > 0:
                 success_rate = max(0, 100 - (total_errors / total_requests * 100))
             
+            # CPU is the share of handler wall time spent on CPU; memory is peak RSS against the configured limit
+            timing = self.rollups()['timing']
+            timed = timing['timed_requests']
             return {
-                'cpu_usage': 35,  
-                'memory_usage': 60,  
-                'api_success_rate': round(success_rate, 1)
+                'cpu_usage': round(min(100, timing['cpu_ms'] / timing['duration_ms'] * 100), 1) if timing['duration_ms'] else 0,
+                'memory_usage': round(timing['memory_mb'] / timing['memory_limit_mb'] * 100, 1) if timing['memory_limit_mb'] else 0,
+                'api_success_rate': round(success_rate, 1),
+                'cold_start_rate': round(timing['cold_starts'] / timed * 100, 1) if timed else 0,
+                'dynamodb_latency_ms': round(timing['dynamodb_ms'] / timing['dynamodb_calls'], 1) if timing['dynamodb_calls'] else 0,
+                's3_latency_ms': round(timing['s3_ms'] / timing['s3_calls'], 1) if timing['s3_calls'] else 0
             }
         except Exception as e:
             print(f"Error getting system health: {e}")
             return {'cpu_usage': 0, 'memory_usage': 0, 'api_success_rate': 100}
 
+    def all_panels(self):
+        s3_insights = self.s3_bucket_details()
+        return {
+            'stats': {
+                'totalRequests': self.total_requests(),
+                'activeUsers': self.active_users(),
+                'totalFriends': self.total_friends(),
+                's3BucketCount': s3_insights['total_buckets'],
+                'avgResponseTime': self.average_response_time()
+            },
+            'recentActivity': self.recent_activity(10),
+            'chartData': {
+                'requestsOverTime': self.requests_over_time(),
+                'intentDistribution': self.intent_distribution(),
+                'latencyByIntent': self.latency_by_intent()
+            },
+            'userInsights': {
+                'topUsers': self.top_users(5),
+                'systemHealth': self.system_health()
+            },
+            's3Insights': s3_insights
+        }
+
+
+class DashboardAnalytics:
+    @staticmethod
+    def get_rollups(periods):
+        """Fetch rollup items by period key in one BatchGetItem per 100 keys"""
+        rollups = {}
+        periods = list(periods)
+        for start in range(0, len(periods), 100):
+            request = {
+                analytics_rollups_table.name: {
+                    'Keys': [{'period': {'S': period}} for period in periods[start:start + 100]]
+                }
+            }
+            while request:
+                response = dynamodb_client.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(analytics_rollups_table.name, []):
+                    item = analytics_rollups_table.decode(item)
+                    rollups[item['period']] = item
+                request = response.get('UnprocessedKeys')
+        return rollups
+
+    @staticmethod
+    def inspect_bucket(bucket_name):
+        """Object count and size of one bucket"""
+        # the local agent publishes a full inventory summary per bucket and day
+        response = cost_metrics_table.query(
+            KeyConditionExpression=Key('bucket_name').eq(bucket_name),
+            ScanIndexForward=False,
+            Limit=1
+        )
+        if response['Items']:
+            item = response['Items'][0]
+            return {
+                'object_count': int(item.get('object_count', 0)),
+                'size': int(item.get('total_size_bytes', 0)),
+                'measured_at': item.get('timestamp')
+            }
+        
+        # buckets the agent has not indexed yet: first page only, size unknown
+        objects_response = s3_client.list_objects_v2(Bucket=bucket_name, MaxKeys=1000)
+        return {'object_count': objects_response.get('KeyCount', 0), 'size': 0}
+
+    @staticmethod
+    def get_total_requests():
+        """Get total requests from the all-time rollup"""
+        return DashboardSnapshot().total_requests()
+
+    @staticmethod
+    def get_active_users_count():
+        """Get count of users who interacted in the last 24 hours"""
+        return DashboardSnapshot().active_users()
+
+    @staticmethod
+    def get_total_friends():
+        """Get total number of friends from a specific user"""
+        return DashboardSnapshot().total_friends()
+
+    @staticmethod
+    def get_s3_bucket_count():
+        """Get total number of S3 buckets"""
+        return DashboardSnapshot().s3_bucket_count()
+
+    @staticmethod
+    def get_s3_bucket_details():
+        """Get detailed information about S3 buckets"""
+        return DashboardSnapshot().s3_bucket_details()
+
+    @staticmethod
+    def get_average_response_time():
+        """Mean skill response time in ms over the last 24 hours"""
+        return DashboardSnapshot().average_response_time()
+
+    @staticmethod
+    def get_recent_activity(limit=10):
+        """Get recent conversations"""
+        return DashboardSnapshot(recent_limit=limit).recent_activity(limit)
+
+    @staticmethod
+    def get_requests_over_time():
+        """Get request counts over time (last 24 hours, grouped by hour)"""
+        return DashboardSnapshot().requests_over_time()
+
+    @staticmethod
+    def get_intent_distribution():
+        """Get distribution of different intents"""
+        return DashboardSnapshot().intent_distribution()
+
+    @staticmethod
+    def get_top_users(limit=5):
+        """Get top users by interaction count"""
+        return DashboardSnapshot().top_users(limit)
+
+    @staticmethod
+    def get_latency_by_intent():
+        """p50/p95/p99 response time per intent over the last 24 hours"""
+        return DashboardSnapshot().latency_by_intent()
+
+    @staticmethod
+    def get_system_health():
+        """Get system health metrics"""
+        return DashboardSnapshot().system_health()
+
+def dashboard_delta(old, new):
+    """Describe what changed between two /all payloads, or None if nothing did"""
+    delta = {}
+
+    counters = {}
+    for key, value in new['stats'].items():
+        previous = old['stats'].get(key, 0)
+        if isinstance(value, (int, float)) and value != previous:
+            counters[key] = value - previous
+    if counters:
+        delta['counters'] = counters
+
+    seen = {(a['timestamp'], a['user'], a['intent']) for a in old['recentActivity']}
+    activity = [a for a in new['recentActivity'] if (a['timestamp'], a['user'], a['intent']) not in seen]
+    if activity:
+        delta['activity'] = activity
+
+    old_buckets = {b['name']: b for b in old['s3Insights']['buckets']}
+    new_buckets = {b['name']: b for b in new['s3Insights']['buckets']}
+    changed = [b for name, b in new_buckets.items() if old_buckets.get(name) != b]
+    removed = [name for name in old_buckets if name not in new_buckets]
+    if changed or removed:
+        delta['buckets'] = changed
+        delta['removedBuckets'] = removed
+    s3_totals = {k: v for k, v in new['s3Insights'].items() if k != 'buckets'}
+    if s3_totals != {k: v for k, v in old['s3Insights'].items() if k != 'buckets'}:
+        delta['s3Totals'] = s3_totals
+
+    # charts and user panels are small, so a change just replaces them
+    for panel in ('chartData', 'userInsights'):
+        if new[panel] != old[panel]:
+            delta[panel] = new[panel]
+
+    return delta or None
+
+
+class DashboardCache:
+    """Pre-serialized endpoint payloads kept fresh by a background thread.
+
+    Each endpoint is registered with a builder, a refresh interval and a
+    staleness bound. The refresher rebuilds every due endpoint from one
+    shared DashboardSnapshot, so read cost does not grow with the number of
+    viewers. Requests are always served from the cache; only an endpoint
+    that has never been built is built inline. A payload older than its
+    staleness bound, because rebuilds keep failing, is served with a
+    Warning header while the refresher keeps retrying.
+    """
+    def __init__(self, tick):
+        self.tick = tick
+        self.endpoints = {}
+        self.entries = {}
+        # re-entrant so store() can publish under the lock it swaps entries with
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+        self.thread = None
+        self.subscribers = set()
+        self.payloads = {}
+
+    def register(self, name, builder, refresh_every, max_age):
+        self.endpoints[name] = {'builder': builder, 'refresh_every': refresh_every, 'max_age': max_age}
+
+    def age(self, name):
+        entry = self.entries.get(name)
+        return time.monotonic() - entry['built_at'] if entry else float('inf')
+
+    def refresh(self, names, snapshot=None):
+        # one rebuild at a time; a payload refreshed while we waited is skipped
+        with self.refresh_lock:
+            names = [name for name in names if self.age(name) >= self.refresh_interval(name)]
+            if not names:
+                return
+            snapshot = snapshot or DashboardSnapshot()
+            for name in names:
+                try:
+                    payload = self.endpoints[name]['builder'](snapshot)
+                except Exception as e:
+                    # keep serving the previous payload until a rebuild succeeds
+                    print(f"Error refreshing {name}: {e}")
+                    continue
+                self.store(name, payload)
+
+    def store(self, name, payload):
+        # the ETag covers the data only, so an unchanged payload keeps its ETag
+        content = payload
+        if isinstance(payload, dict):
+            content = {k: v for k, v in payload.items() if k != 'lastUpdated'}
+        etag = hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+        previous = self.entries.get(name)
+        unchanged = previous is not None and previous['etag'] == etag
+        body = previous['body'] if unchanged else json.dumps(
+            payload, separators=(',', ':'), sort_keys=True
+        ).encode('utf-8')
+        delta = None
+        with self.lock:
+            old_payload = self.payloads.get(name)
+            if name == 'all' and not unchanged and old_payload is not None:
+                delta = dashboard_delta(old_payload, payload)
+            self.entries[name] = {'body': body, 'etag': etag, 'built_at': time.monotonic()}
+            self.payloads[name] = payload
+            # published under the lock so a new subscriber sees either the old
+            # snapshot plus this delta, or the new snapshot alone
+            if delta:
+                delta['lastUpdated'] = payload.get('lastUpdated')
+                self._publish('delta', delta)
+
+    def payload(self, name, snapshot):
+        """The cached payload of an endpoint, built from snapshot if there is none yet"""
+        with self.lock:
+            payload = self.payloads.get(name)
+        if payload is None:
+            payload = self.endpoints[name]['builder'](snapshot)
+            self.store(name, payload)
+        return payload
+
+    def _publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    self.subscribers.discard(subscriber)
+                    self._close(subscriber)
+
+    @staticmethod
+    def _close(subscriber):
+        """End a lagging client's stream; EventSource reconnects and gets a fresh snapshot"""
+        # its backlog is useless once deltas were lost, so make room for the sentinel
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        subscriber.put_nowait(STREAM_CLOSED)
+
+    def subscribe(self):
+        """Register a stream client, returning its queue and the snapshot deltas apply to"""
+        self.start()
+        subscriber = queue.Queue(maxsize=100)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            entry = self.entries.get('all')
+        return subscriber, entry['body'] if entry else None
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def refresh_interval(self, name):
+        interval = self.endpoints[name]['refresh_every']
+        if name == 'all' and self.subscribers:
+            interval = min(interval, DASHBOARD_STREAM_INTERVAL)
+        return interval
+
+    def run(self):
+        while True:
+            due = [name for name in self.endpoints if self.age(name) >= self.refresh_interval(name)]
+            if due:
+                self.refresh(due)
+            time.sleep(self.tick)
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name='dashboard-refresher', daemon=True)
+            self.thread.start()
+
+    def respond(self, name):
+        # started on first use so the reloader's parent process never polls AWS
+        self.start()
+        if name not in self.entries:
+            self.refresh([name])
+        entry = self.entries.get(name)
+        if entry is None:
+            return jsonify({'error': f'{name} data is unavailable'}), 500
+
+        response = Response(entry['body'], mimetype='application/json')
+        response.set_etag(entry['etag'])
+        response.headers['Cache-Control'] = f"max-age={int(self.endpoints[name]['refresh_every'])}"
+        if self.age(name) > self.endpoints[name]['max_age']:
+            # rebuilds are failing; the refresher retries on its own schedule
+            response.headers['Warning'] = '110 - "Response is Stale"'
+        return response.make_conditional(request)
+
+# queued to a stream client that fell behind, ending its event stream
+STREAM_CLOSED = None
+
+dashboard_cache = DashboardCache(DASHBOARD_REFRESH_TICK)
+
+def build_stats(snapshot):
+    return {
+        'totalRequests': snapshot.total_requests(),
+        'activeUsers': snapshot.active_users(),
+        'totalFriends': snapshot.total_friends(),
+        's3BucketCount': snapshot.s3_bucket_count(),
+        'avgResponseTime': snapshot.average_response_time(),
+        'lastUpdated': datetime.now().isoformat()
+    }
+
+def build_activity(snapshot):
+    return snapshot.recent_activity(15)
+
+def build_charts(snapshot):
+    return {
+        'requestsOverTime': snapshot.requests_over_time(),
+        'intentDistribution': snapshot.intent_distribution(),
+        'latencyByIntent': snapshot.latency_by_intent()
+    }
+
+def build_user_insights(snapshot):
+    return {
+        'topUsers': snapshot.top_users(5),
+        'systemHealth': snapshot.system_health()
+    }
+
+def build_s3_insights(snapshot):
+    return snapshot.s3_bucket_details()
+
+def build_all(snapshot):
+    # every panel is computed from one read of each source table; bucket
+    # inspection follows the 's3' schedule, so its cached payload is reused
+    snapshot.preload('s3_details', dashboard_cache.payload('s3', snapshot))
+    data = snapshot.all_panels()
+    data['lastUpdated'] = datetime.now().isoformat()
+    return data
+
+# name, builder, refresh interval (s), staleness bound (s)
+dashboard_cache.register('stats', build_stats, 15, 30)
+dashboard_cache.register('activity', build_activity, 10, 20)
+dashboard_cache.register('charts', build_charts, 60, 120)
+dashboard_cache.register('users', build_user_insights, 60, 120)
+dashboard_cache.register('s3', build_s3_insights, 300, 600)
+dashboard_cache.register('all', build_all, 15, 30)
+
 # API endpoints
 @app.route('/api/dashboard/stats')
 def get_dashboard_stats():
     """Get main dashboard statistics"""
-    try:
-        stats = {
-            'totalRequests': DashboardAnalytics.get_total_requests(),
-            'activeUsers': DashboardAnalytics.get_active_users_count(),
-            'totalFriends': DashboardAnalytics.get_total_friends(),
-            's3BucketCount': DashboardAnalytics.get_s3_bucket_count(),
-            'avgResponseTime': DashboardAnalytics.get_average_response_time(),
-            'lastUpdated': datetime.now().isoformat()
-        }
-        return jsonify(DashboardAnalytics.decimal_to_native(stats))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return dashboard_cache.respond('stats')
 
 @app.route('/api/dashboard/activity')
 def get_recent_activity():
     """Get recent activity feed"""
-    try:
-        activities = DashboardAnalytics.get_recent_activity(15)
-        return jsonify(DashboardAnalytics.decimal_to_native(activities))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return dashboard_cache.respond('activity')
 
 @app.route('/api/dashboard/charts')
 def get_chart_data():
     """Get data for charts"""
-    try:
-        chart_data = {
-            'requestsOverTime': DashboardAnalytics.get_requests_over_time(),
-            'intentDistribution': DashboardAnalytics.get_intent_distribution()
-        }
-        return jsonify(DashboardAnalytics.decimal_to_native(chart_data))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return dashboard_cache.respond('charts')
 
 @app.route('/api/dashboard/users')
 def get_user_insights():
     """Get user insights"""
-    try:
-        insights = {
-            'topUsers': DashboardAnalytics.get_top_users(5),
-            'systemHealth': DashboardAnalytics.get_system_health()
-        }
-        return jsonify(DashboardAnalytics.decimal_to_native(insights))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return dashboard_cache.respond('users')
 
 @app.route('/api/dashboard/s3')
 def get_s3_insights():
     """Get S3 bucket insights"""
-    try:
-        s3_data = DashboardAnalytics.get_s3_bucket_details()
-        return jsonify(DashboardAnalytics.decimal_to_native(s3_data))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return dashboard_cache.respond('s3')
 
 @app.route('/api/dashboard/all')
 def get_all_dashboard_data():
     """Get all dashboard data in one call"""
-    try:
-        data = {
-            'stats': {
-                'totalRequests': DashboardAnalytics.get_total_requests(),
-                'activeUsers': DashboardAnalytics.get_active_users_count(),
-                'totalFriends': DashboardAnalytics.get_total_friends(),
-                's3BucketCount': DashboardAnalytics.get_s3_bucket_count(),
-                'avgResponseTime': DashboardAnalytics.get_average_response_time()
-            },
-            'recentActivity': DashboardAnalytics.get_recent_activity(10),
-            'chartData': {
-                'requestsOverTime': DashboardAnalytics.get_requests_over_time(),
-                'intentDistribution': DashboardAnalytics.get_intent_distribution()
-            },
-            'userInsights': {
-                'topUsers': DashboardAnalytics.get_top_users(5),
-                'systemHealth': DashboardAnalytics.get_system_health()
-            },
-            's3Insights': DashboardAnalytics.get_s3_bucket_details(),
-            'lastUpdated': datetime.now().isoformat()
-        }
-        return jsonify(DashboardAnalytics.decimal_to_native(data))
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return dashboard_cache.respond('all')
+
+@app.route('/api/dashboard/stream')
+def stream_dashboard_data():
+    """Stream the dashboard as Server-Sent Events: one snapshot, then deltas"""
+    if 'all' not in dashboard_cache.entries:
+        dashboard_cache.refresh(['all'])
+    subscriber, initial = dashboard_cache.subscribe()
+
+    def events():
+        try:
+            if initial is not None:
+                yield f"event: snapshot\ndata: {initial.decode('utf-8')}\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is STREAM_CLOSED:
+                    return
+                yield message
+        finally:
+            dashboard_cache.unsubscribe(subscriber)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/health')
 def health_check():
@@ -409,6 +1047,7 @@ def index():
             '/api/dashboard/users': 'User insights',
             '/api/dashboard/s3': 'S3 bucket insights',
             '/api/dashboard/all': 'All dashboard data',
+            '/api/dashboard/stream': 'Live dashboard updates (Server-Sent Events)',
             '/health': 'Health check'
         }
     })
@@ -419,6 +1058,7 @@ if __name__ == '__main__':
     print("Make sure your AWS credentials are configured!")
     print("Available endpoints:")
     print("  - GET /api/dashboard/all - Get all dashboard data")
+    print("  - GET /api/dashboard/stream - Live dashboard updates (SSE)")
     print("  - GET /api/dashboard/stats - Get main stats (including S3)")
     print("  - GET /api/dashboard/s3 - Get S3 bucket insights")
     print("  - GET /api/dashboard/activity - Get recent activity")
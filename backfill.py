@@ -0,0 +1,343 @@
+#Maintenance commands for rebuilding derived DynamoDB records
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import random
+import time
+import boto3
+from botocore.exceptions import ClientError
+from collections import defaultdict
+from boto3.dynamodb.conditions import Key
+from datetime import datetime, timezone
+
+# Configuration
+AWS_REGION = 'us-east-1'
+
+# Initialize AWS clients
+dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
+user_profiles_table = dynamodb.Table('VirtualAssistant-UserProfiles')
+conversation_history_table = dynamodb.Table('VirtualAssistant-ConversationHistory')
+user_stats_table = dynamodb.Table('VirtualAssistant-UserStats')
+analytics_rollups_table = dynamodb.Table('VirtualAssistant-AnalyticsRollups')
+request_tables = [
+    dynamodb.Table('VirtualAssistant-FileUploadRequest'),
+    dynamodb.Table('VirtualAssistant-FileDownloadRequest')
+]
+
+QUEUE_SHARDS = 4  # must match lambda_function.py and local_upload.py
+HLL_PRECISION = 10  # must match lambda_function.py
+
+# where the skill queues conversation rows when CONVERSATION_QUEUE_URL is set
+CONVERSATION_QUEUE_URL = os.environ.get('CONVERSATION_QUEUE_URL', '')
+# unprocessed BatchWriteItem items are retried this many times with backoff, as in the skill
+BATCH_WRITE_ATTEMPTS = int(os.environ.get('BATCH_WRITE_ATTEMPTS', '5'))
+
+
+def scan_all(table, **scan_kwargs):
+    """Yield every item of a table, following LastEvaluatedKey"""
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def count_conversations(user_id):
+    """Count a user's history with paginated COUNT queries"""
+    total = 0
+    query_kwargs = {
+        'KeyConditionExpression': Key('user_id').eq(user_id),
+        'Select': 'COUNT'
+    }
+    while True:
+        response = conversation_history_table.query(**query_kwargs)
+        total += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            return total
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def last_seen(user_id):
+    """Timestamp of the user's newest conversation, read from the end of the partition"""
+    response = conversation_history_table.query(
+        KeyConditionExpression=Key('user_id').eq(user_id),
+        ScanIndexForward=False,
+        Limit=1,
+        ProjectionExpression='#ts',
+        ExpressionAttributeNames={'#ts': 'timestamp'}
+    )
+    items = response.get('Items', [])
+    return items[0]['timestamp'] if items else None
+
+
+def rebuild_user_stats(user_ids=None):
+    """Recompute VirtualAssistant-UserStats from ConversationHistory and UserProfiles"""
+    profiles = {
+        item['user_id']: item
+        for item in scan_all(user_profiles_table, ProjectionExpression='user_id, friends')
+    }
+
+    if not user_ids:
+        user_ids = set(profiles)
+        for item in scan_all(conversation_history_table, ProjectionExpression='user_id'):
+            user_ids.add(item['user_id'])
+
+    rebuilt = 0
+    for user_id in sorted(user_ids):
+        # SET only the rebuilt attributes; 'name' and anything else the skill keeps stay as they are
+        values = {
+            ':c': count_conversations(user_id),
+            ':f': len(profiles.get(user_id, {}).get('friends', [])),
+            ':r': datetime.now(timezone.utc).isoformat()
+        }
+        update_expression = 'SET conversation_count = :c, friends_count = :f, rebuilt_at = :r'
+        seen = last_seen(user_id)
+        if seen:
+            values[':s'] = seen
+            update_expression += ', last_seen = :s'
+        user_stats_table.update_item(
+            Key={'user_id': user_id}, UpdateExpression=update_expression, ExpressionAttributeValues=values
+        )
+        rebuilt += 1
+        print(f"Rebuilt stats for {user_id}: {values[':c']} conversations")
+
+    print(f"Rebuilt stats for {rebuilt} users")
+
+
+def hll_register(user_id):
+    """(register index, rank) a user sets in a distinct-users sketch, as in the skill"""
+    value = int.from_bytes(hashlib.sha1(user_id.encode('utf-8')).digest()[:8], 'big')
+    width = 64 - HLL_PRECISION
+    return value >> width, width - (value & ((1 << width) - 1)).bit_length() + 1
+
+
+def rebuild_rollups():
+    """Recompute VirtualAssistant-AnalyticsRollups from ConversationHistory.
+
+    Counter items are replaced, so increments the skill makes during the scan
+    are lost; run this with the skill quiesced.
+    """
+    rollups = defaultdict(lambda: {'requests': 0, 'intents': defaultdict(int), 'users': bytearray(1 << HLL_PRECISION)})
+
+    for item in scan_all(conversation_history_table):
+        try:
+            timestamp = datetime.fromisoformat(item['timestamp'].replace('Z', '+00:00'))
+        except (KeyError, ValueError):
+            continue
+        timestamp = timestamp.astimezone(timezone.utc)
+        index, rank = hll_register(item['user_id'])
+        intent_name = item.get('intent_name', 'Unknown')
+
+        for period in (f"hour#{timestamp.strftime('%Y-%m-%dT%H')}", 'all'):
+            rollup = rollups[period]
+            rollup['requests'] += 1
+            rollup['intents'][intent_name] += 1
+            if period != 'all':
+                rollup['users'][index] = max(rollup['users'][index], rank)
+
+    with analytics_rollups_table.batch_writer() as batch:
+        for period, rollup in rollups.items():
+            item = {'period': period, 'requests': rollup['requests']}
+            for intent_name, count in rollup['intents'].items():
+                item[f'intent_{intent_name}'] = count
+            batch.put_item(Item=item)
+
+    # sketches move to a newer version, so skill containers holding a cached copy re-read before merging
+    for period, rollup in rollups.items():
+        if period != 'all':
+            analytics_rollups_table.update_item(
+                Key={'period': f'users#{period}'},
+                UpdateExpression='SET registers = :registers, #version = if_not_exists(#version, :zero) + :one',
+                ExpressionAttributeNames={'#version': 'version'},
+                ExpressionAttributeValues={':registers': bytes(rollup['users']), ':zero': 0, ':one': 1}
+            )
+
+    print(f"Rebuilt {len(rollups)} rollup periods")
+
+
+def queue_shard(request_id):
+    shard = int(hashlib.md5(request_id.encode('utf-8')).hexdigest(), 16) % QUEUE_SHARDS
+    return f'open#{shard}'
+
+
+def migrate_queue_index():
+    """Set queue_shard on open transfer requests and clear it on finished ones"""
+    for table in request_tables:
+        key_names = [element['AttributeName'] for element in table.key_schema]
+        tagged = cleared = 0
+        for item in scan_all(table):
+            key = {name: item[name] for name in key_names}
+            if item.get('status') in ('pending', 'in_progress'):
+                if item.get('queue_shard'):
+                    continue
+                table.update_item(
+                    Key=key,
+                    UpdateExpression='SET queue_shard = :shard',
+                    ExpressionAttributeValues={':shard': queue_shard(item['request_id'])}
+                )
+                tagged += 1
+            elif 'queue_shard' in item:
+                table.update_item(Key=key, UpdateExpression='REMOVE queue_shard')
+                cleared += 1
+        print(f"{table.name}: tagged {tagged} open requests, cleared {cleared} finished ones")
+
+
+def conversation_rows(body):
+    """Rows of one queued message body; raises ValueError if it is not a list of conversation rows"""
+    rows = json.loads(body)
+    if not isinstance(rows, list) or not all(
+        isinstance(row, dict) and 'user_id' in row and 'timestamp' in row for row in rows
+    ):
+        raise ValueError('expected a JSON list of rows with user_id and timestamp')
+    return rows
+
+
+def write_conversation_rows(rows):
+    """Put rows 25 per BatchWriteItem, retrying unprocessed ones with backoff; returns rows not written.
+
+    Mirrors batch_write_rows in lambda_function.py (which this script does not
+    import, to stay free of the Alexa SDK); keep the two in step.
+    """
+    # a request that puts the same key twice is rejected whole, so the last row per key wins
+    rows = list({(row['user_id'], row['timestamp']): row for row in rows}.values())
+    # the resource's client takes native Python values
+    client = dynamodb.meta.client
+    table_name = conversation_history_table.name
+    unwritten = []
+    for start in range(0, len(rows), 25):
+        group = rows[start:start + 25]
+        request_items = {table_name: [{'PutRequest': {'Item': row}} for row in group]}
+        try:
+            for attempt in range(BATCH_WRITE_ATTEMPTS):
+                response = client.batch_write_item(RequestItems=request_items)
+                request_items = response.get('UnprocessedItems') or {}
+                if not request_items:
+                    break
+                time.sleep(min(2.0, 0.05 * (2 ** attempt)) * random.uniform(0.5, 1.0))
+        except ClientError as e:
+            print(f"Error writing {len(group)} conversation rows: {e}")
+            unwritten.extend(group)
+            continue
+        unwritten.extend(request['PutRequest']['Item'] for request in request_items.get(table_name, []))
+    return unwritten
+
+
+def append_conversation_rows(path, rows):
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(rows, separators=(',', ':'), default=str) + '\n')
+
+
+def drain_conversation_file(path):
+    """Write the rows queued in the local stand-in file, then remove them.
+
+    The file is moved aside under its lock, so the skill starts a new one
+    for rows logged meanwhile. A leftover .draining file from an
+    interrupted drain is written first. Rows that could not be written are
+    appended back to the queue file; malformed lines are set aside in a
+    .rejected file next to it.
+    """
+    draining = path + '.draining'
+    if not os.path.exists(draining) and os.path.exists(path):
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            os.replace(path, draining)
+    if not os.path.exists(draining):
+        print(f"No conversation rows queued in {path}")
+        return
+    rows, rejected = [], []
+    with open(draining) as f:
+        for line in f:
+            if line.strip():
+                try:
+                    rows.extend(conversation_rows(line))
+                except ValueError as e:
+                    print(f"Malformed conversation line: {e}")
+                    rejected.append(line)
+    unwritten = write_conversation_rows(rows)
+    if unwritten:
+        append_conversation_rows(path, unwritten)
+    if rejected:
+        with open(path + '.rejected', 'a') as f:
+            f.writelines(line if line.endswith('\n') else line + '\n' for line in rejected)
+    os.remove(draining)
+    written = len({(row['user_id'], row['timestamp']) for row in rows}) - len(unwritten)
+    print(f"Wrote {written} conversation rows, requeued {len(unwritten)}, rejected {len(rejected)} lines")
+
+
+def drain_conversation_sqs(queue_url):
+    """Receive, write and delete queued conversation messages until the queue is empty"""
+    sqs = boto3.client('sqs', region_name=AWS_REGION)
+    written = 0
+    while True:
+        messages = sqs.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=1, VisibilityTimeout=60
+        ).get('Messages', [])
+        if not messages:
+            break
+        rows, owners, failed = [], defaultdict(set), set()
+        for message in messages:
+            try:
+                message_rows = conversation_rows(message['Body'])
+            except ValueError as e:
+                # left on the queue; the redrive policy moves it to the dead-letter queue
+                print(f"Malformed conversation message {message['MessageId']}: {e}")
+                failed.add(message['MessageId'])
+                continue
+            for row in message_rows:
+                rows.append(row)
+                owners[(row['user_id'], row['timestamp'])].add(message['MessageId'])
+        unwritten = write_conversation_rows(rows)
+        written += len(owners) - len(unwritten)
+        # messages with unwritten rows become visible again after the timeout
+        for row in unwritten:
+            failed |= owners[(row['user_id'], row['timestamp'])]
+        done = [message for message in messages if message['MessageId'] not in failed]
+        if done:
+            sqs.delete_message_batch(QueueUrl=queue_url, Entries=[
+                {'Id': str(n), 'ReceiptHandle': message['ReceiptHandle']} for n, message in enumerate(done)
+            ])
+    print(f"Wrote {written} conversation rows from {queue_url}")
+
+
+def drain_conversations(queue_url):
+    if queue_url.startswith('file://'):
+        drain_conversation_file(queue_url[len('file://'):])
+    else:
+        drain_conversation_sqs(queue_url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild derived CloudButler records')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    user_stats_parser = subparsers.add_parser('user-stats', help='Rebuild per-user conversation counters')
+    user_stats_parser.add_argument('--user-id', action='append', dest='user_ids',
+                                   help='Only rebuild these users (repeatable)')
+
+    subparsers.add_parser('rollups', help='Rebuild hourly and all-time dashboard rollups')
+    subparsers.add_parser('queue-index', help='Backfill queue_shard on transfer requests for the sparse queue index')
+    drain_parser = subparsers.add_parser('drain-conversations', help='Write queued conversation rows to the history table')
+    drain_parser.add_argument('--queue-url', default=CONVERSATION_QUEUE_URL,
+                              help='SQS queue URL or file:// path (default: CONVERSATION_QUEUE_URL)')
+
+    args = parser.parse_args()
+
+    if args.command == 'user-stats':
+        rebuild_user_stats(args.user_ids)
+    elif args.command == 'rollups':
+        rebuild_rollups()
+    elif args.command == 'queue-index':
+        migrate_queue_index()
+    elif args.command == 'drain-conversations':
+        if not args.queue_url:
+            parser.error('drain-conversations needs --queue-url or CONVERSATION_QUEUE_URL')
+        drain_conversations(args.queue_url)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#Dispatch cost per request: the SDK's linear can_handle scan against the skill's RequestRouter
+#
+#   python benchmarks/dispatch.py
+#   python benchmarks/dispatch.py --iterations 200000
+
+import os
+import sys
+import json
+import time
+import argparse
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path[:0] = [BENCHMARK_DIR, REPO_DIR]
+
+# clients are built lazily, so importing the skill makes no AWS calls
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+import lambda_function
+from run import envelope, intent_slots
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_core.skill import CustomSkill
+from ask_sdk_core.skill_builder import SkillBuilder
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components.request_components import GenericRequestMapper
+
+# registration order puts these at the start, middle and end of the linear scan
+REQUESTS = [
+    'LaunchRequest', 'GetStatsIntent', 'UploadFiletoSIntent', 'AMAZON.HelpIntent', 'AMAZON.StopIntent',
+    'SessionEndedRequest', 'AMAZON.FallbackIntent'
+]
+
+
+def handler_input(request):
+    serializer = DefaultSerializer()
+    event = envelope(request, 'amzn1.ask.account.DISPATCH', intent_slots(request, 0))
+    return HandlerInput(request_envelope=serializer.deserialize(json.dumps(event), RequestEnvelope))
+
+
+def per_call_ns(operation, iterations):
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        operation()
+    return (time.perf_counter_ns() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request dispatch cost of the skill')
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    chains = lambda_function.sb.runtime_configuration_builder.request_handler_chains
+    linear = GenericRequestMapper(request_handler_chains=chains)
+    router = lambda_function.RequestRouter(chains)
+
+    print(f"{'request':<28} {'handler':<44} {'linear ns':>10} {'router ns':>10} {'speedup':>8}")
+    for request in REQUESTS:
+        item = handler_input(request)
+        chain = router.get_request_handler_chain(item)
+        assert chain is linear.get_request_handler_chain(item), request
+        linear_ns = per_call_ns(lambda: linear.get_request_handler_chain(item), args.iterations)
+        router_ns = per_call_ns(lambda: router.get_request_handler_chain(item), args.iterations)
+        handler = type(chain.request_handler).__name__
+        print(f"{request:<28} {handler:<44} {linear_ns:>10.0f} {router_ns:>10.0f} {linear_ns / router_ns:>7.1f}x")
+
+    # the stock SkillBuilder.lambda_handler rebuilds the configuration and skill on every invocation
+    builder = lambda_function.sb
+    rebuild_ns = per_call_ns(
+        lambda: CustomSkill(skill_configuration=SkillBuilder.skill_configuration.fget(builder)),
+        max(1, args.iterations // 100)
+    )
+    print(f"\nPer-invocation skill rebuild in the stock lambda_handler: {rebuild_ns / 1000:.1f} us (once per container with RoutedSkillBuilder)")
+
+
+if __name__ == '__main__':
+    main()
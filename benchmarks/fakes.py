@@ -0,0 +1,1007 @@
+#In-memory DynamoDB and S3 stand-ins for the benchmarks
+
+import os
+import re
+import json
+import time
+import base64
+import bisect
+import hashlib
+import threading
+from collections import Counter
+from decimal import Decimal
+from datetime import datetime, timezone
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+# every AWS call made while the fakes are installed, as 'service.Operation' -> count
+calls = Counter()
+calls_lock = threading.Lock()
+
+# key schemas from the README's create-table commands: table -> (hash, range, {index: (hash, range)})
+TABLES = {
+    'VirtualAssistant-UserProfiles': ('user_id', None, {}),
+    'VirtualAssistant-ConversationHistory': ('user_id', 'timestamp', {'date-timestamp-index': ('date', 'timestamp')}),
+    'VirtualAssistant-UsageAnalytics': ('metric_type', 'date', {}),
+    'VirtualAssistant-UserStats': ('user_id', None, {}),
+    'VirtualAssistant-AnalyticsRollups': ('period', None, {}),
+    'VirtualAssistant-CostMetrics': ('bucket_name', 'date', {}),
+    'VirtualAssistant-FileUploadRequest': ('request_id', 'timestamp', {'queue-index': ('queue_shard', 'timestamp')}),
+    'VirtualAssistant-FileDownloadRequest': ('request_id', 'timestamp', {'queue-index': ('queue_shard', 'timestamp')}),
+}
+
+PAGE_BYTES = 1024 * 1024  # DynamoDB stops a Query or Scan page after 1 MB read
+
+
+def count_call(name):
+    with calls_lock:
+        calls[name] += 1
+
+
+class ConditionalCheckFailed(Exception):
+    pass
+
+
+class ValidationError(Exception):
+    pass
+
+
+# attribute values
+
+def plain(value):
+    """Comparable Python value for a wire-format attribute value"""
+    if value is None:
+        return None
+    (kind, inner), = value.items()
+    if kind == 'S' or kind == 'B':
+        return inner
+    if kind == 'N':
+        return Decimal(inner)
+    if kind == 'BOOL':
+        return inner
+    if kind == 'NULL':
+        return None
+    if kind == 'SS' or kind == 'BS':
+        return frozenset(inner)
+    if kind == 'NS':
+        return frozenset(Decimal(n) for n in inner)
+    if kind == 'L':
+        return [plain(v) for v in inner]
+    return {k: plain(v) for k, v in inner.items()}
+
+
+def number(value):
+    # DynamoDB returns integers without an exponent, e.g. '10' rather than '1E+1'
+    return {'N': str(int(value)) if value == value.to_integral_value() else str(value.normalize())}
+
+
+# expressions
+
+TOKEN = re.compile(r"\s*(?:(#[A-Za-z0-9_]+)|(:[A-Za-z0-9_]+)|([A-Za-z_][A-Za-z0-9_]*)|(\d+)|(<>|<=|>=|=|<|>|\(|\)|,|\.|\[|\]|\+|-))")
+KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+
+
+class Expression:
+    """Recursive-descent parser for the subset of DynamoDB expressions the code base uses"""
+    def __init__(self, text, names=None, values=None):
+        self.names = names or {}
+        self.values = values or {}
+        self.tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = TOKEN.match(text, position)
+            if not match or match.end() == position:
+                raise ValidationError(f"Cannot parse expression at: {text[position:]}")
+            position = match.end()
+            name, value, word, digits, symbol = match.groups()
+            if name:
+                self.tokens.append(('path', self.names[name]))
+            elif value:
+                self.tokens.append(('value', self.values[value]))
+            elif word:
+                self.tokens.append(('word', word))
+            elif digits:
+                self.tokens.append(('int', int(digits)))
+            else:
+                self.tokens.append(('symbol', symbol))
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, symbol=None):
+        token = self.peek()
+        if symbol is not None and token[1] != symbol:
+            raise ValidationError(f"Expected {symbol!r}, got {token[1]!r}")
+        self.position += 1
+        return token
+
+    def at_keyword(self, *words):
+        kind, text = self.peek()
+        return kind == 'word' and text.upper() in words
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # operands
+
+    def path(self):
+        kind, text = self.take()
+        if kind not in ('path', 'word'):
+            raise ValidationError(f"Expected an attribute, got {text!r}")
+        elements = [text]
+        while self.peek()[1] in ('.', '['):
+            if self.take()[1] == '.':
+                elements.append(self.take()[1])
+            else:
+                elements.append(self.take()[1])
+                self.take(']')
+        return elements
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.take()
+            return lambda item, value=text: value
+        if kind == 'word' and self.peek(1)[1] == '(':
+            function = text.lower()
+            self.take()
+            self.take('(')
+            if function == 'size':
+                path = self.path()
+                self.take(')')
+                return lambda item: size_of(get_path(item, path))
+            if function == 'if_not_exists':
+                path = self.path()
+                self.take(',')
+                fallback = self.operand()
+                self.take(')')
+                return lambda item: get_path(item, path) or fallback(item)
+            if function == 'list_append':
+                first = self.operand()
+                self.take(',')
+                second = self.operand()
+                self.take(')')
+                return lambda item: {'L': first(item)['L'] + second(item)['L']}
+            raise ValidationError(f"Unsupported function {function}")
+        path = self.path()
+        return lambda item: get_path(item, path)
+
+    # conditions
+
+    def condition(self):
+        left = self.conjunction()
+        while self.at_keyword('OR'):
+            self.take()
+            right = self.conjunction()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.at_keyword('AND'):
+            self.take()
+            right = self.negation()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def negation(self):
+        if self.at_keyword('NOT'):
+            self.take()
+            inner = self.negation()
+            return lambda item: not inner(item)
+        return self.predicate()
+
+    def predicate(self):
+        kind, text = self.peek()
+        if text == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        if kind == 'word' and self.peek(1)[1] == '(' and text.lower() != 'size':
+            function = text.lower()
+            self.take()
+            self.take('(')
+            path = self.path()
+            argument = None
+            if self.peek()[1] == ',':
+                self.take()
+                argument = self.operand()
+            self.take(')')
+            if function == 'attribute_exists':
+                return lambda item: get_path(item, path) is not None
+            if function == 'attribute_not_exists':
+                return lambda item: get_path(item, path) is None
+            if function == 'attribute_type':
+                return lambda item: (get_path(item, path) or {}).keys() == {argument(item)['S']}
+            if function == 'begins_with':
+                def begins_with(item):
+                    value, prefix = plain(get_path(item, path)), plain(argument(item))
+                    return isinstance(value, str) and value.startswith(prefix)
+                return begins_with
+            if function == 'contains':
+                def contains(item):
+                    value, part = plain(get_path(item, path)), plain(argument(item))
+                    try:
+                        return value is not None and part in value
+                    except TypeError:
+                        return False
+                return contains
+            raise ValidationError(f"Unsupported function {function}")
+
+        left = self.operand()
+        if self.at_keyword('BETWEEN'):
+            self.take()
+            low = self.operand()
+            if not self.at_keyword('AND'):
+                raise ValidationError("BETWEEN needs AND")
+            self.take()
+            high = self.operand()
+            return lambda item: compare(left(item), '>=', low(item)) and compare(left(item), '<=', high(item))
+        if self.at_keyword('IN'):
+            self.take()
+            self.take('(')
+            options = [self.operand()]
+            while self.peek()[1] == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return lambda item: any(compare(left(item), '=', option(item)) for option in options)
+        operator = self.take()[1]
+        right = self.operand()
+        return lambda item: compare(left(item), operator, right(item))
+
+    def key_condition(self, hash_name):
+        """(hash key value, test for the rest) for a KeyConditionExpression"""
+        found, tests = [], []
+        self._key_terms(hash_name, found, tests)
+        if not found:
+            raise ValidationError(f"Query condition missed key schema element: {hash_name}")
+        return found[0], (lambda item: all(test(item) for test in tests))
+
+    def _key_terms(self, hash_name, found, tests):
+        while True:
+            kind, text = self.peek()
+            if text == '(' and kind == 'symbol':
+                self.take()
+                self._key_terms(hash_name, found, tests)
+                self.take(')')
+            elif kind in ('path', 'word') and text == hash_name and self.peek(1)[1] == '=' and self.peek(2)[0] == 'value':
+                found.append(self.peek(2)[1])
+                self.position += 3
+            else:
+                tests.append(self.predicate())
+            if not self.at_keyword('AND'):
+                return
+            self.take()
+
+    # update expressions
+
+    def updates(self):
+        actions = []
+        while not self.done():
+            clause = self.take()[1].upper()
+            while True:
+                if clause == 'SET':
+                    path = self.path()
+                    self.take('=')
+                    value = self.operand()
+                    if self.peek()[1] in ('+', '-'):
+                        sign = self.take()[1]
+                        other = self.operand()
+                        value = (lambda a, b, sign: lambda item: arithmetic(a(item), b(item), sign))(value, other, sign)
+                    actions.append(('SET', path, value))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                elif clause in ('ADD', 'DELETE'):
+                    path = self.path()
+                    actions.append((clause, path, self.operand()))
+                else:
+                    raise ValidationError(f"Unknown update clause {clause}")
+                if self.peek()[1] != ',':
+                    break
+                self.take()
+        return actions
+
+    def paths(self):
+        paths = [self.path()]
+        while self.peek()[1] == ',':
+            self.take()
+            paths.append(self.path())
+        return paths
+
+
+def compare(left, operator, right):
+    if left is None or right is None:
+        return operator == '<>' and (left is None) != (right is None)
+    left, right = plain(left), plain(right)
+    if operator == '=':
+        return left == right
+    if operator == '<>':
+        return left != right
+    if type(left) is not type(right):
+        return False
+    if operator == '<':
+        return left < right
+    if operator == '<=':
+        return left <= right
+    if operator == '>':
+        return left > right
+    return left >= right
+
+
+def arithmetic(left, right, sign):
+    left, right = Decimal(left['N']), Decimal(right['N'])
+    return number(left + right if sign == '+' else left - right)
+
+
+def size_of(value):
+    if value is None:
+        return None
+    (kind, inner), = value.items()
+    if kind == 'B':
+        inner = base64.b64decode(inner)
+    return {'N': str(len(inner))}
+
+
+def get_path(item, path):
+    value = {'M': item}
+    for element in path:
+        if value is None:
+            return None
+        if isinstance(element, int):
+            items = value.get('L')
+            value = items[element] if items is not None and element < len(items) else None
+        else:
+            value = value.get('M', {}).get(element)
+    return value
+
+
+def set_path(item, path, value):
+    container = item
+    for element in path[:-1]:
+        container = container[element]['M'] if not isinstance(element, int) else container['L'][element]
+        if 'M' in container:
+            container = container['M']
+    if isinstance(path[-1], int):
+        container['L'][path[-1]] = value
+    else:
+        container[path[-1]] = value
+
+
+def remove_path(item, path):
+    container = item
+    for element in path[:-1]:
+        container = container.get(element, {}).get('M', {})
+    container.pop(path[-1], None)
+
+
+def apply_updates(item, actions):
+    # every right-hand side is read from the item as it was before the update
+    resolved = [(action, path, value(item) if value else None) for action, path, value in actions]
+    for action, path, value in resolved:
+        current = get_path(item, path)
+        if action == 'SET':
+            set_path(item, path, value)
+        elif action == 'REMOVE':
+            remove_path(item, path)
+        elif action == 'ADD':
+            if 'N' in value:
+                total = Decimal(value['N']) + (Decimal(current['N']) if current else 0)
+                set_path(item, path, number(total))
+            else:
+                (kind, members), = value.items()
+                existing = set(current[kind]) if current else set()
+                set_path(item, path, {kind: sorted(existing | set(members))})
+        elif action == 'DELETE' and current:
+            (kind, members), = value.items()
+            remaining = set(current[kind]) - set(members)
+            if remaining:
+                set_path(item, path, {kind: sorted(remaining)})
+            else:
+                remove_path(item, path)
+
+
+# tables
+
+class FakeTable:
+    """One table's items plus sorted partitions for its key and each index"""
+    def __init__(self, name, hash_key, range_key=None, indexes=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items = {}
+        self.sizes = {}
+        # scan order: keys in insertion order, deleted ones left as None
+        self.order = []
+        self.position = {}
+        # (index name or None) -> hash value -> sorted [(range value, primary key)]
+        self.partitions = {None: {}}
+        for index in self.indexes:
+            self.partitions[index] = {}
+        self.lock = threading.RLock()
+
+    def schema(self, index=None):
+        return self.indexes[index] if index else (self.hash_key, self.range_key)
+
+    def key_of(self, item):
+        hash_value = plain(item.get(self.hash_key))
+        if hash_value is None:
+            raise ValidationError(f"Missing the key {self.hash_key} in the item")
+        return (hash_value, plain(item.get(self.range_key)) if self.range_key else None)
+
+    def key_attributes(self, key):
+        return {name: self.items[key][name] for name in (self.hash_key, self.range_key) if name}
+
+    def _index_entries(self, key, item):
+        for index in self.partitions:
+            hash_name, range_name = self.schema(index)
+            hash_value = plain(item.get(hash_name))
+            if hash_value is None or (range_name and item.get(range_name) is None):
+                continue  # sparse: only items carrying the index keys are indexed
+            range_value = plain(item.get(range_name)) if range_name else None
+            yield index, hash_value, (range_value, key)
+
+    def put(self, item):
+        key = self.key_of(item)
+        with self.lock:
+            old = self.items.get(key)
+            if old is not None:
+                for index, hash_value, entry in self._index_entries(key, old):
+                    entries = self.partitions[index][hash_value]
+                    del entries[bisect.bisect_left(entries, entry)]
+            else:
+                self.position[key] = len(self.order)
+                self.order.append(key)
+            self.items[key] = item
+            self.sizes[key] = len(json.dumps(item))
+            for index, hash_value, entry in self._index_entries(key, item):
+                bisect.insort(self.partitions[index].setdefault(hash_value, []), entry)
+        return old
+
+    def delete(self, key):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is None:
+                return None
+            for index, hash_value, entry in self._index_entries(key, old):
+                entries = self.partitions[index][hash_value]
+                del entries[bisect.bisect_left(entries, entry)]
+            self.order[self.position.pop(key)] = None
+            del self.sizes[key]
+        return old
+
+    def query(self, index, hash_value, range_test, forward, start_key):
+        """Primary keys in one partition, in range-key order, after start_key"""
+        with self.lock:
+            entries = list(self.partitions[index].get(hash_value, []))
+        if not forward:
+            entries.reverse()
+        if start_key is not None:
+            entries = entries[[entry[1] for entry in entries].index(start_key) + 1:]
+        for range_value, key in entries:
+            item = self.items.get(key)
+            if item is not None and range_test(item):
+                yield key, item
+
+    def scan(self, segment, total_segments, start_key):
+        with self.lock:
+            count = len(self.order)
+        begin, end = count * segment // total_segments, count * (segment + 1) // total_segments
+        if start_key is not None:
+            begin = self.position[start_key] + 1
+        for position in range(begin, end):
+            key = self.order[position]
+            if key is not None:
+                item = self.items.get(key)
+                if item is not None:
+                    yield key, item
+
+
+class FakeDynamoDB:
+    """Answers DynamoDB JSON requests from in-memory tables.
+
+    It is hooked into botocore's before-send event, so boto3's resource and
+    client layers, request serialization and response parsing all run for
+    real and only the network round trip is replaced.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {name: FakeTable(name, *schema) for name, schema in TABLES.items()}
+        self.serializer = TypeSerializer()
+
+    def seed(self, table_name, items):
+        """Load native Python items straight into a table, without going through boto3"""
+        table = self.tables[table_name]
+        serialize = self.serializer.serialize
+
+        def wire(value):
+            value = serialize(value)
+            # binary values travel base64-encoded in the JSON protocol
+            if 'B' in value:
+                return {'B': base64.b64encode(value['B']).decode()}
+            return value
+
+        for item in items:
+            table.put({name: wire(value) for name, value in item.items()})
+
+    def truncate(self, table_name):
+        """Empty a table, keeping its schema"""
+        self.tables[table_name] = FakeTable(table_name, *TABLES[table_name])
+
+    def handle(self, request, **kwargs):
+        target = request.headers['X-Amz-Target']
+        operation = (target.decode() if isinstance(target, bytes) else target).split('.')[-1]
+        count_call(f'dynamodb.{operation}')
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.loads(request.body or b'{}')
+        try:
+            status, payload = 200, getattr(self, operation)(body)
+        except ConditionalCheckFailed as e:
+            status, payload = 400, {'__type': 'com.amazonaws.dynamodb.v20120810#ConditionalCheckFailedException', 'message': str(e)}
+        except ValidationError as e:
+            status, payload = 400, {'__type': 'com.amazon.coral.validate#ValidationException', 'message': str(e)}
+        except KeyError as e:
+            status, payload = 400, {'__type': 'com.amazonaws.dynamodb.v20120810#ResourceNotFoundException', 'message': f"Requested resource not found: {e}"}
+        content = json.dumps(payload).encode()
+        return AWSResponse(request.url, status, {'Content-Type': 'application/x-amz-json-1.0'}, RawBody(content))
+
+    # helpers
+
+    def table(self, body):
+        return self.tables[body['TableName']]
+
+    @staticmethod
+    def expression(body, field):
+        text = body.get(field)
+        if not text:
+            return None
+        return Expression(text, body.get('ExpressionAttributeNames'), body.get('ExpressionAttributeValues'))
+
+    def check(self, body, item):
+        condition = self.expression(body, 'ConditionExpression')
+        if condition and not condition.condition()(item or {}):
+            raise ConditionalCheckFailed('The conditional request failed')
+
+    def projector(self, body):
+        """Function applying the request's projection to an item, parsed once per request"""
+        projection = self.expression(body, 'ProjectionExpression')
+        if not projection:
+            return lambda item: item
+        names = [path[0] for path in projection.paths()]
+        return lambda item: {name: item[name] for name in names if name in item}
+
+    def project(self, body, item):
+        return self.projector(body)(item)
+
+    def page(self, body, table, index, rows):
+        """Apply Limit, the 1 MB page size, the filter, Select and the projection"""
+        limit = body.get('Limit')
+        select = body.get('Select')
+        filter_expression = self.expression(body, 'FilterExpression')
+        test = filter_expression.condition() if filter_expression else None
+        items, scanned, read, last_key = [], 0, 0, None
+        for key, item in rows:
+            scanned += 1
+            read += table.sizes.get(key, 0)
+            if test is None or test(item):
+                items.append(item)
+            if (limit and scanned >= limit) or read >= PAGE_BYTES:
+                last_key = key
+                break
+        response = {'Count': len(items), 'ScannedCount': scanned}
+        if select != 'COUNT':
+            project = self.projector(body)
+            response['Items'] = [project(item) for item in items]
+        if last_key is not None:
+            last = table.key_attributes(last_key)
+            if index:
+                for name in table.schema(index):
+                    if name:
+                        last[name] = table.items[last_key][name]
+            response['LastEvaluatedKey'] = last
+        return response
+
+    # operations
+
+    def DescribeTable(self, body):
+        table = self.table(body)
+        attributes = {table.hash_key, table.range_key}
+        key_schema = [{'AttributeName': table.hash_key, 'KeyType': 'HASH'}]
+        if table.range_key:
+            key_schema.append({'AttributeName': table.range_key, 'KeyType': 'RANGE'})
+        indexes = []
+        for name, (hash_name, range_name) in table.indexes.items():
+            attributes |= {hash_name, range_name}
+            index_schema = [{'AttributeName': hash_name, 'KeyType': 'HASH'}]
+            if range_name:
+                index_schema.append({'AttributeName': range_name, 'KeyType': 'RANGE'})
+            indexes.append({'IndexName': name, 'KeySchema': index_schema, 'Projection': {'ProjectionType': 'ALL'}, 'IndexStatus': 'ACTIVE'})
+        description = {
+            'TableName': table.name,
+            'TableStatus': 'ACTIVE',
+            'KeySchema': key_schema,
+            'AttributeDefinitions': [{'AttributeName': name, 'AttributeType': 'S'} for name in sorted(a for a in attributes if a)],
+            'ItemCount': len(table.items),
+            'TableArn': f'arn:aws:dynamodb:us-east-1:000000000000:table/{table.name}'
+        }
+        if indexes:
+            description['GlobalSecondaryIndexes'] = indexes
+        return {'Table': description}
+
+    def GetItem(self, body):
+        table = self.table(body)
+        item = table.items.get(table.key_of(body['Key']))
+        return {'Item': self.project(body, item)} if item is not None else {}
+
+    def PutItem(self, body):
+        table = self.table(body)
+        item = body['Item']
+        with table.lock:
+            old = table.items.get(table.key_of(item))
+            self.check(body, old)
+            table.put(item)
+        return {'Attributes': old} if body.get('ReturnValues') == 'ALL_OLD' and old else {}
+
+    def UpdateItem(self, body):
+        table = self.table(body)
+        key = table.key_of(body['Key'])
+        with table.lock:
+            old = table.items.get(key)
+            self.check(body, old)
+            item = json.loads(json.dumps(old)) if old else dict(body['Key'])
+            update = self.expression(body, 'UpdateExpression')
+            if update:
+                apply_updates(item, update.updates())
+            table.put(item)
+        returns = body.get('ReturnValues', 'NONE')
+        if returns in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': item}
+        if returns in ('ALL_OLD', 'UPDATED_OLD') and old:
+            return {'Attributes': old}
+        return {}
+
+    def DeleteItem(self, body):
+        table = self.table(body)
+        key = table.key_of(body['Key'])
+        with table.lock:
+            self.check(body, table.items.get(key))
+            old = table.delete(key)
+        return {'Attributes': old} if body.get('ReturnValues') == 'ALL_OLD' and old else {}
+
+    def Query(self, body):
+        table = self.table(body)
+        index = body.get('IndexName')
+        hash_name, _ = table.schema(index)
+        hash_value, range_test = Expression(
+            body['KeyConditionExpression'], body.get('ExpressionAttributeNames'), body.get('ExpressionAttributeValues')
+        ).key_condition(hash_name)
+        start = body.get('ExclusiveStartKey')
+        start_key = table.key_of(start) if start else None
+        rows = table.query(index, plain(hash_value), range_test, body.get('ScanIndexForward', True), start_key)
+        return self.page(body, table, index, rows)
+
+    def Scan(self, body):
+        table = self.table(body)
+        start = body.get('ExclusiveStartKey')
+        start_key = table.key_of(start) if start else None
+        rows = table.scan(body.get('Segment', 0), body.get('TotalSegments', 1), start_key)
+        return self.page(body, table, body.get('IndexName'), rows)
+
+    def BatchGetItem(self, body):
+        responses = {}
+        for table_name, request in body['RequestItems'].items():
+            table = self.tables[table_name]
+            found = []
+            for key in request['Keys']:
+                item = table.items.get(table.key_of(key))
+                if item is not None:
+                    found.append(self.project(request, item))
+            responses[table_name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def BatchWriteItem(self, body):
+        for table_name, requests in body['RequestItems'].items():
+            table = self.tables[table_name]
+            for request in requests:
+                if 'PutRequest' in request:
+                    table.put(request['PutRequest']['Item'])
+                else:
+                    table.delete(table.key_of(request['DeleteRequest']['Key']))
+        return {'UnprocessedItems': {}}
+
+
+class RawBody:
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+# S3
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, size=None):
+        end = len(self.data) if size is None else self.offset + size
+        chunk = self.data[self.offset:end]
+        self.offset += len(chunk)
+        return chunk
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class FakePaginator:
+    def __init__(self, s3, operation):
+        self.s3 = s3
+        self.operation = operation
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        if self.operation == 'list_parts':
+            yield self.s3.list_parts(**kwargs)
+            return
+        remaining = (PaginationConfig or {}).get('MaxItems')
+        while True:
+            page = self.s3.list_objects_v2(**kwargs)
+            if remaining is not None:
+                page['Contents'] = page['Contents'][:remaining]
+                remaining -= len(page['Contents'])
+            yield page
+            if not page.get('IsTruncated') or remaining == 0:
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class FakeS3:
+    """S3 client stand-in with the methods the agent, skill and dashboard call.
+
+    Objects seeded with seed_object keep only their size; objects written
+    through the client keep their bytes. Each call sleeps `latency`, and
+    transfers also take size / bandwidth when a bandwidth is given.
+    """
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.buckets = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def _call(self, operation, size=0):
+        count_call(f's3.{operation}')
+        delay = self.latency + (size / self.bandwidth if self.bandwidth and size else 0)
+        if delay:
+            time.sleep(delay)
+
+    @staticmethod
+    def _error(code, operation, status=404):
+        return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+    def _bucket(self, name, operation):
+        if name not in self.buckets:
+            raise self._error('NoSuchBucket', operation)
+        return self.buckets[name]
+
+    def _object(self, bucket, key, operation):
+        objects = self._bucket(bucket, operation)['objects']
+        if key not in objects:
+            raise self._error('404' if operation == 'HeadObject' else 'NoSuchKey', operation)
+        return objects[key]
+
+    def _store(self, bucket, key, size, data=None, etag=None, metadata=None, last_modified=None, storage_class='STANDARD'):
+        with self.lock:
+            objects = self.buckets[bucket]['objects']
+            if key not in objects:
+                bisect.insort(self.buckets[bucket]['keys'], key)
+            objects[key] = {
+                'size': size,
+                'data': data,
+                'etag': etag or f'"{hashlib.md5(data or key.encode()).hexdigest()}"',
+                'metadata': metadata or {},
+                'last_modified': last_modified or datetime.now(timezone.utc),
+                'storage_class': storage_class
+            }
+
+    def seed_bucket(self, name):
+        self.buckets.setdefault(name, {'objects': {}, 'keys': [], 'created': datetime.now(timezone.utc)})
+
+    def seed_object(self, bucket, key, size, last_modified=None, storage_class='STANDARD'):
+        self.seed_bucket(bucket)
+        self._store(bucket, key, size, last_modified=last_modified, storage_class=storage_class)
+
+    # bucket operations
+
+    def list_buckets(self, **kwargs):
+        self._call('ListBuckets')
+        return {'Buckets': [{'Name': name, 'CreationDate': bucket['created']} for name, bucket in self.buckets.items()]}
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._call('CreateBucket')
+        if Bucket in self.buckets:
+            raise self._error('BucketAlreadyOwnedByYou', 'CreateBucket', 409)
+        self.seed_bucket(Bucket)
+        return {'Location': f'/{Bucket}'}
+
+    def head_bucket(self, Bucket, **kwargs):
+        self._call('HeadBucket')
+        self._bucket(Bucket, 'HeadBucket')
+        return {}
+
+    def put_bucket_lifecycle_configuration(self, Bucket, LifecycleConfiguration, **kwargs):
+        self._call('PutBucketLifecycleConfiguration')
+        self._bucket(Bucket, 'PutBucketLifecycleConfiguration')['lifecycle'] = LifecycleConfiguration
+        return {}
+
+    def get_paginator(self, operation):
+        return FakePaginator(self, operation)
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', MaxKeys=1000, ContinuationToken=None, Delimiter=None, **kwargs):
+        self._call('ListObjectsV2')
+        bucket = self._bucket(Bucket, 'ListObjectsV2')
+        keys = bucket['keys']
+        after = ContinuationToken or StartAfter
+        position = max(bisect.bisect_right(keys, after), bisect.bisect_left(keys, Prefix))
+        contents, prefixes = [], []
+        while position < len(keys) and len(contents) + len(prefixes) < MaxKeys:
+            key = keys[position]
+            if not key.startswith(Prefix):
+                break
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common = Prefix + rest.split(Delimiter)[0] + Delimiter
+                prefixes.append({'Prefix': common})
+                # skip every key under this common prefix
+                position = bisect.bisect_left(keys, common + '\U0010ffff')
+                continue
+            obj = bucket['objects'][key]
+            contents.append({
+                'Key': key, 'Size': obj['size'], 'ETag': obj['etag'],
+                'LastModified': obj['last_modified'], 'StorageClass': obj['storage_class']
+            })
+            position += 1
+        truncated = position < len(keys) and keys[position].startswith(Prefix)
+        page = {'KeyCount': len(contents) + len(prefixes), 'IsTruncated': truncated, 'Contents': contents}
+        if prefixes:
+            page['CommonPrefixes'] = prefixes
+        if truncated:
+            page['NextContinuationToken'] = keys[position - 1]
+        return page
+
+    # object operations
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('HeadObject')
+        obj = self._object(Bucket, Key, 'HeadObject')
+        return {
+            'ContentLength': obj['size'], 'ETag': obj['etag'], 'LastModified': obj['last_modified'],
+            'Metadata': dict(obj['metadata']), 'StorageClass': obj['storage_class']
+        }
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        obj = self._object(Bucket, Key, 'GetObject')
+        if IfMatch and IfMatch != obj['etag']:
+            raise self._error('PreconditionFailed', 'GetObject', 412)
+        data = obj['data'] if obj['data'] is not None else bytes(obj['size'])
+        if Range:
+            start, end = (int(part) for part in Range[len('bytes='):].split('-'))
+            data = data[start:end + 1]
+        self._call('GetObject', len(data))
+        return {'Body': FakeBody(data), 'ContentLength': len(data), 'ETag': obj['etag']}
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        self._call('PutObject', len(data))
+        self._bucket(Bucket, 'PutObject')
+        self._store(Bucket, Key, len(data), data, metadata=Metadata)
+        return {'ETag': self.buckets[Bucket]['objects'][Key]['etag']}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('DeleteObject')
+        with self.lock:
+            bucket = self._bucket(Bucket, 'DeleteObject')
+            if bucket['objects'].pop(Key, None) is not None:
+                bucket['keys'].remove(Key)
+        return {}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, 'rb') as f:
+            data = f.read()
+        self._call('PutObject', len(data))
+        self._bucket(Bucket, 'PutObject')
+        self._store(Bucket, Key, len(data), data, metadata=(ExtraArgs or {}).get('Metadata'))
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        body = self.get_object(Bucket=Bucket, Key=Key)['Body']
+        with open(Filename, 'wb') as f:
+            f.write(body.read())
+
+    # multipart
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        self._call('CreateMultipartUpload')
+        self._bucket(Bucket, 'CreateMultipartUpload')
+        upload_id = hashlib.sha1(f'{Bucket}/{Key}/{time.time()}'.encode()).hexdigest()
+        self.uploads[upload_id] = {'parts': {}, 'metadata': Metadata or {}}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5=None, **kwargs):
+        self._call('UploadPart', len(Body))
+        if UploadId not in self.uploads:
+            raise self._error('NoSuchUpload', 'UploadPart')
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        self.uploads[UploadId]['parts'][PartNumber] = (etag, Body)
+        return {'ETag': etag}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        self._call('ListParts')
+        if UploadId not in self.uploads:
+            raise self._error('NoSuchUpload', 'ListParts')
+        parts = self.uploads[UploadId]['parts']
+        return {'Parts': [{'PartNumber': number, 'ETag': parts[number][0], 'Size': len(parts[number][1])} for number in sorted(parts)]}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call('CompleteMultipartUpload')
+        upload = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        data = b''.join(upload['parts'][number][1] for number in numbers)
+        digests = b''.join(hashlib.md5(upload['parts'][number][1]).digest() for number in numbers)
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(numbers)}"'
+        self._store(Bucket, Key, len(data), data, etag=etag, metadata=upload['metadata'])
+        return {'ETag': etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call('AbortMultipartUpload')
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+# installation
+
+def install(dynamodb_latency=0.0, s3_latency=0.0, s3_bandwidth=None):
+    """Route boto3 at the fakes; call before importing the modules under test.
+
+    DynamoDB requests from every client and resource created afterwards are
+    answered by a FakeDynamoDB. boto3.client('s3') returns one shared
+    FakeS3. Returns (FakeDynamoDB, FakeS3).
+    """
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    dynamodb = FakeDynamoDB(dynamodb_latency)
+    s3 = FakeS3(s3_latency, s3_bandwidth)
+
+    boto3.setup_default_session(region_name=os.environ['AWS_DEFAULT_REGION'])
+    boto3.DEFAULT_SESSION.events.register('before-send.dynamodb', dynamodb.handle)
+
+    real_client = boto3.client
+
+    def client(service_name, *args, **kwargs):
+        if service_name == 's3':
+            return s3
+        return real_client(service_name, *args, **kwargs)
+
+    boto3.client = client
+    return dynamodb, s3
+
+
+def reset_calls():
+    with calls_lock:
+        snapshot = dict(calls)
+        calls.clear()
+    return snapshot
@@ -0,0 +1,474 @@
+#Benchmarks for the skill, the dashboard backend and the local agent, run against in-memory AWS fakes
+#
+#   python benchmarks/run.py                      # all suites, compared with benchmarks/baseline.json
+#   python benchmarks/run.py --suite dashboard --rows 1000000
+#   python benchmarks/run.py --save               # record the results as the new baseline
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import contextlib
+import platform
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path[:0] = [BENCHMARK_DIR, REPO_DIR, os.path.join(REPO_DIR, 'Backend')]
+
+import fakes
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_MIX = (
+    'GetStatsIntent=3,FriendsName=2,WeatherIntent=2,LaunchRequest=2,ListSBucketsIntent=2,AddFriendIntent=1,'
+    'GetCostOptimizationIntent=1,UploadFiletoSIntent=1,DownloadFileFromSIntent=1,SetupLifecyclePolicyIntent=1,'
+    'HelloWorldIntent=1,AMAZON.HelpIntent=1'
+)
+BUCKETS = [f'bench-bucket-{n}' for n in range(8)]
+LATENCY_BUCKETS_MS = (10, 25, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 1500, 2500, 5000)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, call_counts, runs):
+    """p50/p99/mean in ms, AWS calls per run by operation, and runs per second"""
+    total = sum(latencies)
+    return {
+        'runs': runs,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(total / len(latencies) * 1000, 3),
+        'throughput_per_s': round(len(latencies) / total, 1) if total else None,
+        'calls_per_run': {name: round(count / runs, 2) for name, count in sorted(call_counts.items())},
+    }
+
+
+def measure(operation, runs):
+    latencies, call_counts = [], Counter()
+    for _ in range(runs):
+        fakes.reset_calls()
+        started = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - started)
+        call_counts.update(fakes.reset_calls())
+    return summarize(latencies, call_counts, runs)
+
+
+# seed data
+
+def user_ids(count):
+    return [f'amzn1.ask.account.BENCH{n:07d}' for n in range(count)]
+
+
+def hll_register(user_id, precision=10):
+    # the skill's distinct-users sketch register for a user
+    value = int.from_bytes(hashlib.sha1(user_id.encode('utf-8')).digest()[:8], 'big')
+    width = 64 - precision
+    return value >> width, width - (value & ((1 << width) - 1)).bit_length() + 1
+
+
+def seed_tables(dynamodb, s3, rows, users):
+    """Conversation history plus the derived tables the skill and dashboard read, in their real shapes"""
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    intents = ['GetStatsIntent', 'FriendsName', 'WeatherIntent', 'ListSBucketsIntent', 'AddFriendIntent', 'LaunchRequest']
+    ids = user_ids(users)
+    conversations, stats, rollups = [], defaultdict(lambda: {'conversation_count': 0}), defaultdict(lambda: defaultdict(int))
+    rollup_users = defaultdict(lambda: bytearray(1 << 10))
+    for n in range(rows):
+        user_id = ids[n % users]
+        at = now - timedelta(seconds=rng.randrange(0, 2 * 24 * 3600))
+        intent = rng.choice(intents)
+        timestamp = at.isoformat()
+        conversations.append({
+            'user_id': user_id, 'timestamp': timestamp, 'intent_name': intent, 'request_type': 'IntentRequest',
+            'utterance': 'N/A', 'date': at.strftime('%Y-%m-%d')
+        })
+        stats[user_id]['conversation_count'] += 1
+        stats[user_id]['last_seen'] = max(stats[user_id].get('last_seen', ''), timestamp)
+        index, rank = hll_register(user_id)
+        for period in (f"hour#{at.strftime('%Y-%m-%dT%H')}", 'all'):
+            rollups[period]['requests'] += 1
+            rollups[period][f'intent_{intent}'] += 1
+            if period != 'all':
+                rollup_users[period][index] = max(rollup_users[period][index], rank)
+        # timing counters as the skill's InvocationMetrics adds them to the hourly timing item
+        hour = rollups[f"timing#hour#{at.strftime('%Y-%m-%dT%H')}"]
+        duration = rng.lognormvariate(3, 0.6)
+        hour['timed_requests'] += 1
+        hour['duration_ms'] += round(duration)
+        hour['cpu_ms'] += round(duration * 0.3)
+        hour['dynamodb_calls'] += 3
+        hour['dynamodb_ms'] += 9
+        hour[f'latency_{intent}_{next((str(b) for b in LATENCY_BUCKETS_MS if duration <= b), "inf")}'] += 1
+    dynamodb.seed('VirtualAssistant-ConversationHistory', conversations)
+
+    profiles = []
+    for n, user_id in enumerate(ids):
+        friends = [f'Friend {f}' for f in range(n % 6)]
+        profiles.append({'user_id': user_id, 'name': f'User {n}', 'friends': friends, 'preferences': {'location': 'Seattle'}})
+        stats[user_id].update(friends_count=len(friends), name=f'User {n}')
+    dynamodb.seed('VirtualAssistant-UserProfiles', profiles)
+    dynamodb.seed('VirtualAssistant-UserStats', [{'user_id': user_id, **values} for user_id, values in stats.items()])
+    dynamodb.seed('VirtualAssistant-AnalyticsRollups', [{'period': period, **counters} for period, counters in rollups.items()])
+    dynamodb.seed('VirtualAssistant-AnalyticsRollups', [
+        {'period': f'users#{period}', 'registers': bytes(registers), 'version': 1}
+        for period, registers in rollup_users.items()
+    ])
+
+    # the skill only counts errors in UsageAnalytics; request totals come from the rollups
+    dynamodb.seed('VirtualAssistant-UsageAnalytics', [
+        {'metric_type': 'errors', 'date': (now - timedelta(days=day)).strftime('%Y-%m-%d'), 'count': rng.randrange(0, 20)}
+        for day in range(30)
+    ])
+
+    metrics = []
+    for bucket in BUCKETS:
+        for n in range(200):
+            s3.seed_object(bucket, f'media/{n:05d}.mp4', rng.randrange(1, 200) * 1024 * 1024,
+                           last_modified=now - timedelta(days=rng.randrange(0, 90)))
+        metrics.append({
+            'bucket_name': bucket, 'date': now.strftime('%Y-%m-%d'), 'timestamp': now.isoformat(),
+            'object_count': 200, 'total_size_bytes': 200 * 100 * 1024 * 1024, 'old_objects': 120, 'large_objects': 90,
+            'storage_classes': {'STANDARD': 200}
+        })
+    dynamodb.seed('VirtualAssistant-CostMetrics', metrics)
+
+
+# skill
+
+def envelope(intent, user_id, slots=None, request_id='bench'):
+    request = {'requestId': request_id, 'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), 'locale': 'en-US'}
+    if intent in ('LaunchRequest', 'SessionEndedRequest'):
+        request['type'] = intent
+    else:
+        request['type'] = 'IntentRequest'
+        request['intent'] = {
+            'name': intent, 'confirmationStatus': 'NONE',
+            'slots': {name: {'name': name, 'value': value, 'confirmationStatus': 'NONE'} for name, value in (slots or {}).items()}
+        }
+    return {
+        'version': '1.0',
+        'session': {'new': False, 'sessionId': 'bench-session', 'application': {'applicationId': 'bench'}, 'user': {'userId': user_id}},
+        'context': {'System': {'application': {'applicationId': 'bench'}, 'user': {'userId': user_id}, 'apiEndpoint': 'https://api.amazonalexa.com'}},
+        'request': request
+    }
+
+
+def intent_slots(intent, n):
+    bucket = BUCKETS[n % len(BUCKETS)]
+    if intent == 'AddFriendIntent':
+        return {'friendName': f'friend {n}'}
+    if intent == 'CreateSBucketIntent':
+        return {'bucketName': f'bench-created-{n}'}
+    if intent in ('UploadFiletoSIntent', 'DownloadFileFromSIntent'):
+        return {'fileName': f'report {n} dot pdf', 'bucketName': bucket}
+    if intent in ('GetCostOptimizationIntent', 'SetupLifecyclePolicyIntent'):
+        return {'bucketName': bucket}
+    return None
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_skill(args, dynamodb, s3):
+    results = {}
+    started = time.perf_counter()
+    import lambda_function
+    results['import_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    ids = user_ids(args.users)
+    mix = parse_mix(args.mix)
+    rng = random.Random(11)
+    intents = rng.choices(list(mix), weights=list(mix.values()), k=args.invocations)
+
+    fakes.reset_calls()
+    started = time.perf_counter()
+    lambda_function.lambda_handler(envelope('LaunchRequest', ids[0]), None)
+    results['first_invocation_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    results['first_invocation_calls'] = fakes.reset_calls()
+    results['client_build_ms'] = lambda_function.clients.stats()
+
+    per_intent = defaultdict(lambda: ([], Counter()))
+    all_latencies, all_calls = [], Counter()
+    for n, intent in enumerate(intents):
+        event = envelope(intent, ids[rng.randrange(len(ids))], intent_slots(intent, n), request_id=f'bench-{n}')
+        fakes.reset_calls()
+        started = time.perf_counter()
+        lambda_function.lambda_handler(event, None)
+        elapsed = time.perf_counter() - started
+        made = fakes.reset_calls()
+        per_intent[intent][0].append(elapsed)
+        per_intent[intent][1].update(made)
+        all_latencies.append(elapsed)
+        all_calls.update(made)
+    results['overall'] = summarize(all_latencies, all_calls, len(all_latencies))
+    results['intents'] = {
+        intent: summarize(latencies, call_counts, len(latencies))
+        for intent, (latencies, call_counts) in sorted(per_intent.items())
+    }
+    return results
+
+
+# dashboard
+
+def run_dashboard(args, dynamodb, s3):
+    import dashboard_backend
+    cache = dashboard_backend.dashboard_cache
+    # payloads are built explicitly below; the background refresher would add its reads to the counts
+    cache.start = lambda: None
+
+    results = {'build': {}, 'serve': {}}
+    for name, endpoint in cache.endpoints.items():
+        builder = endpoint['builder']
+        results['build'][name] = measure(lambda: builder(dashboard_backend.DashboardSnapshot()), args.builds)
+
+    cache.refresh(list(cache.endpoints))
+    client = dashboard_backend.app.test_client()
+    routes = sorted(
+        rule.rule for rule in dashboard_backend.app.url_map.iter_rules()
+        if rule.rule.startswith('/api/dashboard/') and not rule.rule.endswith('/stream')
+    )
+    for route in routes:
+        results['serve'][route] = measure(lambda: client.get(route), args.serves)
+        etag = client.get(route).headers.get('ETag')
+        if etag:
+            results['serve'][f'{route} (If-None-Match)'] = measure(
+                lambda: client.get(route, headers={'If-None-Match': etag}), args.serves
+            )
+    return results
+
+
+# agent
+
+def run_agent(args, dynamodb, s3, intake='poll'):
+    import local_upload
+    folder = tempfile.mkdtemp(prefix='cloudbutler-bench-folder-')
+    local_upload.LOCAL_FOLDER = folder
+    rng = random.Random(5)
+    now = datetime.now(timezone.utc)
+    uploads, downloads, sizes = [], [], []
+    for n in range(args.burst):
+        size = rng.choice([4 * 1024, 64 * 1024, 512 * 1024, 2 * 1024 * 1024])
+        name = f'upload-{n:05d}.bin'
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(os.urandom(size))
+        sizes.append(size)
+        request_id = f'bench-upload-{n}'
+        uploads.append({
+            'request_id': request_id, 'timestamp': (now - timedelta(seconds=n % 60)).isoformat(), 'status': 'pending',
+            'file_name': name, 'bucket_name': BUCKETS[n % len(BUCKETS)], 'user_id': 'bench',
+            'queue_shard': f"open#{int(hashlib.md5(request_id.encode('utf-8')).hexdigest(), 16) % local_upload.QUEUE_SHARDS}"
+        })
+    for n in range(args.burst // 2):
+        key = f'media/{n:05d}.mp4'
+        bucket = BUCKETS[n % len(BUCKETS)]
+        s3.seed_object(bucket, key, 64 * 1024)
+        sizes.append(64 * 1024)
+        request_id = f'bench-download-{n}'
+        downloads.append({
+            'request_id': request_id, 'timestamp': (now - timedelta(seconds=n % 60)).isoformat(), 'status': 'pending',
+            'file_name': key, 'bucket_name': bucket, 'user_id': 'bench',
+            'queue_shard': f"open#{int(hashlib.md5(request_id.encode('utf-8')).hexdigest(), 16) % local_upload.QUEUE_SHARDS}"
+        })
+    os.makedirs(os.path.join(folder, 'media'), exist_ok=True)
+    # the skill suite queues requests for files that do not exist locally; the burst starts from a clean queue
+    for table in ('VirtualAssistant-FileUploadRequest', 'VirtualAssistant-FileDownloadRequest'):
+        dynamodb.truncate(table)
+    dynamodb.seed('VirtualAssistant-FileUploadRequest', uploads)
+    dynamodb.seed('VirtualAssistant-FileDownloadRequest', downloads)
+
+    handler = local_upload.UploadHandler()
+    finished = {}
+    lock = threading.Lock()
+    for method in ('update_request_status', 'update_download_request_status'):
+        original = getattr(handler, method)
+
+        def timed(request, status, error_message=None, original=original):
+            original(request, status, error_message)
+            with lock:
+                finished[request['request_id']] = (time.perf_counter(), status)
+        setattr(handler, method, timed)
+
+    total = len(uploads) + len(downloads)
+    if intake == 'stream':
+        # each table's rows arrive on a LocalChangeStream; the second half lands on a child shard
+        state = tempfile.mkdtemp(prefix='cloudbutler-bench-streams-')
+        streams, intakes = [], []
+        for table, rows, on_insert in (
+            ('VirtualAssistant-FileUploadRequest', uploads, handler.handle_upload_item),
+            ('VirtualAssistant-FileDownloadRequest', downloads, handler.handle_download_item)
+        ):
+            stream = local_upload.LocalChangeStream()
+            for n, row in enumerate(rows):
+                if n == len(rows) // 2:
+                    stream.split()
+                stream.append(row)
+            streams.append(stream)
+            intakes.append(local_upload.ChangeFeedIntake(
+                table, on_insert, streams_client=stream, stream_arn=f'local:{table}',
+                checkpoint_path=os.path.join(state, f'{table}.checkpoints.json')
+            ))
+
+    fakes.reset_calls()
+    started = time.perf_counter()
+    if intake == 'stream':
+        read = 0
+        while read < total:
+            read += sum(feed.poll() for feed in intakes)
+    else:
+        handler.check_for_requests()
+        handler.check_for_download_requests()
+    intake_done = time.perf_counter()
+    while len(finished) < total and time.perf_counter() - started < args.agent_timeout:
+        if intake == 'stream':
+            for feed in intakes:
+                feed.poll()
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    call_counts = fakes.reset_calls()
+    latencies = [at - started for at, _ in finished.values()]
+    checks = {}
+    if intake == 'stream':
+        # once every request is claimed, each checkpoint sits on its shard's last record;
+        # retiring the closed parent shard must drop its checkpoint
+        for feed in intakes:
+            feed.poll()
+        checks['checkpoints_at_end'] = all(
+            feed.checkpoints.get(stream.current) == f"{stream.sequence:021d}" for feed, stream in zip(intakes, streams)
+        )
+        for feed, stream in zip(intakes, streams):
+            stream.trim('shard-0')
+            feed.refresh_shards()
+        checks['closed_shards_pruned'] = all('shard-0' not in feed.checkpoints for feed in intakes)
+    return {
+        **checks,
+        'requests': total,
+        'completed': sum(1 for _, status in finished.values() if status == 'completed'),
+        'intake_ms': round((intake_done - started) * 1000, 3),
+        'wall_ms': round(elapsed * 1000, 3),
+        'requests_per_s': round(len(finished) / elapsed, 1),
+        'mb_per_s': round(sum(sizes) / elapsed / (1024 * 1024), 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'calls_per_request': {name: round(count / total, 2) for name, count in sorted(call_counts.items())},
+        'scheduler': handler.scheduler.report(),
+    }
+
+
+# reporting
+
+def flatten(results, prefix=''):
+    """(path, metrics) for every entry that has a p50"""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            if 'p50_ms' in value:
+                yield f'{prefix}{name}', value
+            else:
+                yield from flatten(value, f'{prefix}{name}/')
+
+
+def compare(results, baseline, threshold):
+    previous = dict(flatten(baseline.get('results', {})))
+    regressions = []
+    print(f"\n{'benchmark':<70} {'p50 ms':>10} {'base':>10} {'ratio':>7}")
+    for path, metrics in flatten(results):
+        before = previous.get(path)
+        base = before['p50_ms'] if before and before.get('p50_ms') else None
+        ratio = metrics['p50_ms'] / base if base and metrics['p50_ms'] is not None else None
+        flag = ' REGRESSION' if ratio and ratio > threshold else ''
+        if flag:
+            regressions.append(path)
+        base_text = f'{base:.3f}' if base else '-'
+        ratio_text = f'{ratio:.2f}' if ratio else '-'
+        print(f"{path:<70} {metrics['p50_ms'] or 0:>10.3f} {base_text:>10} {ratio_text:>7}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CloudButler benchmarks against in-memory DynamoDB/S3 fakes')
+    parser.add_argument('--suite', choices=['skill', 'dashboard', 'agent', 'agent-stream', 'all'], default='all')
+    parser.add_argument('--rows', type=int, default=10000, help='conversation history rows to seed')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--invocations', type=int, default=300, help='skill invocations')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='intent mix as Name=weight,...')
+    parser.add_argument('--builds', type=int, default=20, help='cold builds per dashboard payload')
+    parser.add_argument('--serves', type=int, default=200, help='requests per dashboard route')
+    parser.add_argument('--burst', type=int, default=200, help='upload requests in the agent burst (plus half as many downloads)')
+    parser.add_argument('--agent-timeout', type=float, default=120)
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=2.0)
+    parser.add_argument('--s3-latency-ms', type=float, default=5.0)
+    parser.add_argument('--s3-mbps', type=float, default=0, help='per-stream S3 bandwidth, 0 for unlimited')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--verbose', action='store_true', help='show the output of the code under test')
+    parser.add_argument('--save', action='store_true', help='write the results to the baseline file')
+    parser.add_argument('--threshold', type=float, default=1.25, help='p50 ratio over the baseline reported as a regression')
+    args = parser.parse_args()
+
+    os.environ.setdefault('CLOUDBUTLER_STATE_DIR', tempfile.mkdtemp(prefix='cloudbutler-bench-state-'))
+    dynamodb, s3 = fakes.install(
+        dynamodb_latency=args.dynamodb_latency_ms / 1000,
+        s3_latency=args.s3_latency_ms / 1000,
+        s3_bandwidth=args.s3_mbps * 1024 * 1024 or None
+    )
+    import logging
+    logging.disable(logging.INFO)
+
+    started = time.perf_counter()
+    seed_tables(dynamodb, s3, args.rows, args.users)
+    print(f"Seeded {args.rows} conversation rows for {args.users} users in {time.perf_counter() - started:.1f}s")
+
+    suites = ['skill', 'dashboard', 'agent', 'agent-stream'] if args.suite == 'all' else [args.suite]
+    runners = {
+        'skill': run_skill, 'dashboard': run_dashboard, 'agent': run_agent,
+        'agent-stream': lambda args, dynamodb, s3: run_agent(args, dynamodb, s3, intake='stream')
+    }
+    results = {}
+    for suite in suites:
+        started = time.perf_counter()
+        # the modules log with print; keep their output out of the report unless asked for
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, 'w')):
+            results[suite] = runners[suite](args, dynamodb, s3)
+        print(f"{suite}: {time.perf_counter() - started:.1f}s")
+
+    report = {
+        'meta': {
+            'recorded_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'rows': args.rows, 'users': args.users,
+            'dynamodb_latency_ms': args.dynamodb_latency_ms, 's3_latency_ms': args.s3_latency_ms, 's3_mbps': args.s3_mbps
+        },
+        'results': results
+    }
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    else:
+        compare(results, {}, args.threshold)
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True, default=str)
+        print(f"Baseline written to {args.baseline}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold}x the baseline p50")
+    return 1 if regressions and not args.save else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,53 +1,725 @@
 # Lambda Function Code
 
-import logging
 import time
+# measured to the end of the module so cold-start regressions show up in the logs
+_import_started = time.perf_counter()
+
+import logging
 import os
+import resource
+import threading
 import json
 import boto3
 import traceback
+import copy
+import fcntl
+import hashlib
+import random
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
+from boto3.dynamodb.conditions import Key, ConditionExpressionBuilder
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import ask_sdk_core.utils as ask_utils
 from ask_sdk_core.skill_builder import SkillBuilder
+from ask_sdk_runtime.dispatch_components.request_components import AbstractRequestMapper
 from ask_sdk_core.dispatch_components import (
     AbstractRequestHandler,
     AbstractExceptionHandler,
-    AbstractRequestInterceptor,
-    AbstractResponseInterceptor
+    AbstractRequestInterceptor
 )
 from ask_sdk_core.handler_input import HandlerInput
-from ask_sdk_model import Response
+from ask_sdk_model import Response, RequestEnvelope
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-dynamodb = boto3.resource('dynamodb')
-user_profiles_table = dynamodb.Table('VirtualAssistant-UserProfiles')
-conversation_history_table = dynamodb.Table('VirtualAssistant-ConversationHistory')
-usage_analytics_table = dynamodb.Table('VirtualAssistant-UsageAnalytics')
+USER_PROFILES_TABLE = 'VirtualAssistant-UserProfiles'
+CONVERSATION_HISTORY_TABLE = 'VirtualAssistant-ConversationHistory'
+USAGE_ANALYTICS_TABLE = 'VirtualAssistant-UsageAnalytics'
+USER_STATS_TABLE = 'VirtualAssistant-UserStats'
+ANALYTICS_ROLLUPS_TABLE = 'VirtualAssistant-AnalyticsRollups'
+COST_METRICS_TABLE = 'VirtualAssistant-CostMetrics'
+UPLOAD_REQUEST_TABLE = 'VirtualAssistant-FileUploadRequest'
+DOWNLOAD_REQUEST_TABLE = 'VirtualAssistant-FileDownloadRequest'
+
+# wire types of the attributes read on hot paths, decoded without type dispatch
+TABLE_SCHEMAS = {
+    USER_PROFILES_TABLE: {'user_id': 'S', 'name': 'S', 'updated_at': 'S'},
+    USER_STATS_TABLE: {
+        'user_id': 'S', 'name': 'S', 'last_seen': 'S', 'conversation_count': 'N', 'friends_count': 'N'
+    },
+    COST_METRICS_TABLE: {
+        'bucket_name': 'S', 'date': 'S', 'timestamp': 'S', 'object_count': 'N', 'total_size_bytes': 'N',
+        'old_objects': 'N', 'large_objects': 'N'
+    },
+}
+
+# DynamoDB wire format
+#
+# Items are read and written through the low-level client and converted in one
+# pass between wire format ({'N': '42'}, {'M': {...}}) and plain Python values,
+# instead of the resource layer's Decimals plus a second pass to undo them.
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+_FROM_WIRE = {
+    'S': lambda v: v,
+    'N': _number,
+    'BOOL': lambda v: v,
+    'NULL': lambda v: None,
+    'B': lambda v: v,
+    'SS': set,
+    'NS': lambda v: {_number(n) for n in v},
+    'BS': set,
+    'L': lambda v: [from_wire(x) for x in v],
+    'M': lambda v: {k: from_wire(x) for k, x in v.items()},
+}
+
+def from_wire(value):
+    """One wire-format attribute value as int/float/str/bool/None/bytes/list/dict/set"""
+    for tag, raw in value.items():
+        return _FROM_WIRE[tag](raw)
+
+def to_wire(value):
+    """One Python value as a wire-format attribute value"""
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, dict):
+        return {'M': {k: to_wire(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'L': [to_wire(v) for v in value]}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(v, str) for v in value):
+            return {'SS': list(value)}
+        if all(isinstance(v, (bytes, bytearray)) for v in value):
+            return {'BS': [bytes(v) for v in value]}
+        return {'NS': [str(v) for v in value]}
+    raise TypeError(f"Cannot store {type(value).__name__} in DynamoDB")
+
+def item_from_wire(item):
+    return {name: from_wire(value) for name, value in item.items()}
+
+def item_to_wire(item):
+    return {name: to_wire(value) for name, value in item.items()}
+
+def item_decoder(schema):
+    """Decoder for items of a known shape; `schema` maps attribute names to wire types.
+
+    Attributes in the schema are read with their tag directly instead of being
+    dispatched on; anything else, or a value whose type differs, goes through
+    from_wire.
+    """
+    readers = {name: (tag, _FROM_WIRE[tag]) for name, tag in schema.items()}
+    def decode(item):
+        native = {}
+        for name, value in item.items():
+            reader = readers.get(name)
+            if reader is not None and reader[0] in value:
+                native[name] = reader[1](value[reader[0]])
+            else:
+                native[name] = from_wire(value)
+        return native
+    return decode
+
+class NativeTable:
+    """One table on the low-level DynamoDB client, called like a resource Table.
+
+    Keys, items and expression values go in as plain Python values and items
+    come back as plain Python values, with numbers as int or float rather
+    than Decimal. Key() and Attr() conditions are accepted as with the
+    resource. LastEvaluatedKey is returned native and ExclusiveStartKey is
+    taken native, so pagination loops work unchanged.
+    """
+    CONDITIONS = ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression')
+
+    def __init__(self, client, name, schema=None):
+        self.client = client
+        self.name = name
+        self.decode = item_decoder(schema) if schema else item_from_wire
+
+    def encode_request(self, kwargs):
+        kwargs['TableName'] = self.name
+        builder = ConditionExpressionBuilder()
+        for parameter in self.CONDITIONS:
+            condition = kwargs.get(parameter)
+            if condition is not None and not isinstance(condition, str):
+                built = builder.build_expression(condition, is_key_condition=parameter == 'KeyConditionExpression')
+                kwargs[parameter] = built.condition_expression
+                # copied so a caller reusing its kwargs across pages is not modified
+                kwargs['ExpressionAttributeNames'] = {
+                    **kwargs.get('ExpressionAttributeNames', {}), **built.attribute_name_placeholders
+                }
+                kwargs['ExpressionAttributeValues'] = {
+                    **kwargs.get('ExpressionAttributeValues', {}), **built.attribute_value_placeholders
+                }
+        for parameter in ('Key', 'Item', 'ExclusiveStartKey', 'ExpressionAttributeValues'):
+            if parameter in kwargs:
+                kwargs[parameter] = item_to_wire(kwargs[parameter])
+        return kwargs
+
+    def decode_response(self, response):
+        if 'Item' in response:
+            response['Item'] = self.decode(response['Item'])
+        if 'Items' in response:
+            response['Items'] = [self.decode(item) for item in response['Items']]
+        if 'Attributes' in response:
+            response['Attributes'] = self.decode(response['Attributes'])
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = item_from_wire(response['LastEvaluatedKey'])
+        return response
+
+    def get_item(self, **kwargs):
+        return self.decode_response(self.client.get_item(**self.encode_request(kwargs)))
+
+    def put_item(self, **kwargs):
+        return self.decode_response(self.client.put_item(**self.encode_request(kwargs)))
+
+    def update_item(self, **kwargs):
+        return self.decode_response(self.client.update_item(**self.encode_request(kwargs)))
+
+    def delete_item(self, **kwargs):
+        return self.decode_response(self.client.delete_item(**self.encode_request(kwargs)))
+
+    def query(self, **kwargs):
+        return self.decode_response(self.client.query(**self.encode_request(kwargs)))
+
+    def scan(self, **kwargs):
+        return self.decode_response(self.client.scan(**self.encode_request(kwargs)))
+
+# per-invocation metrics are logged as CloudWatch Embedded Metric Format lines
+METRICS_EMF = os.environ.get('METRICS_EMF', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CloudButler')
+# upper bounds in ms of the per-intent latency histogram kept in the hourly rollups
+LATENCY_BUCKETS_MS = (10, 25, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 1500, 2500, 5000)
+METRIC_SERVICES = {'dynamodb': 'DynamoDB', 's3': 'S3'}
+
+class InvocationMetrics:
+    """Wall time of one invocation and the count and latency of its AWS calls.
+
+    ClientRegistry hooks every client it builds into botocore's before-call
+    and after-call events, so calls are timed wherever they are made,
+    including the analytics flush threads. A call's latency covers its
+    retries. Counters are reset by begin() at the start of each invocation.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.begin()
+
+    def begin(self):
+        with self.lock:
+            self.calls = defaultdict(int)
+            self.call_ms = defaultdict(float)
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def watch(self, client):
+        events = client.meta.events
+        events.register('before-call', self.before_call)
+        events.register('after-call', self.after_call)
+        events.register('after-call-error', self.after_call)
+
+    def before_call(self, context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    def after_call(self, event_name, context, **kwargs):
+        started = context.pop('metrics_started', None)
+        if started is None:
+            return
+        service = event_name.split('.')[1]
+        with self.lock:
+            self.calls[service] += 1
+            self.call_ms[service] += (time.perf_counter() - started) * 1000
+
+    def snapshot(self):
+        """Elapsed wall and CPU milliseconds and the calls made so far"""
+        with self.lock:
+            calls, call_ms = dict(self.calls), dict(self.call_ms)
+        return {
+            'duration_ms': (time.perf_counter() - self.started) * 1000,
+            'cpu_ms': (time.process_time() - self.cpu_started) * 1000,
+            'calls': calls,
+            'call_ms': call_ms,
+        }
 
-class DynamoDBHelper:
     @staticmethod
-    def decimal_to_int(obj):
-        if isinstance(obj, list):
-            return [DynamoDBHelper.decimal_to_int(i) for i in obj]
-        elif isinstance(obj, dict):
-            return {k: DynamoDBHelper.decimal_to_int(v) for k, v in obj.items()}
-        elif isinstance(obj, Decimal):
-            return int(obj) if obj % 1 == 0 else float(obj)
-        else:
-            return obj
+    def latency_bucket(duration_ms):
+        for bound in LATENCY_BUCKETS_MS:
+            if duration_ms <= bound:
+                return str(bound)
+        return 'inf'
+
+    @staticmethod
+    def rollup_increments(intent, handled, cold, memory_limit_mb=None):
+        """Counters added to the hourly rollup so the dashboard can derive latency percentiles"""
+        increments = {
+            'timed_requests': 1,
+            'duration_ms': round(handled['duration_ms']),
+            'cpu_ms': round(handled['cpu_ms']),
+            f"latency_{intent}_{InvocationMetrics.latency_bucket(handled['duration_ms'])}": 1,
+        }
+        if cold:
+            increments['cold_starts'] = 1
+        for service, count in handled['calls'].items():
+            increments[f'{service}_calls'] = count
+            increments[f'{service}_ms'] = round(handled['call_ms'][service])
+        if memory_limit_mb:
+            # ru_maxrss is the process peak in KB on Linux
+            increments['memory_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+            increments['memory_limit_mb'] = int(memory_limit_mb)
+        return increments
+
+    @staticmethod
+    def emf_record(intent, handled, finished, cold, profile_lookups=None):
+        """One EMF log line: CloudWatch extracts the metrics, per intent and overall"""
+        profile_lookups = profile_lookups or {}
+        values = {
+            'Duration': round(handled['duration_ms'], 2),
+            'TotalDuration': round(finished['duration_ms'], 2),
+            'CpuTime': round(finished['cpu_ms'], 2),
+            'ColdStart': 1 if cold else 0,
+            'ProfileCacheHits': profile_lookups.get('hits', 0),
+            'ProfileCacheMisses': profile_lookups.get('misses', 0),
+        }
+        units = {
+            'Duration': 'Milliseconds', 'TotalDuration': 'Milliseconds', 'CpuTime': 'Milliseconds', 'ColdStart': 'Count',
+            'ProfileCacheHits': 'Count', 'ProfileCacheMisses': 'Count'
+        }
+        for service, name in METRIC_SERVICES.items():
+            values[f'{name}Calls'] = finished['calls'].get(service, 0)
+            values[f'{name}Latency'] = round(finished['call_ms'].get(service, 0.0), 2)
+            units[f'{name}Calls'] = 'Count'
+            units[f'{name}Latency'] = 'Milliseconds'
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['Intent'], []],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]
+                }]
+            },
+            'Intent': intent,
+            **values
+        }
+
+metrics = InvocationMetrics()
+
+# services whose clients are built during init instead of on first use, e.g. "dynamodb,s3"
+PREWARM_CLIENTS = [s.strip() for s in os.environ.get('PREWARM_CLIENTS', '').split(',') if s.strip()]
+# connections are kept alive between warm invocations; the pool covers the analytics flush workers
+CLIENT_CONFIG = Config(tcp_keepalive=True, max_pool_connections=16)
+
+class ClientRegistry:
+    """boto3 clients built on first use and kept for the container's life.
+
+    Building a client loads and parses the service model, which costs tens of
+    milliseconds, so each (service, region) is built once and shared by every
+    handler. DynamoDB tables are NativeTables over the shared client, cached
+    by name. Creation times are kept in `timings` for the cold-start log line.
+    """
+    def __init__(self, config=None):
+        self.config = config
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.tables = {}
+        self.timings = {}
+
+    def client(self, service, region=None):
+        key = (service, region)
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                started = time.perf_counter()
+                client = boto3.client(service, region_name=region, config=self.config)
+                if hasattr(client, 'meta'):
+                    metrics.watch(client)
+                self.timings[service + (f':{region}' if region else '')] = time.perf_counter() - started
+                self.clients[key] = client
+        return client
+
+    def table(self, name, region=None):
+        key = (name, region)
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = NativeTable(self.client('dynamodb', region), name, TABLE_SCHEMAS.get(name))
+        return table
+
+    def prewarm(self, services):
+        """Build clients ahead of the first request"""
+        for service in services:
+            self.client(service)
+
+    def stats(self):
+        return {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+
+clients = ClientRegistry(CLIENT_CONFIG)
+
+# open transfer requests carry queue_shard so the agent can query a sparse GSI
+QUEUE_SHARDS = 4  # must match QUEUE_SHARDS in local_upload.py
+
+# inventory summaries older than this are ignored by the cost analysis
+COST_METRICS_MAX_AGE_HOURS = int(os.environ.get('COST_METRICS_MAX_AGE_HOURS', '48'))
+
+# analytics writes are buffered and flushed once per invocation unless disabled
+ANALYTICS_WRITE_BEHIND = os.environ.get('ANALYTICS_WRITE_BEHIND', 'true').lower() == 'true'
+ANALYTICS_FLUSH_WORKERS = int(os.environ.get('ANALYTICS_FLUSH_WORKERS', '4'))
+
+# distinct users per hour and day are a HyperLogLog sketch of 2**HLL_PRECISION
+# one-byte registers, kept on a 'users#<period>' item: about 3% error in 1 KB
+HLL_PRECISION = 10  # must match HLL_PRECISION in Backend/dashboard_backend.py and backfill.py
+HLL_ATTEMPTS = 5
+
+def hll_register(user_id):
+    """(register index, rank) a user sets in a distinct-users sketch"""
+    value = int.from_bytes(hashlib.sha1(user_id.encode('utf-8')).digest()[:8], 'big')
+    width = 64 - HLL_PRECISION
+    return value >> width, width - (value & ((1 << width) - 1)).bit_length() + 1
+
+# conversation rows go to this queue instead of the history table when set:
+# an SQS queue URL, or file:///path/conversations.jsonl as a local stand-in
+CONVERSATION_QUEUE_URL = os.environ.get('CONVERSATION_QUEUE_URL', '')
+# unprocessed BatchWriteItem items are retried this many times with backoff
+BATCH_WRITE_ATTEMPTS = int(os.environ.get('BATCH_WRITE_ATTEMPTS', '5'))
+
+def batch_write_rows(table_name, items, attempts=BATCH_WRITE_ATTEMPTS, key_names=None):
+    """Put items 25 per BatchWriteItem; returns the items that could not be written.
+
+    Unprocessed items are retried with exponential backoff and jitter. A
+    group whose request fails outright is returned whole. With key_names,
+    items sharing a key are collapsed to the last one first, since a request
+    that puts the same key twice is rejected as a whole. backfill.py's
+    write_conversation_rows is a copy of this for the manual drain; a fix
+    here belongs there too.
+    """
+    if key_names:
+        items = list({tuple(item[name] for name in key_names): item for item in items}.values())
+    client = clients.client('dynamodb')
+    unwritten = []
+    for start in range(0, len(items), 25):
+        group = items[start:start + 25]
+        request_items = {table_name: [{'PutRequest': {'Item': item_to_wire(item)}} for item in group]}
+        try:
+            for attempt in range(attempts):
+                response = client.batch_write_item(RequestItems=request_items)
+                request_items = response.get('UnprocessedItems') or {}
+                if not request_items:
+                    break
+                time.sleep(min(2.0, 0.05 * (2 ** attempt)) * random.uniform(0.5, 1.0))
+        except ClientError as e:
+            logger.error(f"Error writing {len(group)} rows to {table_name}: {e}")
+            unwritten.extend(group)
+            continue
+        unwritten.extend(
+            item_from_wire(request['PutRequest']['Item']) for request in request_items.get(table_name, [])
+        )
+    return unwritten
+
+class AnalyticsBuffer:
+    """Write-behind buffer for the analytics writes of one invocation.
+
+    Counter increments are folded per item key and conversation rows are held
+    until flush() runs after the response has been built. Flushed writes are
+    issued concurrently so the invocation waits for roughly one round trip.
+    """
+    def __init__(self):
+        self.updates = {}
+        self.rows = defaultdict(list)
+        self.sketches = {}
+        # last stored registers and version of each sketch item, per container
+        self.sketch_cache = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=ANALYTICS_FLUSH_WORKERS)
+
+    def add_counter(self, table_name, key, increments, values=None):
+        item_key = (table_name, tuple(sorted(key.items())))
+        pending = self.updates.setdefault(item_key, {'add': {}, 'set': {}})
+        for attribute, value in increments.items():
+            current = pending['add'].get(attribute)
+            if current is None:
+                pending['add'][attribute] = value
+            elif isinstance(value, set):
+                pending['add'][attribute] = current | value
+            else:
+                pending['add'][attribute] = current + value
+        if values:
+            pending['set'].update(values)
+
+    def pending_increments(self, table_name, key):
+        pending = self.updates.get((table_name, tuple(sorted(key.items()))))
+        return dict(pending['add']) if pending else {}
+
+    def add_row(self, table_name, item):
+        self.rows[table_name].append(item)
+
+    def add_sketch(self, table_name, key, user_id):
+        index, rank = hll_register(user_id)
+        registers = self.sketches.setdefault((table_name, tuple(sorted(key.items()))), {})
+        registers[index] = max(rank, registers.get(index, 0))
+
+    def is_empty(self):
+        return not self.updates and not self.rows and not self.sketches
+
+    def flush(self):
+        if self.is_empty():
+            return
+        updates, self.updates = self.updates, {}
+        rows, self.rows = self.rows, defaultdict(list)
+        sketches, self.sketches = self.sketches, {}
+
+        futures = []
+        for (table_name, key), registers in sketches.items():
+            futures.append(self.executor.submit(self.write_sketch, table_name, dict(key), registers))
+        for (table_name, key), pending in updates.items():
+            futures.append(self.executor.submit(
+                self.write_update, table_name, dict(key), pending['add'], pending['set']
+            ))
+        for table_name, items in rows.items():
+            if table_name == CONVERSATION_HISTORY_TABLE and conversation_queue:
+                futures.append(self.executor.submit(conversation_queue.send, items))
+                continue
+            for start in range(0, len(items), 25):
+                futures.append(self.executor.submit(self._write_rows, table_name, items[start:start + 25]))
+
+        done, _ = wait(futures)
+        for future in done:
+            if future.exception():
+                logger.error(f"Error flushing analytics: {future.exception()}")
+
+    def write_update(self, table_name, key, increments, values=None):
+        names = {}
+        expression_values = {}
+        add_clauses = []
+        set_clauses = []
+        for i, (attribute, value) in enumerate(increments.items()):
+            names[f'#a{i}'] = attribute
+            expression_values[f':a{i}'] = value
+            add_clauses.append(f'#a{i} :a{i}')
+        for i, (attribute, value) in enumerate((values or {}).items()):
+            names[f'#s{i}'] = attribute
+            expression_values[f':s{i}'] = value
+            set_clauses.append(f'#s{i} = :s{i}')
+
+        expression = []
+        if add_clauses:
+            expression.append('ADD ' + ', '.join(add_clauses))
+        if set_clauses:
+            expression.append('SET ' + ', '.join(set_clauses))
+        clients.table(table_name).update_item(
+            Key=key,
+            UpdateExpression=' '.join(expression),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=expression_values
+        )
 
+    def write_sketch(self, table_name, key, registers):
+        """Raise a stored sketch's registers to at least the given ranks.
+
+        Registers only grow, so the merge is a read-modify-write guarded by
+        a version number. The usual case, where no register goes up against
+        the cached copy, writes nothing at all.
+        """
+        table = clients.table(table_name)
+        cache_key = (table_name, tuple(sorted(key.items())))
+        for attempt in range(HLL_ATTEMPTS):
+            with self.lock:
+                cached = self.sketch_cache.get(cache_key)
+            if cached is None:
+                item = table.get_item(Key=key, ConsistentRead=True).get('Item') or {}
+                cached = (int(item.get('version', 0)), bytes(item.get('registers') or bytes(1 << HLL_PRECISION)))
+            version, stored = cached
+            merged = bytearray(stored)
+            for index, rank in registers.items():
+                merged[index] = max(merged[index], rank)
+            if merged == stored:
+                with self.lock:
+                    self.sketch_cache[cache_key] = cached
+                return
+            try:
+                table.update_item(
+                    Key=key,
+                    UpdateExpression='SET registers = :registers, #version = :next',
+                    ConditionExpression='attribute_not_exists(#version) OR #version = :version',
+                    ExpressionAttributeNames={'#version': 'version'},
+                    ExpressionAttributeValues={':registers': bytes(merged), ':next': version + 1, ':version': version}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # another container wrote first; re-read and merge again
+                with self.lock:
+                    self.sketch_cache.pop(cache_key, None)
+                continue
+            with self.lock:
+                self.sketch_cache[cache_key] = (version + 1, bytes(merged))
+            return
+        logger.error(f"Gave up merging the {key} sketch after {HLL_ATTEMPTS} attempts")
+
+    def _write_rows(self, table_name, items):
+        unwritten = batch_write_rows(table_name, items)
+        if unwritten:
+            logger.error(f"Dropped {len(unwritten)} unprocessed rows for {table_name}")
+
+analytics_buffer = AnalyticsBuffer()
+
+class ConversationQueue:
+    """Append-only destination for conversation rows, drained off the request path.
+
+    An https:// URL is an SQS queue; each message body is a JSON list of rows.
+    A file:// URL is a local stand-in that appends the same bodies as lines
+    to a file, under an flock so a drain can move the file away safely.
+    The consumer writes rows to the history table in groups of 25.
+    """
+    MESSAGE_ROWS = 100  # keeps a message body well under the SQS 256 KB limit
+
+    def __init__(self, url):
+        self.url = url
+        self.path = url[len('file://'):] if url.startswith('file://') else None
+        self.lock = threading.Lock()
+
+    def send(self, rows):
+        bodies = [
+            json.dumps(rows[start:start + self.MESSAGE_ROWS], separators=(',', ':'), default=str)
+            for start in range(0, len(rows), self.MESSAGE_ROWS)
+        ]
+        if self.path:
+            self._append(bodies)
+            return
+        sqs = clients.client('sqs')
+        for start in range(0, len(bodies), 10):
+            entries = [{'Id': str(n), 'MessageBody': body} for n, body in enumerate(bodies[start:start + 10])]
+            response = sqs.send_message_batch(QueueUrl=self.url, Entries=entries)
+            if response.get('Failed'):
+                # one retry of the failed entries; after that the rows are lost like a failed flush
+                failed = {entry['Id'] for entry in response['Failed']}
+                response = sqs.send_message_batch(
+                    QueueUrl=self.url, Entries=[entry for entry in entries if entry['Id'] in failed]
+                )
+                if response.get('Failed'):
+                    logger.error(f"Dropped {len(response['Failed'])} conversation messages: {response['Failed'][0]}")
+
+    def _append(self, bodies):
+        with self.lock:
+            while True:
+                with open(self.path, 'a') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    # a drain may have moved the file while we waited for the lock
+                    try:
+                        current = os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino
+                    except FileNotFoundError:
+                        current = False
+                    if current:
+                        f.write(''.join(body + '\n' for body in bodies))
+                        return
+
+conversation_queue = ConversationQueue(CONVERSATION_QUEUE_URL) if CONVERSATION_QUEUE_URL else None
+
+def drain_conversation_messages(records):
+    """SQS consumer: write the rows of a batch of queue messages to the history table.
+
+    Rows from all messages are written together, 25 per BatchWriteItem, with
+    rows sharing a key (a redelivered message) written once. A message with
+    any row left unwritten, or a body that is not a list of rows, is reported
+    as a partial batch failure so SQS delivers it again (and eventually to
+    the dead-letter queue); rewriting a row is harmless because the key is
+    the same.
+    """
+    rows = []
+    owners = defaultdict(set)
+    failed = set()
+    for record in records:
+        try:
+            keyed = [((row['user_id'], row['timestamp']), row) for row in json.loads(record['body'])]
+        except (ValueError, TypeError, KeyError) as e:
+            logger.error(f"Malformed conversation message {record.get('messageId')}: {e}")
+            failed.add(record.get('messageId'))
+            continue
+        for key, row in keyed:
+            rows.append(row)
+            owners[key].add(record['messageId'])
+    unwritten = batch_write_rows(CONVERSATION_HISTORY_TABLE, rows, key_names=('user_id', 'timestamp'))
+    for row in unwritten:
+        failed |= owners[(row['user_id'], row['timestamp'])]
+    logger.info(f"Wrote {len(owners) - len(unwritten)} of {len(owners)} conversation rows from {len(records)} messages")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed)]}
+
+# user profiles are cached per container so warm invocations skip get_item
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '256'))
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', '300'))
+
+class ProfileCache:
+    """Bounded LRU cache of user profiles with a per-entry TTL.
+
+    Entries are copied in and out so handlers can mutate the profile they
+    get back without touching the cached value. A cached None records that
+    the user has no profile yet.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[user_id]
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return True, copy.deepcopy(entry[1])
+
+    def put(self, user_id, profile):
+        if self.max_size <= 0:
+            return
+        self.entries[user_id] = (time.monotonic() + self.ttl, copy.deepcopy(profile))
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self.entries.pop(user_id, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+
+class DynamoDBHelper:
     @staticmethod
     def get_user_profile(user_id):
+        found, profile = profile_cache.get(user_id)
+        if found:
+            return profile
         try:
-            response = user_profiles_table.get_item(Key={'user_id': user_id})
+            response = clients.table(USER_PROFILES_TABLE).get_item(Key={'user_id': user_id})
+            profile = None
             if 'Item' in response:
-                return DynamoDBHelper.decimal_to_int(response['Item'])
-            return None
+                profile = response['Item']
+            profile_cache.put(user_id, profile)
+            return copy.deepcopy(profile)
         except Exception as e:
             logger.error(f"Error getting user profile: {e}")
             return None
@@ -57,33 +729,165 @@ class DynamoDBHelper:
         try:
             profile_data['user_id'] = user_id
             profile_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-            user_profiles_table.put_item(Item=profile_data)
+            clients.table(USER_PROFILES_TABLE).put_item(Item=profile_data)
+            profile_cache.put(user_id, profile_data)
+            stats_values = {'friends_count': len(profile_data.get('friends', []))}
+            if profile_data.get('name'):
+                stats_values['name'] = profile_data['name']
+            DynamoDBHelper.update_user_stats(user_id, values=stats_values)
             return True
         except Exception as e:
+            # the write may or may not have landed, so re-read next time
+            profile_cache.invalidate(user_id)
             logger.error(f"Error saving user profile: {e}")
             return False
 
     @staticmethod
     def log_conversation(user_id, intent_name, request_type, utterance=None):
+        item = {
+            'user_id': user_id,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'intent_name': intent_name,
+            'request_type': request_type,
+            'utterance': utterance or 'N/A',
+            'date': datetime.now().strftime('%Y-%m-%d')
+        }
+        DynamoDBHelper.update_user_stats(
+            user_id, increments={'conversation_count': 1}, values={'last_seen': item['timestamp']}
+        )
+        DynamoDBHelper.update_rollups(user_id, intent_name)
+        if ANALYTICS_WRITE_BEHIND:
+            analytics_buffer.add_row(CONVERSATION_HISTORY_TABLE, item)
+            return
         try:
-            conversation_history_table.put_item(
-                Item={
-                    'user_id': user_id,
-                    'timestamp': datetime.now(timezone.utc).isoformat(),
-                    'intent_name': intent_name,
-                    'request_type': request_type,
-                    'utterance': utterance or 'N/A',
-                    'date': datetime.now().strftime('%Y-%m-%d')
-                }
-            )
+            if conversation_queue:
+                conversation_queue.send([item])
+            else:
+                clients.table(CONVERSATION_HISTORY_TABLE).put_item(Item=item)
         except Exception as e:
             logger.error(f"Error logging conversation: {e}")
 
+    @staticmethod
+    def update_user_stats(user_id, increments=None, values=None):
+        key = {'user_id': user_id}
+        if ANALYTICS_WRITE_BEHIND:
+            analytics_buffer.add_counter(USER_STATS_TABLE, key, increments or {}, values)
+            return
+        try:
+            analytics_buffer.write_update(USER_STATS_TABLE, key, increments or {}, values)
+        except Exception as e:
+            logger.error(f"Error updating user stats: {e}")
+
+    @staticmethod
+    def rollup_periods(now=None):
+        """Rollup items a conversation at `now` counts towards"""
+        now = now or datetime.now(timezone.utc)
+        # a day is the sum of its hours (and the register-wise max of their sketches),
+        # so no day item is kept
+        return [f"hour#{now.strftime('%Y-%m-%dT%H')}", 'all']
+
+    @staticmethod
+    def update_rollups(user_id, intent_name):
+        for period in DynamoDBHelper.rollup_periods():
+            key = {'period': period}
+            # distinct users go to a fixed-size sketch item, so the counter item stays small
+            sketch_key = {'period': f'users#{period}'} if period != 'all' else None
+            if ANALYTICS_WRITE_BEHIND:
+                analytics_buffer.add_counter(ANALYTICS_ROLLUPS_TABLE, key, {'requests': 1, f'intent_{intent_name}': 1})
+                if sketch_key:
+                    analytics_buffer.add_sketch(ANALYTICS_ROLLUPS_TABLE, sketch_key, user_id)
+                continue
+            try:
+                analytics_buffer.write_update(ANALYTICS_ROLLUPS_TABLE, key, {'requests': 1, f'intent_{intent_name}': 1})
+                if sketch_key:
+                    analytics_buffer.write_sketch(ANALYTICS_ROLLUPS_TABLE, sketch_key, dict([hll_register(user_id)]))
+            except Exception as e:
+                logger.error(f"Error updating rollups: {e}")
+
+    @staticmethod
+    def record_timing(increments):
+        """Add an invocation's timing counters to the current hour's timing item"""
+        # kept off the hour's counter item, which every request already updates
+        key = {'period': f'timing#{DynamoDBHelper.rollup_periods()[0]}'}
+        if ANALYTICS_WRITE_BEHIND:
+            analytics_buffer.add_counter(ANALYTICS_ROLLUPS_TABLE, key, increments)
+            return
+        try:
+            analytics_buffer.write_update(ANALYTICS_ROLLUPS_TABLE, key, increments)
+        except Exception as e:
+            logger.error(f"Error recording timing: {e}")
+
+    @staticmethod
+    def queue_shard(request_id):
+        shard = int(hashlib.md5(request_id.encode('utf-8')).hexdigest(), 16) % QUEUE_SHARDS
+        return f'open#{shard}'
+
+    @staticmethod
+    def get_bucket_inventory_summary(bucket_name):
+        """Latest full-bucket summary published by the local agent, if recent enough"""
+        try:
+            response = clients.table(COST_METRICS_TABLE).query(
+                KeyConditionExpression=Key('bucket_name').eq(bucket_name),
+                ScanIndexForward=False,
+                Limit=1
+            )
+        except Exception as e:
+            logger.error(f"Error reading cost metrics: {e}")
+            return None
+        if not response['Items']:
+            return None
+        item = response['Items'][0]
+        measured_at = datetime.fromisoformat(item['timestamp'])
+        if datetime.now(timezone.utc) - measured_at > timedelta(hours=COST_METRICS_MAX_AGE_HOURS):
+            return None
+        if 'old_objects' not in item:
+            return None
+        return {
+            'object_count': item.get('object_count', 0),
+            'total_size': item.get('total_size_bytes', 0),
+            'old_objects': item['old_objects'],
+            'large_objects': item.get('large_objects', 0)
+        }
+
+    @staticmethod
+    def get_user_stats(user_id):
+        """Return the per-user aggregate, including increments not yet flushed"""
+        key = {'user_id': user_id}
+        response = clients.table(USER_STATS_TABLE).get_item(Key=key)
+        if 'Item' not in response:
+            return None
+        stats = response['Item']
+        for attribute, value in analytics_buffer.pending_increments(USER_STATS_TABLE, key).items():
+            stats[attribute] = stats.get(attribute, 0) + value
+        return stats
+
+    @staticmethod
+    def count_conversations(user_id):
+        """Count a user's history with paginated COUNT queries"""
+        total = 0
+        query_kwargs = {
+            'KeyConditionExpression': Key('user_id').eq(user_id),
+            'Select': 'COUNT'
+        }
+        while True:
+            response = clients.table(CONVERSATION_HISTORY_TABLE).query(**query_kwargs)
+            total += response['Count']
+            if 'LastEvaluatedKey' not in response:
+                return total
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
     @staticmethod
     def update_usage_analytics(metric_type, increment=1):
+        today = datetime.now().strftime('%Y-%m-%d')
+        if ANALYTICS_WRITE_BEHIND:
+            analytics_buffer.add_counter(
+                USAGE_ANALYTICS_TABLE,
+                {'metric_type': metric_type, 'date': today},
+                {'count': increment}
+            )
+            return
         try:
-            today = datetime.now().strftime('%Y-%m-%d')
-            usage_analytics_table.update_item(
+            clients.table(USAGE_ANALYTICS_TABLE).update_item(
                 Key={
                     'metric_type': metric_type,
                     'date': today
@@ -96,6 +900,13 @@ class DynamoDBHelper:
         except Exception as e:
             logger.error(f"Error updating analytics: {e}")
 
+    @staticmethod
+    def flush_analytics():
+        try:
+            analytics_buffer.flush()
+        except Exception as e:
+            logger.error(f"Error flushing analytics: {e}")
+
 class RequestLoggerInterceptor(AbstractRequestInterceptor):
     def process(self, handler_input):
         request = handler_input.request_envelope.request
@@ -115,17 +926,98 @@ class RequestLoggerInterceptor(AbstractRequestInterceptor):
             request_type=request.object_type,
             utterance=utterance
         )
-        
-        DynamoDBHelper.update_usage_analytics('total_requests')
-        DynamoDBHelper.update_usage_analytics(f'intent_{intent_name}')
+        # request and per-intent totals are the rollup counters log_conversation adds;
+        # only errors still go to UsageAnalytics
+
+class RoutedRequestHandler(AbstractRequestHandler):
+    """Request handler that declares the intent names or request types it handles.
 
-class ResponseLoggerInterceptor(AbstractResponseInterceptor):
-    def process(self, handler_input, response):
-        DynamoDBHelper.update_usage_analytics('successful_responses')
+    RequestRouter indexes handlers by these declarations once, and can_handle
+    is derived from them so the handler still works with the SDK's own
+    request mapper.
+    """
+    intent_names = ()
+    request_types = ()
 
-class LaunchRequestHandler(AbstractRequestHandler):
     def can_handle(self, handler_input):
-        return ask_utils.is_request_type("LaunchRequest")(handler_input)
+        request = handler_input.request_envelope.request
+        if request.object_type == 'IntentRequest' and request.intent.name in self.intent_names:
+            return True
+        return request.object_type in self.request_types
+
+
+class RequestRouter(AbstractRequestMapper):
+    """Request mapper that resolves a handler chain with one dict lookup.
+
+    Routes are keyed by (request type, intent name), with None as the intent
+    for handlers routed by request type alone. Each route lists its candidate
+    chains in registration order, so the first match is the same one the
+    SDK's linear can_handle scan would pick. Handlers without declared routes
+    are kept in every list and probed with can_handle as before.
+    """
+    def __init__(self, request_handler_chains):
+        chains = list(request_handler_chains)
+        routes_of = [self.routes_of(chain.request_handler) for chain in chains]
+        keys = {key for routes in routes_of if routes for key in routes}
+        keys |= {(request_type, None) for request_type, _ in keys}
+        self.routes = {
+            key: [
+                (chain, routes is not None)
+                for chain, routes in zip(chains, routes_of)
+                if routes is None or key in routes or (key[0], None) in routes
+            ]
+            for key in keys
+        }
+        self.unrouted = [(chain, False) for chain, routes in zip(chains, routes_of) if routes is None]
+
+    @staticmethod
+    def routes_of(handler):
+        intent_names = getattr(handler, 'intent_names', ())
+        request_types = getattr(handler, 'request_types', ())
+        if not intent_names and not request_types:
+            return None
+        routes = {('IntentRequest', name) for name in intent_names}
+        routes |= {(request_type, None) for request_type in request_types}
+        return routes
+
+    def get_request_handler_chain(self, handler_input):
+        request = handler_input.request_envelope.request
+        request_type = request.object_type
+        intent_name = request.intent.name if request_type == 'IntentRequest' else None
+        candidates = self.routes.get((request_type, intent_name))
+        if candidates is None:
+            candidates = self.routes.get((request_type, None), self.unrouted)
+        for chain, routed in candidates:
+            if routed or chain.request_handler.can_handle(handler_input):
+                return chain
+        return None
+
+
+class RoutedSkillBuilder(SkillBuilder):
+    """SkillBuilder that dispatches through a RequestRouter.
+
+    The stock lambda_handler rebuilds the skill configuration, request mapper
+    and skill object on every invocation; here they are built once when
+    lambda_handler() is called, so handlers must be registered before that.
+    """
+    @property
+    def skill_configuration(self):
+        configuration = super().skill_configuration
+        configuration.request_mappers = [RequestRouter(self.runtime_configuration_builder.request_handler_chains)]
+        return configuration
+
+    def lambda_handler(self):
+        skill = self.create()
+
+        def wrapper(event, context):
+            request_envelope = skill.serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+            response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+            return skill.serializer.serialize(response_envelope)
+        return wrapper
+
+
+class LaunchRequestHandler(RoutedRequestHandler):
+    request_types = ("LaunchRequest",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -146,9 +1038,8 @@ class LaunchRequestHandler(AbstractRequestHandler):
                 .response
         )
 
-class HelloWorldIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("HelloWorldIntent")(handler_input)
+class HelloWorldIntentHandler(RoutedRequestHandler):
+    intent_names = ("HelloWorldIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -176,9 +1067,8 @@ class HelloWorldIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class FriendsNameIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("FriendsName")(handler_input)
+class FriendsNameIntentHandler(RoutedRequestHandler):
+    intent_names = ("FriendsName",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -206,11 +1096,8 @@ class FriendsNameIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class AddFriendIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        is_match = ask_utils.is_intent_name("AddFriendIntent")(handler_input)
-        logger.info(f"AddFriendIntentHandler.can_handle: {is_match}")
-        return is_match
+class AddFriendIntentHandler(RoutedRequestHandler):
+    intent_names = ("AddFriendIntent",)
 
     def handle(self, handler_input):
         logger.info("AddFriendIntentHandler.handle called")
@@ -279,22 +1166,22 @@ class AddFriendIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class GetStatsIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("GetStatsIntent")(handler_input)
+class GetStatsIntentHandler(RoutedRequestHandler):
+    intent_names = ("GetStatsIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
         
         try:
-            response = conversation_history_table.query(
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('user_id').eq(user_id)
-            )
-            
-            total_conversations = response['Count']
-            
-            user_profile = DynamoDBHelper.get_user_profile(user_id)
-            friends_count = len(user_profile.get('friends', [])) if user_profile else 0
+            stats = DynamoDBHelper.get_user_stats(user_id)
+            if stats:
+                total_conversations = stats.get('conversation_count', 0)
+                friends_count = stats.get('friends_count', 0)
+            else:
+                # a user with no stats record yet has never been logged or backfilled
+                total_conversations = DynamoDBHelper.count_conversations(user_id)
+                user_profile = DynamoDBHelper.get_user_profile(user_id)
+                friends_count = len(user_profile.get('friends', [])) if user_profile else 0
             
             speak_output = f"Here are your stats: You've had {total_conversations} conversations with me, and you have {friends_count} friends in your list. What else would you like to know?"
             reprompt_text = "What can I help you with next?"
@@ -311,9 +1198,8 @@ class GetStatsIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class WeatherIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("WeatherIntent")(handler_input)
+class WeatherIntentHandler(RoutedRequestHandler):
+    intent_names = ("WeatherIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -333,9 +1219,8 @@ class WeatherIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class CreateS3BucketIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("CreateSBucketIntent")(handler_input)
+class CreateS3BucketIntentHandler(RoutedRequestHandler):
+    intent_names = ("CreateSBucketIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -353,7 +1238,7 @@ class CreateS3BucketIntentHandler(AbstractRequestHandler):
                     .response
             )
 
-        s3 = boto3.client('s3')
+        s3 = clients.client('s3')
         try:
             s3.create_bucket(Bucket=bucket_name)
             speak_output = f"Bucket named {bucket_name} has been created successfully. What else can I help you with?"
@@ -371,13 +1256,12 @@ class CreateS3BucketIntentHandler(AbstractRequestHandler):
         )
 
 
-class ListS3BucketsIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("ListSBucketsIntent")(handler_input)
+class ListS3BucketsIntentHandler(RoutedRequestHandler):
+    intent_names = ("ListSBucketsIntent",)
 
     def handle(self, handler_input):
         try:
-            s3 = boto3.client('s3')
+            s3 = clients.client('s3')
             response = s3.list_buckets()
             buckets = [bucket['Name'] for bucket in response['Buckets']]
             
@@ -406,9 +1290,8 @@ class ListS3BucketsIntentHandler(AbstractRequestHandler):
         )
 
 
-class UploadFileToS3IntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("UploadFiletoSIntent")(handler_input)
+class UploadFileToS3IntentHandler(RoutedRequestHandler):
+    intent_names = ("UploadFiletoSIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -470,8 +1353,7 @@ class UploadFileToS3IntentHandler(AbstractRequestHandler):
         
         try:
             logger.info(f"Preparing to write to DynamoDB: file={file_name}, bucket={bucket_name}, user_id={user_id}, request_id={request_id}")
-            upload_table = dynamodb.Table('VirtualAssistant-FileUploadRequest')
-            upload_table.put_item(
+            clients.table(UPLOAD_REQUEST_TABLE).put_item(
                 Item={
                     'request_id': request_id,
                     'user_id': user_id,
@@ -479,6 +1361,7 @@ class UploadFileToS3IntentHandler(AbstractRequestHandler):
                     'bucket_name': bucket_name,
                     'timestamp': datetime.now(timezone.utc).isoformat(),
                     'status': 'pending',
+                    'queue_shard': DynamoDBHelper.queue_shard(request_id),
                     'expiration_time': int(time.time()) + 3600
                 }
             )
@@ -498,9 +1381,8 @@ class UploadFileToS3IntentHandler(AbstractRequestHandler):
             .ask(reprompt_text)
             .response
         )
-class GetCostOptimizationSuggestionsIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("GetCostOptimizationIntent")(handler_input)
+class GetCostOptimizationSuggestionsIntentHandler(RoutedRequestHandler):
+    intent_names = ("GetCostOptimizationIntent",)
 
     def handle(self, handler_input):
         logger = logging.getLogger(__name__)
@@ -510,7 +1392,7 @@ class GetCostOptimizationSuggestionsIntentHandler(AbstractRequestHandler):
             bucket_name = slots.get("bucketName", {}).value if slots else None
             
             if not bucket_name:
-                s3_client = boto3.client('s3')
+                s3_client = clients.client('s3')
                 buckets = [b['Name'] for b in s3_client.list_buckets()['Buckets']]
                 speak_output = (
                     f"You have {len(buckets)} S3 buckets. Please specify which bucket to analyze. "
@@ -518,32 +1400,40 @@ class GetCostOptimizationSuggestionsIntentHandler(AbstractRequestHandler):
                 )
                 return handler_input.response_builder.speak(speak_output).ask(speak_output).response
             
-            s3_client = boto3.client('s3')
+            s3_client = clients.client('s3')
             
             try:
                 s3_client.head_bucket(Bucket=bucket_name)
                 
-                paginator = s3_client.get_paginator('list_objects_v2')
-                pages = paginator.paginate(Bucket=bucket_name, PaginationConfig={'MaxItems': 1000})
-                
-                total_objects = 0
-                total_size = 0
-                old_objects = 0
-                large_objects = 0
-                now = datetime.now(timezone.utc)
-                
-                for page in pages:
-                    for obj in page.get('Contents', []):
-                        total_objects += 1
-                        size = obj.get('Size', 0)
-                        total_size += size
-                        
-                        last_modified = obj.get('LastModified')
-                        if last_modified and (now - last_modified) > timedelta(days=30):
-                            old_objects += 1
-                        
-                        if size > 100 * 1024 * 1024:
-                            large_objects += 1
+                summary = DynamoDBHelper.get_bucket_inventory_summary(bucket_name)
+                if summary:
+                    total_objects = summary['object_count']
+                    total_size = summary['total_size']
+                    old_objects = summary['old_objects']
+                    large_objects = summary['large_objects']
+                else:
+                    # no recent summary from the local agent: sample the first 1000 objects
+                    paginator = s3_client.get_paginator('list_objects_v2')
+                    pages = paginator.paginate(Bucket=bucket_name, PaginationConfig={'MaxItems': 1000})
+                    
+                    total_objects = 0
+                    total_size = 0
+                    old_objects = 0
+                    large_objects = 0
+                    now = datetime.now(timezone.utc)
+                    
+                    for page in pages:
+                        for obj in page.get('Contents', []):
+                            total_objects += 1
+                            size = obj.get('Size', 0)
+                            total_size += size
+                            
+                            last_modified = obj.get('LastModified')
+                            if last_modified and (now - last_modified) > timedelta(days=30):
+                                old_objects += 1
+                            
+                            if size > 100 * 1024 * 1024:
+                                large_objects += 1
                 
                 suggestions = []
                 if old_objects > 0:
@@ -581,9 +1471,8 @@ class GetCostOptimizationSuggestionsIntentHandler(AbstractRequestHandler):
             speak_output = "Sorry, I encountered an error processing your request. Please try again."
             return handler_input.response_builder.speak(speak_output).ask(speak_output).response
 
-class DownloadFileFromS3IntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("DownloadFileFromSIntent")(handler_input)
+class DownloadFileFromS3IntentHandler(RoutedRequestHandler):
+    intent_names = ("DownloadFileFromSIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -621,8 +1510,7 @@ class DownloadFileFromS3IntentHandler(AbstractRequestHandler):
         request_id = f"{user_id}-download-{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
         try:
-            download_table = dynamodb.Table('VirtualAssistant-FileDownloadRequest')
-            download_table.put_item(
+            clients.table(DOWNLOAD_REQUEST_TABLE).put_item(
                 Item={
                     'request_id': request_id,
                     'user_id': user_id,
@@ -630,6 +1518,7 @@ class DownloadFileFromS3IntentHandler(AbstractRequestHandler):
                     'bucket_name': bucket_name,
                     'timestamp': datetime.now(timezone.utc).isoformat(),
                     'status': 'pending',
+                    'queue_shard': DynamoDBHelper.queue_shard(request_id),
                     'expiration_time': int(time.time()) + 3600
                 }
             )
@@ -649,9 +1538,8 @@ class DownloadFileFromS3IntentHandler(AbstractRequestHandler):
             .response
         )
 
-class SetupLifecyclePolicyIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("SetupLifecyclePolicyIntent")(handler_input)
+class SetupLifecyclePolicyIntentHandler(RoutedRequestHandler):
+    intent_names = ("SetupLifecyclePolicyIntent",)
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -670,7 +1558,7 @@ class SetupLifecyclePolicyIntentHandler(AbstractRequestHandler):
             )
         
         try:
-            s3 = boto3.client('s3')
+            s3 = clients.client('s3')
             
             lifecycle_policy = {
                 'Rules': [
@@ -715,9 +1603,8 @@ class SetupLifecyclePolicyIntentHandler(AbstractRequestHandler):
                 .ask(reprompt_text)
                 .response
         )
-class HelpIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_intent_name("AMAZON.HelpIntent")(handler_input)
+class HelpIntentHandler(RoutedRequestHandler):
+    intent_names = ("AMAZON.HelpIntent",)
 
     def handle(self, handler_input):
         speak_output = """I can help you with several things:
@@ -736,10 +1623,8 @@ class HelpIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class CancelOrStopIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return (ask_utils.is_intent_name("AMAZON.CancelIntent")(handler_input) or
-                ask_utils.is_intent_name("AMAZON.StopIntent")(handler_input))
+class CancelOrStopIntentHandler(RoutedRequestHandler):
+    intent_names = ("AMAZON.CancelIntent", "AMAZON.StopIntent")
 
     def handle(self, handler_input):
         user_id = handler_input.request_envelope.session.user.user_id
@@ -755,16 +1640,14 @@ class CancelOrStopIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class SessionEndedRequestHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_request_type("SessionEndedRequest")(handler_input)
+class SessionEndedRequestHandler(RoutedRequestHandler):
+    request_types = ("SessionEndedRequest",)
 
     def handle(self, handler_input):
         return handler_input.response_builder.response
 
-class IntentReflectorHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return ask_utils.is_request_type("IntentRequest")(handler_input)
+class IntentReflectorHandler(RoutedRequestHandler):
+    request_types = ("IntentRequest",)
 
     def handle(self, handler_input):
         intent_name = ask_utils.get_intent_name(handler_input)
@@ -784,6 +1667,8 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
 
     def handle(self, handler_input, exception):
         logger.error(exception, exc_info=True)
+        # one 'errors' partition, so the dashboard's success rate is a single query
+        DynamoDBHelper.update_usage_analytics('errors')
         speak_output = "Sorry, I had trouble doing what you asked. Please try again."
         reprompt_text = "What can I help you with?"
         
@@ -796,10 +1681,9 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
 
 
 
-sb = SkillBuilder()
+sb = RoutedSkillBuilder()
 
 sb.add_global_request_interceptor(RequestLoggerInterceptor())
-sb.add_global_response_interceptor(ResponseLoggerInterceptor())
 
 sb.add_request_handler(LaunchRequestHandler())
 sb.add_request_handler(HelloWorldIntentHandler())
@@ -820,4 +1704,51 @@ sb.add_request_handler(IntentReflectorHandler())
 
 sb.add_exception_handler(CatchAllExceptionHandler())
 
-lambda_handler = sb.lambda_handler()
+skill_handler = sb.lambda_handler()
+
+clients.prewarm(PREWARM_CLIENTS)
+IMPORT_SECONDS = time.perf_counter() - _import_started
+cold_start = True
+
+def metrics_intent(event):
+    request = event.get('request') or {}
+    if request.get('type') == 'IntentRequest':
+        return (request.get('intent') or {}).get('name') or 'IntentRequest'
+    return request.get('type') or 'Unknown'
+
+def lambda_handler(event, context):
+    global cold_start
+    # the function can also be subscribed to the conversation queue
+    records = event.get('Records') or []
+    if records and records[0].get('eventSource') == 'aws:sqs':
+        return drain_conversation_messages(records)
+    metrics.begin()
+    cache_before = profile_cache.stats()
+    intent = metrics_intent(event)
+    # buffered analytics are written concurrently once the response is built, but
+    # before the handler returns it, so the invocation waits about one round trip
+    try:
+        return skill_handler(event, context)
+    finally:
+        handled = metrics.snapshot()
+        try:
+            DynamoDBHelper.record_timing(InvocationMetrics.rollup_increments(
+                intent, handled, cold_start, getattr(context, 'memory_limit_in_mb', None)
+            ))
+        except Exception as e:
+            logger.error(f"Error recording timing: {e}")
+        DynamoDBHelper.flush_analytics()
+        finished = metrics.snapshot()
+        if METRICS_EMF:
+            # printed rather than logged: EMF needs the bare JSON line
+            cache_after = profile_cache.stats()
+            profile_lookups = {name: cache_after[name] - cache_before[name] for name in ('hits', 'misses')}
+            print(json.dumps(
+                InvocationMetrics.emf_record(intent, handled, finished, cold_start, profile_lookups), separators=(',', ':')
+            ))
+        if cold_start:
+            cold_start = False
+            logger.info(
+                f"Cold start: import {IMPORT_SECONDS * 1000:.1f} ms, "
+                f"first invocation {finished['duration_ms']:.1f} ms, clients {clients.stats()}"
+            )
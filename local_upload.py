@@ -1,54 +1,1410 @@
 #Local Backend code for uploading file to S3
 
 import os
+import io
+import re
+import csv
+import gzip
+import json
 import time
+import base64
+import hashlib
+import queue
+import socket
+import sqlite3
+import threading
 import boto3
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from boto3.dynamodb.conditions import Key, Attr
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote_plus
 from decimal import Decimal  
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
 
 # Configuration
 LOCAL_FOLDER = '/Users/angadsingh04/Desktop/TestR' 
 AWS_REGION = 'us-east-1'  
 POLL_INTERVAL = 10  
+STATE_DIR = os.environ.get('CLOUDBUTLER_STATE_DIR', os.path.expanduser('~/.cloudbutler'))
+INVENTORY_DIR = os.path.join(STATE_DIR, 'inventory')
+INVENTORY_FULL_SYNC_HOURS = 24  # incremental refreshes in between full listings
+OLD_OBJECT_DAYS = 30
+LARGE_OBJECT_BYTES = 100 * 1024 * 1024
+COST_METRICS_INTERVAL = 600  # seconds between cost metric runs on the worker thread
+INVENTORY_LIST_WORKERS = 8  # prefix shards listed in parallel per bucket
+INVENTORY_SHARD_DEPTH = 2  # how many '/' levels may be split to find enough shards
+INTAKE_MODE = os.environ.get('INTAKE_MODE', 'poll')  # 'poll' scans the tables, 'stream' reads DynamoDB Streams
+STREAM_POLL_INTERVAL = 0.5  # seconds between GetRecords rounds when the streams are idle
+STREAM_SHARD_REFRESH = 60  # seconds between checks for new stream shards
+# sparse GSI over open requests: partition 'queue_shard' ('open#<n>'), sort 'timestamp'.
+# Set to '' to fall back to scanning the request tables.
+REQUEST_QUEUE_INDEX = os.environ.get('REQUEST_QUEUE_INDEX', 'queue-index')
+QUEUE_SHARDS = 4  # must match QUEUE_SHARDS in lambda_function.py
+UPLOAD_WORKERS = 4  # concurrent uploads
+DOWNLOAD_WORKERS = 4  # concurrent downloads
+PER_BUCKET_TRANSFERS = 3  # concurrent transfers against any one bucket
+TRANSFER_JOURNAL_DIR = os.path.join(STATE_DIR, 'transfers')
+TRANSFER_JOURNAL_DAYS = 7  # unfinished transfers left this long are abandoned (matches the README's MPU lifecycle rule)
+MULTIPART_THRESHOLD = 64 * 1024 * 1024  # smaller files are sent in one managed transfer
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PART_SIZE = 64 * 1024 * 1024
+MAX_PARTS = 10000
+TARGET_PART_SECONDS = 4  # part size aims for about this long per part at the measured rate
+MAX_PART_CONCURRENCY = 8  # parts in flight per transfer
+PART_ATTEMPTS = 3
+# two-way sync of LOCAL_FOLDER with s3://SYNC_BUCKET/SYNC_PREFIX; off when SYNC_BUCKET is unset
+SYNC_BUCKET = os.environ.get('SYNC_BUCKET', '')
+SYNC_PREFIX = os.environ.get('SYNC_PREFIX', '')
+SYNC_WORKERS = 4
+# '<name>_<timestamp>_backup' files left by backup_existing are never synced
+BACKUP_NAME = re.compile(r'_\d{8}_\d{6}_backup$')
+SYNC_RECONCILE_INTERVAL = 300  # seconds between inventory refreshes that look for changes made in S3
+PROCESSED_REQUEST_TTL = 3600  # matches the requests' expiration_time
+AGENT_ID = os.environ.get('AGENT_ID', f"{socket.gethostname()}-{os.getpid()}")  # lease owner name
+LEASE_SECONDS = 120  # a claimed request goes back to other agents this long after the last heartbeat
+HEARTBEAT_INTERVAL = 30
+EVENT_DEBOUNCE_WINDOW = 1.0  # seconds without folder events before settled files are acted on
 
 # Initialize AWS clients
 dynamodb = boto3.resource('dynamodb', region_name=AWS_REGION)
-s3 = boto3.client('s3', region_name=AWS_REGION)
+s3 = boto3.client(
+    's3',
+    region_name=AWS_REGION,
+    config=Config(
+        max_pool_connections=INVENTORY_LIST_WORKERS + (UPLOAD_WORKERS + DOWNLOAD_WORKERS + SYNC_WORKERS) * MAX_PART_CONCURRENCY
+    )
+)
 upload_requests_table = dynamodb.Table('VirtualAssistant-FileUploadRequest')
+download_requests_table = dynamodb.Table('VirtualAssistant-FileDownloadRequest')
+
+class S3InventoryIndex:
+    """Key-sorted local index of one bucket's objects, stored in SQLite.
+
+    The index is built once from a full paginated listing (or an S3 Inventory
+    manifest) and then kept current incrementally: keys sorting after the
+    last indexed key and top-level prefixes not seen before are listed, and
+    the agent records its own uploads. A full listing is redone every
+    INVENTORY_FULL_SYNC_HOURS to pick up edits and deletes made elsewhere.
+
+    Listings never hold the write lock while waiting on S3. A full listing
+    goes into a staging table a page at a time and replaces the live table
+    in one transaction at the end, so lookups keep answering from the
+    previous listing meanwhile.
+    """
+    def __init__(self, bucket_name, path=None):
+        self.bucket_name = bucket_name
+        os.makedirs(INVENTORY_DIR, exist_ok=True)
+        self.path = path or os.path.join(INVENTORY_DIR, f"{bucket_name}.sqlite3")
+        # guards the connection; held only for short writes
+        self.lock = threading.Lock()
+        # one listing at a time
+        self.listing = threading.Lock()
+        # rows recorded while the lock is busy; applied by whoever holds it next
+        self.pending = deque()
+        # rows applied while a full listing runs, replayed into it before the swap
+        self.recorded = None
+        # (prefix, callback) pairs told which keys under prefix a listing found changed
+        self.listeners = []
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_modified TEXT NOT NULL,
+                storage_class TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+            DROP TABLE IF EXISTS objects_next;
+        """)
+        # lookups use their own read-only connection, so they never wait on the write lock;
+        # under WAL they see the last committed listing while a new one is written
+        self.read_lock = threading.Lock()
+        self.reader = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True, check_same_thread=False)
+
+    def _meta(self, name):
+        with self.lock:
+            return self._meta_locked(name)
+
+    def _meta_locked(self, name):
+        row = self.db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def _store(self, rows, table='objects'):
+        self.db.executemany(
+            f'INSERT OR REPLACE INTO {table} (key, size, last_modified, storage_class) VALUES (?, ?, ?, ?)',
+            rows
+        )
+
+    def add_listener(self, prefix, callback):
+        """Call callback(keys) with the keys under prefix that a refresh or full listing found changed"""
+        self.listeners.append((prefix, callback))
+
+    def _notify(self, keys):
+        for prefix, callback in self.listeners:
+            matching = [key for key in keys if key.startswith(prefix)]
+            if matching:
+                callback(matching)
+
+    def _staged_changes(self):
+        """Keys under the listeners' prefixes added, changed or removed by the staged listing"""
+        if self._meta_locked('last_full_sync') is None:
+            # a first listing has nothing to compare against
+            return []
+        keys = []
+        for prefix in {prefix for prefix, _ in self.listeners}:
+            bounds = (prefix, self._prefix_end(prefix))
+            keys.extend(row[0] for row in self.db.execute(
+                'SELECT n.key FROM objects_next n LEFT JOIN objects o ON o.key = n.key '
+                'WHERE n.key >= ? AND n.key < ? AND (o.key IS NULL OR o.size != n.size OR o.last_modified != n.last_modified) '
+                'UNION ALL '
+                'SELECT o.key FROM objects o LEFT JOIN objects_next n ON n.key = o.key '
+                'WHERE o.key >= ? AND o.key < ? AND n.key IS NULL',
+                bounds + bounds
+            ))
+        return keys
+
+    def _write(self, rows, table='objects'):
+        """Store one batch of rows in its own short transaction"""
+        with self.lock, self.db:
+            self._store(rows, table)
+
+    @staticmethod
+    def _row(obj):
+        last_modified = obj['LastModified']
+        if isinstance(last_modified, datetime):
+            last_modified = last_modified.astimezone(timezone.utc).isoformat()
+        return (obj['Key'], obj['Size'], last_modified, obj.get('StorageClass', 'STANDARD'))
+
+    def _list(self, **list_kwargs):
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, **list_kwargs):
+            yield [self._row(obj) for obj in page.get('Contents', [])]
+
+    def _shard_prefixes(self, workers, table):
+        """Split the keyspace on '/' until there are enough prefixes to keep the workers busy.
+
+        Objects sitting directly at an expanded level are stored as they are
+        found; the returned prefixes still need a full listing.
+        """
+        shards = ['']
+        for _ in range(INVENTORY_SHARD_DEPTH):
+            if len(shards) >= workers:
+                break
+            expanded = []
+            for prefix in shards:
+                for page in s3.get_paginator('list_objects_v2').paginate(
+                    Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'
+                ):
+                    self._write([self._row(obj) for obj in page.get('Contents', [])], table)
+                    expanded.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+            shards = expanded
+        return shards
+
+    def _begin_staging(self):
+        with self.lock, self.db:
+            self.db.execute('DROP TABLE IF EXISTS objects_next')
+            self.db.execute(
+                'CREATE TABLE objects_next (key TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                'last_modified TEXT NOT NULL, storage_class TEXT NOT NULL) WITHOUT ROWID'
+            )
+            self.recorded = []
+
+    def _swap_in_staging(self):
+        """Make the staging table the live one, with the agent's own writes made meanwhile"""
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self._apply_pending()
+            self._store(self.recorded, 'objects_next')
+            changed = self._staged_changes()
+            self.db.execute('DROP TABLE objects')
+            self.db.execute('ALTER TABLE objects_next RENAME TO objects')
+            self._set_meta('last_full_sync', datetime.now(timezone.utc).isoformat())
+            self.recorded = None
+        self._notify(changed)
+
+    def _drop_staging(self):
+        with self.lock, self.db:
+            self.db.execute('DROP TABLE IF EXISTS objects_next')
+            self.recorded = None
+
+    def _staged(self, fill):
+        """Run fill() against a fresh staging table and swap it in if it succeeds"""
+        with self.listing:
+            self._begin_staging()
+            try:
+                fill()
+                self._swap_in_staging()
+            finally:
+                self._drop_staging()
+
+    def rebuild(self, workers=INVENTORY_LIST_WORKERS):
+        """Replace the index with a full listing, sharded by prefix and listed in parallel.
+
+        Listing threads hand pages to this thread through a bounded queue, so
+        memory holds at most a few pages however large the bucket is. If
+        anything fails the listing threads are cancelled rather than left
+        blocked on the full queue.
+        """
+        def fill():
+            pages = queue.Queue(maxsize=workers * 4)
+            cancelled = threading.Event()
+
+            def list_shard(prefix):
+                for rows in self._list(Prefix=prefix):
+                    while not cancelled.is_set():
+                        try:
+                            pages.put(rows, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if cancelled.is_set():
+                        return
+
+            shards = self._shard_prefixes(workers, 'objects_next')
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inventory-list') as pool:
+                futures = [pool.submit(list_shard, prefix) for prefix in shards]
+                try:
+                    while True:
+                        try:
+                            self._write(pages.get(timeout=0.1), 'objects_next')
+                        except queue.Empty:
+                            for future in futures:
+                                if future.done() and future.exception():
+                                    # one failed shard fails the rebuild; stop the others now
+                                    raise future.exception()
+                            if all(future.done() for future in futures) and pages.empty():
+                                break
+                except BaseException:
+                    cancelled.set()
+                    raise
+
+        self._staged(fill)
+
+    def refresh(self, blocking=True):
+        """List only keys after the last indexed key and prefixes the index has never seen.
+
+        With blocking=False nothing is done, and False returned, while
+        another listing is running.
+        """
+        added = []
+        if not self.listing.acquire(blocking=blocking):
+            return False
+        try:
+            with self.lock:
+                last_key = self.db.execute('SELECT MAX(key) FROM objects').fetchone()[0]
+            # a first listing has nothing to compare against, so it reports no changes
+            track = self.listeners and last_key is not None
+            if last_key is not None:
+                for rows in self._list(StartAfter=last_key):
+                    self._write(rows)
+                    if track:
+                        added.extend(row[0] for row in rows)
+
+            paginator = s3.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket_name, Delimiter='/'):
+                for common_prefix in page.get('CommonPrefixes', []):
+                    prefix = common_prefix['Prefix']
+                    with self.lock:
+                        known = self.db.execute(
+                            'SELECT 1 FROM objects WHERE key >= ? AND key < ? LIMIT 1',
+                            (prefix, self._prefix_end(prefix))
+                        ).fetchone()
+                    if not known:
+                        for rows in self._list(Prefix=prefix):
+                            self._write(rows)
+                            if track:
+                                added.extend(row[0] for row in rows)
+            with self.lock, self.db:
+                self._apply_pending()
+                self._set_meta('last_refresh', datetime.now(timezone.utc).isoformat())
+        finally:
+            self.listing.release()
+        self._notify(added)
+        return True
+
+    @staticmethod
+    def _prefix_end(prefix):
+        # every key starting with prefix sorts below prefix + the highest code point
+        return prefix + '\U0010ffff'
+
+    def refresh_prefix(self, prefix):
+        """Re-list one prefix, replacing whatever the index held for it"""
+        with self.listing:
+            rows = [row for page in self._list(Prefix=prefix) for row in page]
+            with self.lock, self.db:
+                self.db.execute('DELETE FROM objects WHERE key >= ? AND key < ?', (prefix, self._prefix_end(prefix)))
+                self._store(rows)
+
+    def sync(self):
+        """Full rebuild when the index is missing or stale, otherwise an incremental refresh"""
+        last_full_sync = self._meta('last_full_sync')
+        if last_full_sync is None or (
+            datetime.now(timezone.utc) - datetime.fromisoformat(last_full_sync)
+        ) > timedelta(hours=INVENTORY_FULL_SYNC_HOURS):
+            self.rebuild()
+        else:
+            self.refresh()
+
+    def record(self, key, size, storage_class='STANDARD', last_modified=None):
+        """Record an object the agent itself just wrote"""
+        last_modified = last_modified or datetime.now(timezone.utc)
+        self.pending.append((key, size, last_modified.astimezone(timezone.utc).isoformat(), storage_class))
+        # never wait on the lock; whoever holds it applies pending rows when done
+        if self.lock.acquire(blocking=False):
+            try:
+                with self.db:
+                    self._apply_pending()
+            finally:
+                self.lock.release()
+
+    def _apply_pending(self):
+        rows = []
+        while self.pending:
+            rows.append(self.pending.popleft())
+        self._store(rows)
+        if self.recorded is not None:
+            self.recorded.extend(rows)
+
+    def import_inventory_manifest(self, manifest_path):
+        """Load the index from an S3 Inventory manifest (local path or s3://bucket/key)"""
+        manifest = json.loads(self._read(manifest_path))
+        file_format = manifest.get('fileFormat', 'CSV').upper()
+        schema = [column.strip() for column in manifest.get('fileSchema', '').split(',')]
+        destination = manifest['destinationBucket'].split(':::')[-1]
+
+        def fill():
+            for data_file in manifest['files']:
+                data = self._read(f"s3://{destination}/{data_file['key']}")
+                if file_format == 'CSV':
+                    rows = self._csv_rows(data, schema)
+                elif file_format == 'PARQUET':
+                    rows = self._parquet_rows(data)
+                else:
+                    raise ValueError(f"Unsupported inventory format: {file_format}")
+                self._write(list(rows), 'objects_next')
+
+        self._staged(fill)
+
+    @staticmethod
+    def _read(path):
+        if path.startswith('s3://'):
+            bucket_name, key = path[len('s3://'):].split('/', 1)
+            return s3.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _csv_rows(data, schema):
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+        for values in csv.reader(io.StringIO(data.decode('utf-8'))):
+            record = dict(zip(schema, values))
+            if record.get('IsLatest', 'true') == 'false' or record.get('IsDeleteMarker') == 'true':
+                continue
+            yield (
+                unquote_plus(record['Key']),  # inventory CSV keys are URL-encoded
+                int(record.get('Size') or 0),
+                datetime.fromisoformat(record['LastModifiedDate'].replace('Z', '+00:00')).isoformat(),
+                record.get('StorageClass') or 'STANDARD'
+            )
+
+    @staticmethod
+    def _parquet_rows(data):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Importing Parquet inventories requires pyarrow (pip install pyarrow)")
+        table = pq.read_table(io.BytesIO(data)).to_pydict()
+        for i, key in enumerate(table['key']):
+            if table.get('is_latest') and not table['is_latest'][i]:
+                continue
+            if table.get('is_delete_marker') and table['is_delete_marker'][i]:
+                continue
+            last_modified = table['last_modified_date'][i]
+            yield (
+                key,
+                int(table['size'][i] or 0),
+                last_modified.astimezone(timezone.utc).isoformat(),
+                table.get('storage_class', [None] * len(table['key']))[i] or 'STANDARD'
+            )
+
+    def size_of(self, key):
+        with self.read_lock:
+            row = self.reader.execute('SELECT size FROM objects WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def summary(self):
+        """Object count, size, storage classes and cost-relevant counts"""
+        old_cutoff = (datetime.now(timezone.utc) - timedelta(days=OLD_OBJECT_DAYS)).isoformat()
+        with self.read_lock:
+            object_count, total_size, old_objects, large_objects = self.reader.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), '
+                'COALESCE(SUM(last_modified < ?), 0), COALESCE(SUM(size > ?), 0) FROM objects',
+                (old_cutoff, LARGE_OBJECT_BYTES)
+            ).fetchone()
+            storage_classes = dict(self.reader.execute(
+                'SELECT storage_class, COUNT(*) FROM objects GROUP BY storage_class'
+            ).fetchall())
+        return {
+            'object_count': object_count,
+            'total_size': total_size,
+            'old_objects': old_objects,
+            'large_objects': large_objects,
+            'storage_classes': storage_classes
+        }
+
+
+class ChangeFeedIntake:
+    """Reads new request rows from a table's DynamoDB Stream instead of scanning it.
+
+    Every open shard is read from its last checkpointed sequence number (or
+    from the start of the retained stream on first run), and INSERT images
+    are handed to on_insert. on_insert may return an Event that is set once
+    the request has been claimed; a shard's checkpoint only moves past
+    records whose events are set, so requests that were queued but not yet
+    claimed are read again after a crash. Checkpoints are saved to a local
+    JSON file, and those of shards the stream no longer lists are dropped.
+    The streams client can be swapped for a LocalChangeStream, as the
+    benchmark's agent-stream suite does.
+    """
+    def __init__(self, table_name, on_insert, streams_client=None, stream_arn=None, checkpoint_path=None):
+        self.table_name = table_name
+        self.on_insert = on_insert
+        self.streams = streams_client or boto3.client('dynamodbstreams', region_name=AWS_REGION)
+        self.stream_arn = stream_arn or dynamodb.meta.client.describe_table(
+            TableName=table_name
+        )['Table']['LatestStreamArn']
+        self.checkpoint_path = checkpoint_path or os.path.join(STATE_DIR, f"{table_name}.checkpoints.json")
+        self.checkpoints = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.checkpoints = json.load(f)
+        self.iterators = {}
+        self.pending = defaultdict(deque)  # shard -> (sequence number, claim event or None) past its checkpoint
+        self.finished_shards = set()
+        self.shards_refreshed_at = 0
+        self.deserializer = TypeDeserializer()
+
+    def _iterator(self, shard_id):
+        if shard_id in self.checkpoints:
+            kwargs = {'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER', 'SequenceNumber': self.checkpoints[shard_id]}
+        else:
+            kwargs = {'ShardIteratorType': 'TRIM_HORIZON'}
+        return self.streams.get_shard_iterator(
+            StreamArn=self.stream_arn, ShardId=shard_id, **kwargs
+        )['ShardIterator']
+
+    def refresh_shards(self):
+        describe_kwargs = {'StreamArn': self.stream_arn}
+        listed = set()
+        while True:
+            description = self.streams.describe_stream(**describe_kwargs)['StreamDescription']
+            for shard in description['Shards']:
+                shard_id = shard['ShardId']
+                listed.add(shard_id)
+                if shard_id not in self.iterators and shard_id not in self.finished_shards:
+                    self.iterators[shard_id] = self._iterator(shard_id)
+            if not description.get('LastEvaluatedShardId'):
+                break
+            describe_kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+        self.shards_refreshed_at = time.time()
+
+        # closed shards drop out of the listing once their records pass the stream's retention
+        trimmed = [shard_id for shard_id in self.checkpoints if shard_id not in listed]
+        for shard_id in trimmed:
+            del self.checkpoints[shard_id]
+            self.pending.pop(shard_id, None)
+        self.finished_shards &= listed
+        if trimmed:
+            self.save_checkpoints()
+
+    def _advance(self):
+        """Move each shard's checkpoint past the records whose requests are settled; True if any moved"""
+        moved = False
+        for shard_id, entries in self.pending.items():
+            while entries and (entries[0][1] is None or entries[0][1].is_set()):
+                self.checkpoints[shard_id] = entries.popleft()[0]
+                moved = True
+        return moved
+
+    def poll(self):
+        """Read every open shard once; returns the number of records seen"""
+        if time.time() - self.shards_refreshed_at > STREAM_SHARD_REFRESH:
+            self.refresh_shards()
+
+        seen = 0
+        for shard_id, iterator in list(self.iterators.items()):
+            try:
+                response = self.streams.get_records(ShardIterator=iterator, Limit=100)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ExpiredIteratorException':
+                    self.iterators[shard_id] = self._iterator(shard_id)
+                    continue
+                raise
+
+            for record in response.get('Records', []):
+                seen += 1
+                claimed = None
+                if record['eventName'] == 'INSERT':
+                    image = record['dynamodb'].get('NewImage', {})
+                    claimed = self.on_insert({k: self.deserializer.deserialize(v) for k, v in image.items()})
+                self.pending[shard_id].append((record['dynamodb']['SequenceNumber'], claimed))
+
+            if response.get('NextShardIterator'):
+                self.iterators[shard_id] = response['NextShardIterator']
+            else:
+                # a closed shard has been read to its end; its children carry on
+                del self.iterators[shard_id]
+                self.finished_shards.add(shard_id)
+
+        if self._advance():
+            self.save_checkpoints()
+        return seen
+
+    def save_checkpoints(self):
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.checkpoints, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+class LocalChangeStream:
+    """In-memory stand-in for the dynamodbstreams client.
+
+    Records go to the newest shard. split() closes it and opens a child, as
+    DynamoDB does every few hours, and trim() removes a closed shard from the
+    listing, as the stream's 24 hour retention does.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shards = {'shard-0': {'records': [], 'closed': False}}
+        self.current = 'shard-0'
+        self.sequence = 0
+        self.serializer = TypeSerializer()
+
+    def append(self, item, event_name='INSERT'):
+        with self.lock:
+            self.sequence += 1
+            self.shards[self.current]['records'].append({
+                'eventName': event_name,
+                'dynamodb': {
+                    'SequenceNumber': f"{self.sequence:021d}",
+                    'NewImage': {k: self.serializer.serialize(v) for k, v in item.items()}
+                }
+            })
+
+    def split(self):
+        with self.lock:
+            self.shards[self.current]['closed'] = True
+            self.current = f"shard-{len(self.shards)}"
+            self.shards[self.current] = {'records': [], 'closed': False}
+
+    def trim(self, shard_id):
+        with self.lock:
+            del self.shards[shard_id]
+
+    def describe_stream(self, StreamArn, ExclusiveStartShardId=None):
+        with self.lock:
+            return {'StreamDescription': {'Shards': [{'ShardId': shard_id} for shard_id in self.shards]}}
+
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType, SequenceNumber=None):
+        position = 0
+        if ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+            with self.lock:
+                records = self.shards[ShardId]['records']
+                position = sum(1 for record in records if record['dynamodb']['SequenceNumber'] <= SequenceNumber)
+        return {'ShardIterator': f"{ShardId}:{position}"}
+
+    def get_records(self, ShardIterator, Limit=100):
+        shard_id, position = ShardIterator.rsplit(':', 1)
+        position = int(position)
+        with self.lock:
+            shard = self.shards[shard_id]
+            records = shard['records'][position:position + Limit]
+            end = position + len(records)
+            if shard['closed'] and end == len(shard['records']):
+                # a closed shard read to its end has no next iterator
+                return {'Records': records}
+        return {'Records': records, 'NextShardIterator': f"{shard_id}:{end}"}
+
+
+class TransferScheduler:
+    """Worker pools that run queued uploads and downloads concurrently.
+
+    Uploads and downloads have separate pools and queues, and other
+    producers such as FolderSync can add their own. Each queue is
+    ordered by file size, so small files go ahead of large ones. A bucket
+    never has more than PER_BUCKET_TRANSFERS transfers in flight; a job for
+    a busy bucket is parked until one of that bucket's transfers finishes.
+    Reported throughput counts only the time a pool had transfers running,
+    so idle stretches do not dilute it.
+    """
+    def __init__(self, runners, workers, per_bucket_limit=PER_BUCKET_TRANSFERS):
+        self.runners = {}
+        self.per_bucket_limit = per_bucket_limit
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.active = defaultdict(int)
+        self.parked = defaultdict(deque)
+        self.sequence = 0
+        self.stats = {}
+        for kind, runner in runners.items():
+            self.add_pool(kind, runner, workers[kind])
+
+    def add_pool(self, kind, runner, workers):
+        """Start a queue and worker pool for another kind of job; runner(request) returns True on success"""
+        with self.lock:
+            self.runners[kind] = runner
+            self.queues[kind] = queue.PriorityQueue()
+            self.stats[kind] = {
+                'completed': 0, 'failed': 0, 'skipped': 0, 'bytes': 0, 'running': 0,
+                'busy_seconds': 0.0, 'busy_since': None
+            }
+        for i in range(workers):
+            threading.Thread(target=self._work, args=(kind,), name=f'{kind}-{i}', daemon=True).start()
+
+    def submit(self, kind, request, size):
+        with self.lock:
+            self.sequence += 1
+            self.queues[kind].put((size, self.sequence, request))
+
+    def _work(self, kind):
+        while True:
+            job = self.queues[kind].get()
+            size, _, request = job
+            bucket_name = request['bucket_name']
+            with self.lock:
+                if self.active[bucket_name] >= self.per_bucket_limit:
+                    self.parked[bucket_name].append((kind, job))
+                    continue
+                self.active[bucket_name] += 1
+                if not self.stats[kind]['running']:
+                    self.stats[kind]['busy_since'] = time.time()
+                self.stats[kind]['running'] += 1
+
+            succeeded = False
+            try:
+                # runners return None for jobs they decided not to run
+                succeeded = self.runners[kind](request)
+            except Exception as e:
+                print(f"Error running {kind} {request.get('request_id')}: {e}")
+            finally:
+                with self.lock:
+                    self.active[bucket_name] -= 1
+                    self.stats[kind]['running'] -= 1
+                    if not self.stats[kind]['running']:
+                        self.stats[kind]['busy_seconds'] += time.time() - self.stats[kind]['busy_since']
+                        self.stats[kind]['busy_since'] = None
+                    self.stats[kind]['skipped' if succeeded is None else 'completed' if succeeded else 'failed'] += 1
+                    if succeeded:
+                        self.stats[kind]['bytes'] += size
+                    # hand the freed slot to the next job parked for this bucket
+                    if self.parked[bucket_name]:
+                        parked_kind, parked_job = self.parked[bucket_name].popleft()
+                        self.queues[parked_kind].put(parked_job)
+
+    def report(self):
+        """Queue depth, in-flight transfers and throughput per kind while it had transfers running"""
+        now = time.time()
+        with self.lock:
+            parked = defaultdict(int)
+            for jobs in self.parked.values():
+                for kind, _ in jobs:
+                    parked[kind] += 1
+            return {
+                kind: {
+                    'queued': self.queues[kind].qsize() + parked[kind],
+                    'running': stats['running'],
+                    'completed': stats['completed'],
+                    'failed': stats['failed'],
+                    'skipped': stats['skipped'],
+                    'throughput_mb_s': round(stats['bytes'] / max(
+                        stats['busy_seconds'] + (now - stats['busy_since'] if stats['busy_since'] else 0), 1e-6
+                    ) / (1024 * 1024), 3)
+                }
+                for kind, stats in self.stats.items()
+            }
+
+    def busy(self):
+        with self.lock:
+            return any(q.qsize() for q in self.queues.values()) or any(
+                stats['running'] for stats in self.stats.values()
+            ) or any(self.parked.values())
+
+
+class ContentIndex:
+    """Cached content hashes of local files, stored in SQLite.
+
+    A file is only read again when its size or mtime changes. Each entry
+    holds the MD5 and SHA-256 of the whole file and the multipart ETag S3
+    would give it for one part size, so a local file can be compared with
+    an object's HEAD response without downloading anything.
+    """
+    def __init__(self, path=None):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        self.path = path or os.path.join(STATE_DIR, 'content.sqlite3')
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        # one row per (path, part size), so checking an object uploaded with another
+        # part size does not evict the entry uploads use
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                part_size INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                md5 TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                PRIMARY KEY (path, part_size)
+            ) WITHOUT ROWID
+        """)
+
+    def digest(self, local_path, part_size=MIN_PART_SIZE):
+        stat = os.stat(local_path)
+        with self.lock:
+            row = self.db.execute(
+                'SELECT md5, sha256, etag FROM hashes WHERE path = ? AND part_size = ? AND size = ? AND mtime_ns = ?',
+                (local_path, part_size, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        if row:
+            return {'size': stat.st_size, 'md5': row[0], 'sha256': row[1], 'etag': row[2]}
+
+        md5, sha256 = hashlib.md5(), hashlib.sha256()
+        part_digests, part, part_left = [], hashlib.md5(), part_size
+        with open(local_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+                sha256.update(chunk)
+                view = memoryview(chunk)
+                while view:
+                    taken = view[:part_left]
+                    part.update(taken)
+                    part_left -= len(taken)
+                    view = view[len(taken):]
+                    if not part_left:
+                        part_digests.append(part.digest())
+                        part, part_left = hashlib.md5(), part_size
+        if part_left != part_size or not part_digests:
+            part_digests.append(part.digest())
+        etag = f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+        entry = {'size': stat.st_size, 'md5': md5.hexdigest(), 'sha256': sha256.hexdigest(), 'etag': etag}
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO hashes (path, part_size, size, mtime_ns, md5, sha256, etag) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (local_path, part_size, stat.st_size, stat.st_mtime_ns, entry['md5'], entry['sha256'], etag)
+            )
+        return entry
+
+    def matches(self, local_path, head):
+        """Whether the object described by a HEAD response has the same bytes as the local file"""
+        if head['ContentLength'] != os.path.getsize(local_path):
+            return False
+        metadata = head.get('Metadata', {})
+        if 'sha256' in metadata:
+            # written by this agent on upload, whatever the part size was
+            return metadata['sha256'] == self.digest(local_path)['sha256']
+        etag = head['ETag'].strip('"')
+        if '-' not in etag:
+            # single-part ETags are the MD5 of the body (except for SSE-KMS objects, which never match)
+            return etag == self.digest(local_path)['md5']
+        part_size = int(metadata.get('part-size', MIN_PART_SIZE))
+        return etag == self.digest(local_path, part_size)['etag']
+
+
+class TransferCancelled(Exception):
+    """A transfer stopped because its request's lease moved to another agent"""
+
+
+class TransferEngine:
+    """Multipart uploads and ranged downloads that resume after an interruption.
+
+    Files under MULTIPART_THRESHOLD go through boto3's managed transfer. Larger
+    files are split into parts and sent on a thread pool. Each finished part is
+    written to a JSON journal under TRANSFER_JOURNAL_DIR, together with its
+    MD5, so a retried request only transfers the parts that are missing.
+    Upload parts are sent with Content-MD5 so S3 rejects corrupted parts.
+    Download parts are written into a '.part' file; their MD5s are checked
+    again before resuming, and the file is renamed when the last part is in.
+    Journals are keyed by bucket and key (downloads also by target path),
+    so a later request for the same transfer picks up where a failed one
+    stopped, and transfers sharing a journal run one at a time. A transfer
+    given a cancel event checks it between parts and stops, keeping its
+    journal. Journals untouched for TRANSFER_JOURNAL_DAYS are swept at
+    startup together with their multipart upload or '.part' file.
+
+    The part size follows the measured per-stream throughput, aiming for
+    parts of about TARGET_PART_SECONDS. The number of parts in flight is
+    hill-climbed between transfers: it grows while aggregate throughput
+    improves and shrinks when it does not.
+    """
+    def __init__(self, client=None, journal_dir=TRANSFER_JOURNAL_DIR):
+        self.client = client or s3
+        self.journal_dir = journal_dir
+        os.makedirs(journal_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.journal_locks = defaultdict(threading.Lock)
+        self.stream_throughput = None  # EWMA of bytes/second for a single part stream
+        self.concurrency = max(2, MAX_PART_CONCURRENCY // 2)
+        self.step = 1
+        self.last_throughput = None
+        self.small_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MIN_PART_SIZE,
+            max_concurrency=MAX_PART_CONCURRENCY
+        )
+        self.sweep_journals()
+
+    def sweep_journals(self, max_age=TRANSFER_JOURNAL_DAYS * 86400):
+        """Abandon transfers that were never retried: abort their upload or delete their '.part' file"""
+        for name in os.listdir(self.journal_dir):
+            path = os.path.join(self.journal_dir, name)
+            try:
+                if not name.endswith('.json') or time.time() - os.path.getmtime(path) < max_age:
+                    continue
+            except OSError:
+                continue
+            journal = self._load_journal(path) or {}
+            try:
+                if 'upload_id' in journal:
+                    self.client.abort_multipart_upload(
+                        Bucket=journal['bucket'], Key=journal['key'], UploadId=journal['upload_id']
+                    )
+                elif 'part_path' in journal and os.path.exists(journal['part_path']):
+                    os.remove(journal['part_path'])
+            except (ClientError, OSError) as e:
+                print(f"Error abandoning transfer journal {name}: {e}")
+            os.remove(path)
+            print(f"Abandoned unfinished transfer of {journal.get('key', name)}")
+
+    def part_size(self, size):
+        with self.lock:
+            throughput = self.stream_throughput
+        part_size = MIN_PART_SIZE
+        if throughput:
+            part_size = int(min(max(throughput * TARGET_PART_SECONDS, MIN_PART_SIZE), MAX_PART_SIZE))
+        # S3 allows at most MAX_PARTS parts per upload
+        return max(part_size, -(-size // MAX_PARTS))
+
+    def _record_part(self, nbytes, seconds):
+        with self.lock:
+            rate = nbytes / max(seconds, 1e-6)
+            self.stream_throughput = rate if self.stream_throughput is None else 0.7 * self.stream_throughput + 0.3 * rate
+
+    def _record_transfer(self, nbytes, seconds):
+        """Move the part concurrency towards whatever gave better aggregate throughput"""
+        with self.lock:
+            throughput = nbytes / max(seconds, 1e-6)
+            if self.last_throughput is not None and throughput < self.last_throughput:
+                self.step = -self.step
+            self.concurrency = min(max(self.concurrency + self.step, 2), MAX_PART_CONCURRENCY)
+            self.last_throughput = throughput
+
+    def _journal_path(self, direction, journal_id):
+        name = hashlib.sha1(f"{direction}:{journal_id}".encode()).hexdigest()
+        return os.path.join(self.journal_dir, f"{name}.json")
+
+    def _journal_lock(self, journal_path):
+        with self.lock:
+            return self.journal_locks[journal_path]
+
+    @staticmethod
+    def _check(cancel, key):
+        if cancel is not None and cancel.is_set():
+            raise TransferCancelled(f"Transfer of {key} was cancelled")
+
+    @staticmethod
+    def _load_journal(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_journal(self, path, journal):
+        with self.lock:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(journal, f)
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _retry(operation, attempts=PART_ATTEMPTS):
+        for attempt in range(attempts):
+            try:
+                return operation()
+            except Exception:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _run_parts(self, parts, send):
+        """Send parts on a thread pool, raising the first failure once the pool drains"""
+        if not parts:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(parts)), thread_name_prefix='transfer-part') as pool:
+            futures = [pool.submit(send, *part) for part in parts]
+        for future in futures:
+            future.result()
+
+    def upload(self, local_path, bucket_name, key, metadata=None, cancel=None):
+        stat = os.stat(local_path)
+        metadata = dict(metadata or {})
+        self._check(cancel, key)
+        if stat.st_size < MULTIPART_THRESHOLD:
+            self.client.upload_file(
+                local_path, bucket_name, key, ExtraArgs={'Metadata': metadata}, Config=self.small_config
+            )
+            return
+        journal_path = self._journal_path('upload', f"{bucket_name}/{key}")
+        with self._journal_lock(journal_path):
+            self._upload_parts(local_path, bucket_name, key, metadata, journal_path, cancel)
+
+    def _upload_parts(self, local_path, bucket_name, key, metadata, journal_path, cancel):
+        started = time.time()
+        stat = os.stat(local_path)
+        journal = self._resume_upload(journal_path, stat, bucket_name, key)
+        if journal is None:
+            part_size = self.part_size(stat.st_size)
+            # the part size lets a later HEAD recompute this object's multipart ETag locally
+            metadata['part-size'] = str(part_size)
+            upload_id = self.client.create_multipart_upload(Bucket=bucket_name, Key=key, Metadata=metadata)['UploadId']
+            journal = {
+                'bucket': bucket_name, 'key': key, 'upload_id': upload_id,
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'part_size': part_size, 'parts': {}
+            }
+            self._save_journal(journal_path, journal)
+
+        part_size = journal['part_size']
+        part_count = -(-stat.st_size // part_size)
+        missing = [
+            (number, (number - 1) * part_size, min(part_size, stat.st_size - (number - 1) * part_size))
+            for number in range(1, part_count + 1) if str(number) not in journal['parts']
+        ]
+        sent = sum(length for _, _, length in missing)
+        if len(missing) < part_count:
+            print(f"Resuming upload of {key}: {part_count - len(missing)}/{part_count} parts already in {bucket_name}")
+
+        def send(number, offset, length):
+            self._check(cancel, key)
+            with open(local_path, 'rb') as f:
+                f.seek(offset)
+                body = f.read(length)
+            digest = hashlib.md5(body)
+            part_started = time.time()
+            response = self._retry(lambda: self.client.upload_part(
+                Bucket=bucket_name, Key=key, UploadId=journal['upload_id'], PartNumber=number,
+                Body=body, ContentMD5=base64.b64encode(digest.digest()).decode()
+            ))
+            self._record_part(length, time.time() - part_started)
+            with self.lock:
+                journal['parts'][str(number)] = {'etag': response['ETag'], 'md5': digest.hexdigest()}
+            self._save_journal(journal_path, journal)
+
+        self._run_parts(missing, send)
+        self._check(cancel, key)
+        self.client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=journal['upload_id'],
+            MultipartUpload={'Parts': [
+                {'PartNumber': int(number), 'ETag': part['etag']}
+                for number, part in sorted(journal['parts'].items(), key=lambda item: int(item[0]))
+            ]}
+        )
+        os.remove(journal_path)
+        if sent:
+            self._record_transfer(sent, time.time() - started)
+
+    def _resume_upload(self, journal_path, stat, bucket_name, key):
+        """Journal of an unfinished upload of this same file, trimmed to the parts S3 still has"""
+        journal = self._load_journal(journal_path)
+        if journal is None:
+            return None
+        if journal['size'] != stat.st_size or journal['mtime_ns'] != stat.st_mtime_ns:
+            # the file changed since the interrupted upload; its parts are useless
+            try:
+                self.client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=journal['upload_id'])
+            except ClientError:
+                pass
+            os.remove(journal_path)
+            return None
+        try:
+            uploaded = {}
+            paginator = self.client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=bucket_name, Key=key, UploadId=journal['upload_id']):
+                for part in page.get('Parts', []):
+                    uploaded[str(part['PartNumber'])] = part['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+            os.remove(journal_path)
+            return None
+        journal['parts'] = {
+            number: part for number, part in journal['parts'].items() if uploaded.get(number) == part['etag']
+        }
+        return journal
+
+    def download(self, bucket_name, key, local_path, cancel=None):
+        self._check(cancel, key)
+        head = self.client.head_object(Bucket=bucket_name, Key=key)
+        if head['ContentLength'] < MULTIPART_THRESHOLD:
+            self.client.download_file(bucket_name, key, local_path, Config=self.small_config)
+            return
+        journal_path = self._journal_path('download', f"{bucket_name}/{key}:{os.path.abspath(local_path)}")
+        with self._journal_lock(journal_path):
+            self._download_parts(bucket_name, key, local_path, head, journal_path, cancel)
+
+    def _download_parts(self, bucket_name, key, local_path, head, journal_path, cancel):
+        started = time.time()
+        size = head['ContentLength']
+        part_path = local_path + '.part'
+        journal = self._resume_download(journal_path, part_path, head)
+        if journal is None:
+            journal = {
+                'key': key, 'part_path': part_path, 'etag': head['ETag'], 'size': size,
+                'part_size': self.part_size(size), 'parts': {}
+            }
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            self._save_journal(journal_path, journal)
+
+        part_size = journal['part_size']
+        part_count = -(-size // part_size)
+        missing = [
+            (number, (number - 1) * part_size, min(part_size, size - (number - 1) * part_size))
+            for number in range(1, part_count + 1) if str(number) not in journal['parts']
+        ]
+        received = sum(length for _, _, length in missing)
+        if len(missing) < part_count:
+            print(f"Resuming download of {key}: {part_count - len(missing)}/{part_count} parts already on disk")
+
+        def fetch(number, offset, length):
+            self._check(cancel, key)
+
+            def get():
+                # IfMatch fails the part if the object is replaced mid-download
+                response = self.client.get_object(
+                    Bucket=bucket_name, Key=key, IfMatch=journal['etag'],
+                    Range=f"bytes={offset}-{offset + length - 1}"
+                )
+                digest = hashlib.md5()
+                with open(part_path, 'r+b') as f:
+                    f.seek(offset)
+                    for chunk in response['Body'].iter_chunks(1024 * 1024):
+                        digest.update(chunk)
+                        f.write(chunk)
+                    if f.tell() != offset + length:
+                        raise IOError(f"Short read for part {number} of {key}")
+                return digest.hexdigest()
+
+            part_started = time.time()
+            md5 = self._retry(get)
+            self._record_part(length, time.time() - part_started)
+            with self.lock:
+                journal['parts'][str(number)] = md5
+            self._save_journal(journal_path, journal)
+
+        self._run_parts(missing, fetch)
+        self._check(cancel, key)
+        os.replace(part_path, local_path)
+        os.remove(journal_path)
+        if received:
+            self._record_transfer(received, time.time() - started)
+
+    def _resume_download(self, journal_path, part_path, head):
+        """Journal of an unfinished download of this same object version, keeping only parts whose bytes still check out"""
+        journal = self._load_journal(journal_path)
+        if journal is None or journal['etag'] != head['ETag'] or not os.path.exists(part_path) \
+                or os.path.getsize(part_path) != head['ContentLength']:
+            return None
+        verified = {}
+        with open(part_path, 'rb') as f:
+            for number, md5 in journal['parts'].items():
+                offset = (int(number) - 1) * journal['part_size']
+                f.seek(offset)
+                remaining = min(journal['part_size'], journal['size'] - offset)
+                digest = hashlib.md5()
+                while remaining:
+                    chunk = f.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                if digest.hexdigest() == md5:
+                    verified[number] = md5
+        journal['parts'] = verified
+        return journal
+
+
+class ProcessedRequestStore:
+    """Request ids this agent has already taken on, kept for PROCESSED_REQUEST_TTL.
+
+    Ids live in memory with the time they were added and are appended to a
+    small log under the state directory, so a restart does not pick up
+    requests that are still 'pending' but already handled. Ids older than
+    the TTL are dropped every quarter TTL, when the log is also rewritten
+    with only the live ids: by then the request has expired and is no
+    longer picked up anyway.
+    """
+    def __init__(self, name, ttl=PROCESSED_REQUEST_TTL, path=None):
+        os.makedirs(STATE_DIR, exist_ok=True)
+        self.path = path or os.path.join(STATE_DIR, f"processed-{name}.log")
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.added = {}
+        self.log = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    added_at, _, request_id = line.rstrip('\n').partition('\t')
+                    if request_id:
+                        self.added[request_id] = float(added_at)
+        self.evict()
+
+    def __contains__(self, request_id):
+        with self.lock:
+            added_at = self.added.get(request_id)
+            return added_at is not None and time.time() - added_at < self.ttl
+
+    def __len__(self):
+        return len(self.added)
+
+    def add(self, request_id):
+        now = time.time()
+        with self.lock:
+            self.added[request_id] = now
+            self.log.write(f"{now:.3f}\t{request_id}\n")
+            self.log.flush()
+        if now - self.last_evicted > self.ttl / 4:
+            self.evict()
+
+    def evict(self):
+        """Drop expired ids and compact the log down to the live ones"""
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            self.added = {request_id: added_at for request_id, added_at in self.added.items() if added_at >= cutoff}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for request_id, added_at in self.added.items():
+                    f.write(f"{added_at:.3f}\t{request_id}\n")
+            os.replace(tmp_path, self.path)
+            if self.log:
+                self.log.close()
+            self.log = open(self.path, 'a')
+            self.last_evicted = time.time()
+
+
+class LeaseManager(threading.Thread):
+    """Claims requests for this agent so several agents can share the request tables.
+
+    A claim is a conditional update that moves a request from 'pending', or
+    from 'in_progress' with an expired lease, to 'in_progress', with this
+    agent as owner and a lease that runs for LEASE_SECONDS. Only one agent's
+    update can succeed. While a transfer runs, this thread extends the lease
+    every HEARTBEAT_INTERVAL. If the agent dies, the lease runs out and
+    another agent reclaims the request. If a heartbeat finds the lease
+    gone, the claim's cancel event is set and the transfer stops at its
+    next part.
+    """
+    def __init__(self, owner=AGENT_ID):
+        super().__init__(name='lease-heartbeat', daemon=True)
+        self.owner = owner
+        self.lock = threading.Lock()
+        self.held = {}  # request_id -> (table, key, cancel event)
+        self.stopped = threading.Event()
+
+    def claim(self, table, item):
+        """The claimed item, or None if another agent got there first"""
+        now = int(time.time())
+        key = {'request_id': item['request_id'], 'timestamp': item['timestamp']}
+        try:
+            response = table.update_item(
+                Key=key,
+                UpdateExpression='SET #st = :in_progress, #owner = :owner, lease_expires = :expires, #ua = :updated_at',
+                ConditionExpression='#st = :pending OR (#st = :in_progress AND lease_expires < :now)',
+                ExpressionAttributeNames={'#st': 'status', '#owner': 'owner', '#ua': 'updated_at'},
+                ExpressionAttributeValues={
+                    ':pending': 'pending',
+                    ':in_progress': 'in_progress',
+                    ':owner': self.owner,
+                    ':expires': now + LEASE_SECONDS,
+                    ':now': now,
+                    ':updated_at': datetime.now(timezone.utc).isoformat()
+                },
+                ReturnValues='ALL_NEW'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+        with self.lock:
+            self.held[item['request_id']] = (table, key, threading.Event())
+        return response['Attributes']
+
+    def cancel_event(self, request_id):
+        """Set once this agent loses the lease on a claimed request"""
+        with self.lock:
+            held = self.held.get(request_id)
+        return held[2] if held else None
+
+    def release(self, request_id):
+        with self.lock:
+            self.held.pop(request_id, None)
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            with self.lock:
+                held = list(self.held.items())
+            for request_id, (table, key, cancel) in held:
+                try:
+                    table.update_item(
+                        Key=key,
+                        UpdateExpression='SET lease_expires = :expires',
+                        ConditionExpression='#owner = :owner AND #st = :in_progress',
+                        ExpressionAttributeNames={'#owner': 'owner', '#st': 'status'},
+                        ExpressionAttributeValues={
+                            ':expires': int(time.time()) + LEASE_SECONDS,
+                            ':owner': self.owner,
+                            ':in_progress': 'in_progress'
+                        }
+                    )
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        print(f"Error extending lease on {request_id}: {e}")
+                        continue
+                    print(f"Lost the lease on {request_id}; cancelling its transfer")
+                    cancel.set()
+                    self.release(request_id)
+
+    def stop(self):
+        self.stopped.set()
+
 
 class UploadHandler:
     def __init__(self):
-        self.processed_requests = set()
-        self.processed_downloads = set()
+        self.processed_requests = ProcessedRequestStore('uploads')
+        self.processed_downloads = ProcessedRequestStore('downloads')
+        # submitted to the scheduler but not yet claimed
+        self.queued = set()
+        # request_id -> Event set once the queued request has been claimed, here or elsewhere
+        self.claim_events = {}
+        self.leases = LeaseManager()
+        self.leases.start()
+        self.inventories = {}
+        self.inventories_lock = threading.Lock()
+        self.transfers = TransferEngine()
+        self.content_index = ContentIndex()
+        self.folder_sync = None  # set by FolderSync when LOCAL_FOLDER is synced
+        self.scheduler = TransferScheduler(
+            runners={'upload': self.run_upload, 'download': self.run_download},
+            workers={'upload': UPLOAD_WORKERS, 'download': DOWNLOAD_WORKERS}
+        )
+
+    def get_inventory(self, bucket_name):
+        # called from the intake, transfer, sync and cost threads; one index per bucket
+        with self.inventories_lock:
+            if bucket_name not in self.inventories:
+                self.inventories[bucket_name] = S3InventoryIndex(bucket_name)
+            return self.inventories[bucket_name]
+        
+    def open_requests(self, table):
+        """Requests from the last hour that are pending or whose lease has expired"""
+        one_hour_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        claimable = Attr('status').eq('pending') | (
+            Attr('status').eq('in_progress') & Attr('lease_expires').lt(int(time.time()))
+        )
         
+        if not REQUEST_QUEUE_INDEX:
+            response = table.scan(FilterExpression=claimable & Attr('timestamp').gt(one_hour_ago))
+            return response.get('Items', [])
+        
+        # only open rows carry queue_shard, so this reads pending and claimed work and nothing else
+        items = []
+        for shard in range(QUEUE_SHARDS):
+            query_kwargs = {
+                'IndexName': REQUEST_QUEUE_INDEX,
+                'KeyConditionExpression': Key('queue_shard').eq(f'open#{shard}') & Key('timestamp').gt(one_hour_ago),
+                'FilterExpression': claimable
+            }
+            while True:
+                response = table.query(**query_kwargs)
+                items.extend(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return items
+
     def check_for_requests(self):
         try:
-            # Get requests from the last hour that are pending
-            one_hour_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
-            
-            response = upload_requests_table.scan(
-                FilterExpression='#st = :status AND #ts > :time',
-                ExpressionAttributeNames={
-                    '#st': 'status',
-                    '#ts': 'timestamp'
-                },
-                ExpressionAttributeValues={
-                    ':status': 'pending',
-                    ':time': one_hour_ago
-                }
-            )
-            
-            for item in response.get('Items', []):
-                request_id = item['request_id']
-                if request_id not in self.processed_requests:
-                    self.process_upload_request(item)
-                    self.processed_requests.add(request_id)
+            for item in self.open_requests(upload_requests_table):
+                self.handle_upload_item(item)
                     
         except Exception as e:
             print(f"Error checking for requests: {e}")
     
+    @staticmethod
+    def is_open_request(item):
+        one_hour_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        if item.get('timestamp', '') <= one_hour_ago:
+            return False
+        if item.get('status') == 'in_progress':
+            return item.get('lease_expires', 0) < time.time()
+        return item.get('status') == 'pending'
+
+    def should_submit(self, item, processed):
+        """Open, not already queued here, and not taken on by this agent unless its lease has since expired"""
+        if not self.is_open_request(item) or item['request_id'] in self.queued:
+            return False
+        return item['status'] == 'in_progress' or item['request_id'] not in processed
+
+    def run_claimed(self, table, processed, process, item):
+        """Claim a queued request and process it; None if another agent claimed it first"""
+        self.queued.discard(item['request_id'])
+        try:
+            claimed = self.leases.claim(table, item)
+        finally:
+            # from here the request's row, not the change feed, says who has it
+            settled = self.claim_events.pop(item['request_id'], None)
+            if settled:
+                settled.set()
+        if claimed is None:
+            return None
+        processed.add(item['request_id'])
+        try:
+            return process(claimed)
+        finally:
+            self.leases.release(item['request_id'])
+
+    def enqueue(self, kind, item, size):
+        """Submit a request to the scheduler; returns an Event set once it has been claimed"""
+        claimed = self.claim_events.setdefault(item['request_id'], threading.Event())
+        self.queued.add(item['request_id'])
+        self.scheduler.submit(kind, item, size)
+        return claimed
+
+    def handle_upload_item(self, item):
+        """Queue an upload request row; returns its claim Event, or None if it was not queued"""
+        if self.should_submit(item, self.processed_requests):
+            local_path = os.path.join(LOCAL_FOLDER, item['file_name'])
+            size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+            return self.enqueue('upload', item, size)
+        return self.claim_events.get(item['request_id'])
+
+    def run_upload(self, item):
+        return self.run_claimed(upload_requests_table, self.processed_requests, self.process_upload_request, item)
+    
     def process_upload_request(self, request):
         file_name = request['file_name']
         bucket_name = request['bucket_name']
@@ -59,16 +1415,44 @@ class UploadHandler:
         if not os.path.exists(local_path):
             print(f"File not found: {local_path}")
             self.update_request_status(request, 'failed', 'File not found')
-            return
+            return False
         
         try:
-            s3.upload_file(local_path, bucket_name, file_name)
+            if self.is_unchanged(local_path, bucket_name, file_name):
+                print(f"{file_name} is unchanged in {bucket_name}, skipping upload")
+                self.update_request_status(request, 'completed')
+                return True
+
+            sha256 = self.content_index.digest(local_path)['sha256']
+            self.transfers.upload(
+                local_path, bucket_name, file_name, metadata={'sha256': sha256},
+                cancel=self.leases.cancel_event(request_id)
+            )
             print(f"Successfully uploaded {file_name} to {bucket_name}")
+            self.get_inventory(bucket_name).record(file_name, os.path.getsize(local_path))
             self.update_request_status(request, 'completed')
+            return True
             
+        except TransferCancelled as e:
+            print(f"{e}: request {request_id} is now owned by another agent")
+            return False
         except Exception as e:
             print(f"Error uploading file: {e}")
             self.update_request_status(request, 'failed', str(e))
+            return False
+    
+    def is_unchanged(self, local_path, bucket_name, key):
+        """Whether the object at this key already holds the local file's bytes, checked with at most one HEAD"""
+        indexed_size = self.get_inventory(bucket_name).size_of(key)
+        if indexed_size is not None and indexed_size != os.path.getsize(local_path):
+            return False
+        try:
+            head = s3.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return self.content_index.matches(local_path, head)
     
     def update_request_status(self, request, status, error_message=None):
         try:
@@ -83,6 +1467,10 @@ class UploadHandler:
                 update_values[':error'] = error_message
                 update_expression += ', error_message = :error'
             
+            # finished requests drop out of the sparse queue index
+            update_expression += ' REMOVE queue_shard, lease_expires'
+            update_values[':owner'] = self.leases.owner
+            
             
             key = {
                 'request_id': request['request_id'],
@@ -94,14 +1482,22 @@ class UploadHandler:
             upload_requests_table.update_item(
                 Key=key,
                 UpdateExpression=update_expression,
+                # only the agent holding the lease may finish the request
+                ConditionExpression='#owner = :owner',
                 ExpressionAttributeNames={
                     '#st': 'status',
-                    '#ua': 'updated_at'
+                    '#ua': 'updated_at',
+                    '#owner': 'owner'
                 },
                 ExpressionAttributeValues=update_values
             )
             print(f"Successfully updated request status to: {status}")
             
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                print(f"Request {request['request_id']} is now owned by another agent, not marking it {status}")
+                return
+            print(f"Error updating request status: {e}")
         except Exception as e:
             print(f"Error updating request status: {e}")
             print(f"Request item keys: {list(request.keys())}")
@@ -115,30 +1511,30 @@ class UploadHandler:
     def check_for_download_requests(self):
         """Check for download requests from Alexa"""
         try:
-            
-            one_hour_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
-            
-            download_requests_table = dynamodb.Table('VirtualAssistant-FileDownloadRequest')
-            response = download_requests_table.scan(
-                FilterExpression='#st = :status AND #ts > :time',
-                ExpressionAttributeNames={
-                    '#st': 'status',
-                    '#ts': 'timestamp'
-                },
-                ExpressionAttributeValues={
-                    ':status': 'pending',
-                    ':time': one_hour_ago
-                }
-            )
-            
-            for item in response.get('Items', []):
-                request_id = item['request_id']
-                if request_id not in self.processed_downloads:
-                    self.process_download_request(item)
-                    self.processed_downloads.add(request_id)
+            for item in self.open_requests(download_requests_table):
+                self.handle_download_item(item)
                     
         except Exception as e:
             print(f"Error checking for download requests: {e}")
+    
+    def handle_download_item(self, item):
+        """Queue a download request row; returns its claim Event, or None if it was not queued"""
+        if self.should_submit(item, self.processed_downloads):
+            return self.enqueue('download', item, self.remote_size(item['bucket_name'], item['file_name']))
+        return self.claim_events.get(item['request_id'])
+
+    def run_download(self, item):
+        return self.run_claimed(download_requests_table, self.processed_downloads, self.process_download_request, item)
+    
+    def remote_size(self, bucket_name, key):
+        """Object size from the inventory index, or a HEAD request when it is not indexed"""
+        size = self.get_inventory(bucket_name).size_of(key)
+        if size is None:
+            try:
+                size = s3.head_object(Bucket=bucket_name, Key=key)['ContentLength']
+            except Exception:
+                size = 0
+        return size
             
     def process_download_request(self, request):
         """Process a download request from S3 to local folder"""
@@ -148,30 +1544,51 @@ class UploadHandler:
         
         local_path = os.path.join(LOCAL_FOLDER, file_name)
         
-        
-        if os.path.exists(local_path):
-            
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_name = f"{file_name}_{timestamp}_backup"
-            backup_path = os.path.join(LOCAL_FOLDER, backup_name)
-            os.rename(local_path, backup_path)
-            print(f"Existing file backed up as: {backup_name}")
+        # the backup rename must not reach folder sync as a local delete
+        if self.folder_sync:
+            self.folder_sync.hold(local_path)
+        backup_path = self.backup_existing(local_path)
+        downloaded = False
         
         try:
            
-            s3.download_file(bucket_name, file_name, local_path)
+            self.transfers.download(
+                bucket_name, file_name, local_path, cancel=self.leases.cancel_event(request_id)
+            )
+            downloaded = True
             print(f"Successfully downloaded {file_name} from {bucket_name} to {local_path}")
             self.update_download_request_status(request, 'completed')
+            return True
             
+        except TransferCancelled as e:
+            print(f"{e}: download request {request_id} is now owned by another agent")
+            return False
         except Exception as e:
             print(f"Error downloading file: {e}")
             self.update_download_request_status(request, 'failed', str(e))
+            return False
+        finally:
+            if not downloaded and backup_path and not os.path.exists(local_path):
+                os.rename(backup_path, local_path)
+                print(f"Restored {file_name} from its backup")
+            if self.folder_sync:
+                self.folder_sync.release(local_path)
+            
+    @staticmethod
+    def backup_existing(local_path):
+        """Move an existing file out of the way as '<name>_<timestamp>_backup'; returns the backup path"""
+        if os.path.exists(local_path):
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            backup_name = f"{os.path.basename(local_path)}_{timestamp}_backup"
+            backup_path = os.path.join(os.path.dirname(local_path), backup_name)
+            os.rename(local_path, backup_path)
+            print(f"Existing file backed up as: {backup_name}")
+            return backup_path
+        return None
             
     def update_download_request_status(self, request, status, error_message=None):
         """Update download request status in DynamoDB"""
         try:
-            download_requests_table = dynamodb.Table('VirtualAssistant-FileDownloadRequest')
-            
             update_values = {
                 ':status': status,
                 ':updated_at': datetime.now(timezone.utc).isoformat()
@@ -183,6 +1600,10 @@ class UploadHandler:
                 update_values[':error'] = error_message
                 update_expression += ', error_message = :error'
             
+            # finished requests drop out of the sparse queue index
+            update_expression += ' REMOVE queue_shard, lease_expires'
+            update_values[':owner'] = self.leases.owner
+            
             key = {
                 'request_id': request['request_id'],
                 'timestamp': request['timestamp']
@@ -191,14 +1612,21 @@ class UploadHandler:
             download_requests_table.update_item(
                 Key=key,
                 UpdateExpression=update_expression,
+                ConditionExpression='#owner = :owner',
                 ExpressionAttributeNames={
                     '#st': 'status',
-                    '#ua': 'updated_at'
+                    '#ua': 'updated_at',
+                    '#owner': 'owner'
                 },
                 ExpressionAttributeValues=update_values
             )
             print(f"Successfully updated download request status to: {status}")
             
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                print(f"Download request {request['request_id']} is now owned by another agent, not marking it {status}")
+                return
+            print(f"Error updating download request status: {e}")
         except Exception as e:
             print(f"Error updating download request status: {e}")
             
@@ -213,21 +1641,13 @@ class UploadHandler:
                 
                 try:
                     
-                    paginator = s3.get_paginator('list_objects_v2')
-                    pages = paginator.paginate(Bucket=bucket_name)
-                    
-                    total_size = 0
-                    object_count = 0
-                    storage_classes = {}
+                    index = self.get_inventory(bucket_name)
+                    index.sync()
+                    summary = index.summary()
                     
-                    for page in pages:
-                        for obj in page.get('Contents', []):
-                            object_count += 1
-                            total_size += obj['Size']
-                            
-                            
-                            storage_class = obj.get('StorageClass', 'STANDARD')
-                            storage_classes[storage_class] = storage_classes.get(storage_class, 0) + 1
+                    total_size = summary['total_size']
+                    object_count = summary['object_count']
+                    storage_classes = summary['storage_classes']
                     
                     
                     total_size_decimal = Decimal(str(total_size))
@@ -243,7 +1663,9 @@ class UploadHandler:
                             'total_size_bytes': total_size_decimal,  
                             'object_count': object_count,  
                             'storage_classes': storage_classes,
-                            'size_gb': size_gb_decimal  
+                            'size_gb': size_gb_decimal,
+                            'old_objects': summary['old_objects'],
+                            'large_objects': summary['large_objects']
                         }
                     )
                     
@@ -256,30 +1678,459 @@ class UploadHandler:
             print(f"Error monitoring cost metrics: {e}")
             
 
+class CostMetricsWorker(threading.Thread):
+    """Runs monitor_cost_metrics on its own thread so bucket listings never stall request intake"""
+    def __init__(self, upload_handler, interval=COST_METRICS_INTERVAL):
+        super().__init__(name='cost-metrics', daemon=True)
+        self.upload_handler = upload_handler
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            self.upload_handler.monitor_cost_metrics()
+            print(f"Cost metrics run took {time.time() - started:.1f}s")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+class FolderSync(threading.Thread):
+    """Keeps LOCAL_FOLDER and a bucket prefix in step in both directions.
+
+    A SQLite manifest records each file as it was when both sides last
+    agreed: the local size and mtime, and the object's ETag. Settled folder
+    events from the EventCoalescer mark paths dirty, and so do keys under
+    the prefix that the bucket's S3InventoryIndex finds changed. The index
+    is refreshed every SYNC_RECONCILE_INTERVAL: new keys show up at once,
+    edits and deletes made directly in S3 with its daily full listing. Dirty
+    paths are handled in batches, with one HEAD per path. Only at startup is
+    the whole folder stat'ed and the prefix listed, to catch changes made
+    while the agent was down.
+
+    Either way, each path gets a three-way comparison against the manifest,
+    and only sides that changed are copied, through the transfer scheduler.
+    A path changed on both sides keeps the S3 copy, and the local copy is
+    backed up with the same rename used for download requests. Deleting a
+    file on one side deletes it on the other, unless the other side has
+    also changed.
+    """
+    def __init__(self, upload_handler, bucket_name, prefix='', path=None):
+        super().__init__(name='folder-sync', daemon=True)
+        self.upload_handler = upload_handler
+        self.bucket_name = bucket_name
+        self.prefix = prefix if not prefix or prefix.endswith('/') else prefix + '/'
+        sync_dir = os.path.join(STATE_DIR, 'sync')
+        os.makedirs(sync_dir, exist_ok=True)
+        name = hashlib.sha1(f"{LOCAL_FOLDER}:{bucket_name}/{self.prefix}".encode()).hexdigest()[:16]
+        self.path = path or os.path.join(sync_dir, f"{name}.sqlite3")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                rel TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                etag TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.dirty = set()
+        self.in_flight = set()
+        # paths a download request is rewriting; they count as in flight until released
+        self.held = Counter()
+        self.reconciled = False
+        self.last_reconcile = 0
+        self.last_refresh = 0
+        self.stopped = threading.Event()
+        self.index = upload_handler.get_inventory(bucket_name)
+        self.index.add_listener(self.prefix, self.remote_changed)
+        upload_handler.scheduler.add_pool('sync', self.run_job, SYNC_WORKERS)
+        upload_handler.folder_sync = self
+
+    @staticmethod
+    def _rel(local_path):
+        return os.path.relpath(local_path, LOCAL_FOLDER).replace(os.sep, '/')
+
+    def mark(self, local_path):
+        """Note a local change reported by watchdog"""
+        rel = self._rel(local_path)
+        if rel.startswith('..') or self._ignored(rel):
+            return
+        with self.lock:
+            self.dirty.add(rel)
+
+    def hold(self, local_path):
+        """Keep sync off a path while the agent backs it up and downloads over it"""
+        with self.lock:
+            self.held[self._rel(local_path)] += 1
+
+    def release(self, local_path):
+        """End a hold; the path is compared again once its events have settled"""
+        rel = self._rel(local_path)
+        with self.lock:
+            self.held[rel] -= 1
+            if self.held[rel] <= 0:
+                del self.held[rel]
+            self.dirty.add(rel)
+
+    def _busy(self):
+        # callers hold self.lock
+        return self.in_flight | self.held.keys()
+
+    def remote_changed(self, keys):
+        """Note keys under the prefix that an inventory listing found added, changed or removed"""
+        rels = [key[len(self.prefix):] for key in keys]
+        rels = [rel for rel in rels if rel and not rel.endswith('/') and not self._ignored(rel)]
+        with self.lock:
+            self.dirty.update(rels)
+
+    def _ignored(self, rel):
+        if rel.endswith('.part') or BACKUP_NAME.search(rel):
+            return True
+        # boto3 downloads into '<name>.<random>' next to the target before renaming it
+        with self.lock:
+            return any(rel.startswith(busy + '.') for busy in self._busy())
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                if not self.reconciled:
+                    if time.time() - self.last_reconcile >= SYNC_RECONCILE_INTERVAL:
+                        self.reconcile()
+                elif time.time() - self.last_refresh >= SYNC_RECONCILE_INTERVAL:
+                    # changed keys come back through remote_changed; the cost metrics
+                    # worker runs the daily full listing, which reports edits and deletes
+                    if self.index.refresh(blocking=False):
+                        self.last_refresh = time.time()
+                    elif self.dirty:
+                        self.sync_dirty()
+                elif self.dirty:
+                    self.sync_dirty()
+            except Exception as e:
+                print(f"Error syncing {LOCAL_FOLDER} with {self.bucket_name}/{self.prefix}: {e}")
+            self.stopped.wait(1)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _base(self, rel):
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime_ns, etag FROM files WHERE rel = ?', (rel,)).fetchone()
+        return {'size': row[0], 'mtime_ns': row[1], 'etag': row[2]} if row else None
+
+    def _local(self, rel):
+        try:
+            stat = os.stat(os.path.join(LOCAL_FOLDER, rel))
+        except FileNotFoundError:
+            return None
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _remote(self, rel):
+        try:
+            head = s3.head_object(Bucket=self.bucket_name, Key=self.prefix + rel)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {'size': head['ContentLength'], 'etag': head['ETag'], 'metadata': head.get('Metadata', {})}
+
+    def _local_files(self):
+        files = {}
+        for root, _, names in os.walk(LOCAL_FOLDER):
+            for name in names:
+                rel = os.path.relpath(os.path.join(root, name), LOCAL_FOLDER).replace(os.sep, '/')
+                if not self._ignored(rel):
+                    local = self._local(rel)
+                    if local:
+                        files[rel] = local
+        return files
+
+    def _remote_files(self):
+        files = {}
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                rel = obj['Key'][len(self.prefix):]
+                if rel and not rel.endswith('/'):
+                    files[rel] = {'size': obj['Size'], 'etag': obj['ETag']}
+        return files
+
+    def sync_dirty(self):
+        if not os.path.isdir(LOCAL_FOLDER):
+            return
+        with self.lock:
+            batch = self.dirty - self._busy()
+            self.dirty -= batch
+        for rel in batch:
+            self.apply(rel, self._local(rel), self._remote(rel))
+
+    def reconcile(self):
+        """Compare the whole folder with the whole prefix; run once at startup"""
+        self.last_reconcile = time.time()
+        if not os.path.isdir(LOCAL_FOLDER):
+            # an unmounted folder must not look like every file was deleted
+            print(f"{LOCAL_FOLDER} is missing, skipping sync")
+            return
+        local_files = self._local_files()
+        remote_files = self._remote_files()
+        with self.lock:
+            known = [row[0] for row in self.db.execute('SELECT rel FROM files')]
+            self.dirty.clear()
+            in_flight = self._busy()
+        for rel in set(local_files) | set(remote_files) | set(known):
+            if rel not in in_flight and not self._ignored(rel):
+                self.apply(rel, local_files.get(rel), remote_files.get(rel))
+        self.reconciled = True
+        self.last_refresh = time.time()
+
+    def apply(self, rel, local, remote):
+        """Three-way compare one path against the manifest and act on the side that changed"""
+        base = self._base(rel)
+        local_changed = local is None if base else local is not None
+        if base and local:
+            local_changed = (local['size'], local['mtime_ns']) != (base['size'], base['mtime_ns'])
+        remote_changed = remote is None if base else remote is not None
+        if base and remote:
+            remote_changed = remote['etag'] != base['etag']
+
+        if not local_changed and not remote_changed:
+            return
+        if not local and not remote:
+            self._forget(rel)
+        elif local_changed and not remote_changed:
+            if local:
+                self._submit('upload', rel, local['size'])
+            else:
+                s3.delete_object(Bucket=self.bucket_name, Key=self.prefix + rel)
+                print(f"Sync: deleted {self.prefix + rel} from {self.bucket_name}")
+                self._forget(rel)
+        elif remote_changed and not local_changed:
+            if remote:
+                self._submit('download', rel, remote['size'], remote['etag'])
+            else:
+                os.remove(os.path.join(LOCAL_FOLDER, rel))
+                print(f"Sync: deleted {rel} locally")
+                self._forget(rel)
+        elif local and remote:
+            # changed on both sides: done already if the bytes are the same, otherwise S3 wins
+            local_path = os.path.join(LOCAL_FOLDER, rel)
+            head = {'ContentLength': remote['size'], 'ETag': remote['etag'], 'Metadata': remote.get('metadata', {})}
+            if self.upload_handler.content_index.matches(local_path, head):
+                self._remember(rel, remote['etag'])
+            else:
+                print(f"Sync conflict on {rel}")
+                self.upload_handler.backup_existing(local_path)
+                self._submit('download', rel, remote['size'], remote['etag'])
+        elif local:
+            self._submit('upload', rel, local['size'])
+        else:
+            self._submit('download', rel, remote['size'], remote['etag'])
+
+    def _submit(self, action, rel, size, etag=None):
+        with self.lock:
+            self.in_flight.add(rel)
+        job = {'request_id': f'sync:{rel}', 'bucket_name': self.bucket_name, 'action': action, 'rel': rel, 'etag': etag}
+        self.upload_handler.scheduler.submit('sync', job, size)
+
+    def run_job(self, job):
+        rel = job['rel']
+        local_path = os.path.join(LOCAL_FOLDER, rel)
+        key = self.prefix + rel
+        try:
+            if job['action'] == 'upload':
+                stat = os.stat(local_path)
+                local = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                if not self.upload_handler.is_unchanged(local_path, self.bucket_name, key):
+                    sha256 = self.upload_handler.content_index.digest(local_path)['sha256']
+                    self.upload_handler.transfers.upload(local_path, self.bucket_name, key, metadata={'sha256': sha256})
+                    self.upload_handler.get_inventory(self.bucket_name).record(key, stat.st_size)
+                    print(f"Sync: uploaded {rel} to {self.bucket_name}/{key}")
+                # remember the stat from before the upload, so a write made mid-upload is sent next pass
+                self._remember(rel, s3.head_object(Bucket=self.bucket_name, Key=key)['ETag'], local)
+            else:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                self.upload_handler.transfers.download(self.bucket_name, key, local_path)
+                print(f"Sync: downloaded {self.bucket_name}/{key} to {rel}")
+                self._remember(rel, job['etag'])
+            return True
+        except Exception as e:
+            print(f"Sync error on {rel}: {e}")
+            return False
+        finally:
+            with self.lock:
+                self.in_flight.discard(rel)
+
+    def _remember(self, rel, etag, local=None):
+        local = local or self._local(rel)
+        if local is None:
+            return
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO files (rel, size, mtime_ns, etag) VALUES (?, ?, ?, ?)',
+                (rel, local['size'], local['mtime_ns'], etag)
+            )
+
+    def _forget(self, rel):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM files WHERE rel = ?', (rel,))
+
+
+class EventCoalescer(threading.Thread):
+    """Turns bursts of watchdog events into one callback per settled batch.
+
+    Events only record the path. Once no event has arrived for
+    EVENT_DEBOUNCE_WINDOW, every pending path is stat'ed. A path is settled
+    when it has been closed after writing, is gone, or has kept the same
+    size and mtime since the previous check. Settled paths are handed to
+    on_batch together. Paths still being written wait for the next check,
+    so a half-copied file is never acted on.
+    """
+    def __init__(self, on_batch, window=EVENT_DEBOUNCE_WINDOW):
+        super().__init__(name='event-coalescer', daemon=True)
+        self.on_batch = on_batch
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> (size, mtime_ns) at the last check, None before the first
+        self.closed = set()
+        self.last_event = 0
+        self.stopped = threading.Event()
+
+    def add(self, path, closed=False):
+        with self.lock:
+            self.pending[path] = None
+            if closed:
+                self.closed.add(path)
+            else:
+                self.closed.discard(path)
+            self.last_event = time.time()
+
+    def run(self):
+        while not self.stopped.wait(self.window / 2):
+            if self.pending and time.time() - self.last_event >= self.window:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error handling folder events: {e}")
+
+    def flush(self):
+        settled = []
+        with self.lock:
+            for path, seen in list(self.pending.items()):
+                try:
+                    stat = os.stat(path)
+                    current = (stat.st_size, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    current = 'missing'
+                if current == 'missing' or path in self.closed or current == seen:
+                    settled.append(path)
+                    del self.pending[path]
+                    self.closed.discard(path)
+                else:
+                    self.pending[path] = current
+        if settled:
+            self.on_batch(settled)
+
+    def stop(self):
+        self.stopped.set()
+
+
 class FolderMonitor(FileSystemEventHandler):
-    def __init__(self, upload_handler):
+    """Feeds file events to an EventCoalescer; each settled batch runs one intake pass when polling"""
+    def __init__(self, upload_handler, folder_sync=None):
         self.upload_handler = upload_handler
+        self.folder_sync = folder_sync
+        self.coalescer = EventCoalescer(self.on_settled)
+        self.coalescer.start()
     
     def on_created(self, event):
         if not event.is_directory:
-            print(f"New file detected: {event.src_path}")
+            self.coalescer.add(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.coalescer.add(event.src_path)
+
+    def on_deleted(self, event):
+        if self.folder_sync and not event.is_directory:
+            self.coalescer.add(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            if self.folder_sync:
+                self.coalescer.add(event.src_path)
+            self.coalescer.add(event.dest_path)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.coalescer.add(event.src_path, closed=True)
+
+    def on_settled(self, paths):
+        print(f"{len(paths)} file change(s) detected")
+        if self.folder_sync:
+            for path in paths:
+                self.folder_sync.mark(path)
+        # in stream mode new requests arrive through the change feed; polling here would duplicate it
+        if INTAKE_MODE != 'stream':
             self.upload_handler.check_for_requests()
 
+    def stop(self):
+        self.coalescer.stop()
+
+def import_inventory(bucket_name, manifest_path):
+    index = S3InventoryIndex(bucket_name)
+    index.import_inventory_manifest(manifest_path)
+    print(f"Imported inventory for {bucket_name}: {index.summary()}")
+
+def run_stream_intake(upload_handler):
+    """Pick requests up from the tables' change feeds; never returns"""
+    intakes = [
+        ChangeFeedIntake('VirtualAssistant-FileUploadRequest', upload_handler.handle_upload_item),
+        ChangeFeedIntake('VirtualAssistant-FileDownloadRequest', upload_handler.handle_download_item)
+    ]
+    print("Reading upload/download requests from DynamoDB Streams")
+    last_reclaim = time.time()
+    while True:
+        if time.time() - last_reclaim >= LEASE_SECONDS:
+            # the streams only carry new requests; expired leases are found by querying
+            upload_handler.check_for_requests()
+            upload_handler.check_for_download_requests()
+            last_reclaim = time.time()
+        seen = 0
+        for intake in intakes:
+            try:
+                seen += intake.poll()
+            except Exception as e:
+                print(f"Error reading {intake.table_name} stream: {e}")
+        if not seen:
+            time.sleep(STREAM_POLL_INTERVAL)
+
 def main():
     upload_handler = UploadHandler()
     
+    folder_sync = None
+    if SYNC_BUCKET:
+        folder_sync = FolderSync(upload_handler, SYNC_BUCKET, SYNC_PREFIX)
+        folder_sync.start()
+        print(f"Syncing {LOCAL_FOLDER} with s3://{SYNC_BUCKET}/{folder_sync.prefix}")
+    
     # Set up folder monitoring
-    event_handler = FolderMonitor(upload_handler)
+    event_handler = FolderMonitor(upload_handler, folder_sync)
     observer = Observer()
-    observer.schedule(event_handler, LOCAL_FOLDER, recursive=False)
+    observer.schedule(event_handler, LOCAL_FOLDER, recursive=bool(folder_sync))
     observer.start()
     
+    cost_metrics_worker = CostMetricsWorker(upload_handler)
+    cost_metrics_worker.start()
+    
     print(f"Monitoring {LOCAL_FOLDER} for new files...")
     print("Also checking for download requests and monitoring costs...")
     print("Press Ctrl+C to stop")
     
     try:
-        loop_counter = 0
+        if INTAKE_MODE == 'stream':
+            run_stream_intake(upload_handler)
         while True:
             
             upload_handler.check_for_requests()
@@ -287,17 +2138,25 @@ def main():
               
             upload_handler.check_for_download_requests()
             
+            if upload_handler.scheduler.busy():
+                print(f"Transfers: {upload_handler.scheduler.report()}")
             
-            if loop_counter % 60 == 0:
-                upload_handler.monitor_cost_metrics()
-            
-            loop_counter += 1
             time.sleep(POLL_INTERVAL)
             
     except KeyboardInterrupt:
         observer.stop()
+        event_handler.stop()
+        cost_metrics_worker.stop()
+        upload_handler.leases.stop()
+        if folder_sync:
+            folder_sync.stop()
     
     observer.join()
 
 if __name__ == "__main__":
-    main()
+    import sys
+    if len(sys.argv) == 4 and sys.argv[1] == 'import-inventory':
+        # python local_upload.py import-inventory <bucket> <manifest.json | s3://bucket/manifest.json>
+        import_inventory(sys.argv[2], sys.argv[3])
+    else:
+        main()